@@ -0,0 +1,312 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+from csv_cli import BabyNamesDatabase
+
+# ----------------------------------------------------------- #
+# SYNTHETIC DATA BENCHMARK FOR THE CSV DATABASE
+# ----------------------------------------------------------- #
+# Builds a baby-names dataset of the requested size, loads it into a fresh data
+# directory and runs a fixed, seeded workload mix through BabyNamesDatabase without any
+# input() prompts:
+#   - batch loads (the full dataset, then a small incremental file)
+#   - point edits (inserts of existing and new names, deletes, updates)
+#   - representative FIND queries (sum, top N, multi-name, a-z, M/F, group, order by)
+#   - startup: fresh interpreters importing csv_cli and running one small sum query,
+#     as every CLI invocation does
+# Each size runs in its own process so peak RSS is measured per size. The report is JSON:
+# latency percentiles (ms) and throughput per operation, load rates and peak RSS.
+#
+#   python src/csv_bench.py --rows 1000000 --output bench.json
+
+DEFAULT_ROWS = [1000000, 10000000, 50000000]
+FIRST_YEAR, LAST_YEAR = 1880, 2014
+ZIPF_EXPONENT = 1.07     # name popularity ~ 1 / rank ** ZIPF_EXPONENT
+ROWS_PER_NAME = 250      # vocabulary size = rows / ROWS_PER_NAME (at least 1000 names)
+GENERATE_CHUNK = 1000000
+SYLLABLES = ["a", "an", "bel", "ca", "da", "el", "fi", "ga", "ha", "is", "ja", "ka", "li", "ma", "na",
+             "ol", "pa", "qui", "ra", "sa", "ta", "u", "vi", "wen", "xa", "ya", "zo", "ri", "le", "no"]
+
+# Point edits per run, and how often each query shape is repeated
+WORKLOAD = {"inserts": 2000, "new_name_share": 0.2, "deletes": 200, "updates": 200,
+            "incremental_rows": 100000, "query_repeats": 5, "startup_runs": 10}
+
+# Run in a fresh interpreter by measure_startup(): import time, the time of one query
+# (argv: data directory, query) and whether it had to import pandas
+STARTUP_PROBE = '''
+import sys, json, time
+start = time.perf_counter()
+from csv_cli import BabyNamesDatabase
+imported = time.perf_counter()
+database = BabyNamesDatabase(sys.argv[1] + "/dummy.csv")
+database.run_query(sys.argv[1], sys.argv[2])
+database.close()
+print(json.dumps({"import": imported - start, "query": time.perf_counter() - imported,
+                  "pandas_imported": "pandas" in sys.modules}))
+'''
+
+# {name}, {name2}, {name3} are popular names and {letter} the first letter of {name}
+QUERIES = {
+    "sum": "FIND {name} M 2000-2014 CONDITION sum",
+    "count": "FIND {name} M/F 1880-2014 CONDITION count",
+    "top_n": "FIND {letter} F 2010 CONDITION top 10 ORDER desc BY Count RETURN all",
+    "multi_name": "FIND [{name},{name2},{name3}] M/F 1950-2000 CONDITION count",
+    "a_z_count": "FIND a-z M/F 1880-2014 CONDITION count",
+    "a_z_sum_one_year": "FIND a-z M/F 2014 CONDITION sum",
+    "group_gender": "FIND {name} M/F 1880-2014 CONDITION group Gender ORDER desc BY Count RETURN all",
+    "group_name": "FIND {letter} M/F 2000-2005 CONDITION group Name ORDER desc BY Count RETURN all",
+    "order_by": "FIND {letter} M 1990-1995 CONDITION None None ORDER [asc,desc] BY [Name,Count] RETURN [Name,Year,Count]",
+}
+
+# ----------------------------------------------------------- #
+# DATASET
+# ----------------------------------------------------------- #
+def make_names(count, rng):
+    names = set()
+    while len(names) < count:
+        parts = rng.choice(SYLLABLES, size=rng.integers(2, 5))
+        names.add(''.join(parts).capitalize())
+    names = sorted(names)
+    rng.shuffle(names)  # popularity rank must not follow alphabetical order
+    return np.array(names)
+
+# Write a CSV of rows records (Id,Name,Year,Gender,Count) with Zipf-distributed names.
+# Returns the vocabulary (most popular first) and a sample of written (Name, Year, Gender).
+def generate_dataset(csv_path, rows, rng, first_id=0):
+    names = make_names(max(1000, rows // ROWS_PER_NAME), rng)
+    weights = 1.0 / np.arange(1, len(names) + 1) ** ZIPF_EXPONENT
+    weights /= weights.sum()
+    name_genders = np.where(rng.random(len(names)) < 0.5, 'M', 'F')
+    years = np.arange(FIRST_YEAR, LAST_YEAR + 1)
+    year_weights = (years - FIRST_YEAR + 10).astype(float)  # more births in later years
+    year_weights /= year_weights.sum()
+
+    sample = None
+    written = 0
+    with open(csv_path, 'w', newline='') as csv_file:
+        while written < rows:
+            size = min(GENERATE_CHUNK, rows - written)
+            picks = rng.choice(len(names), size=size, p=weights)
+            genders = name_genders[picks].copy()
+            flip = rng.random(size) < 0.05
+            genders[flip] = np.where(genders[flip] == 'M', 'F', 'M')
+            chunk = pd.DataFrame({
+                "Id": np.arange(first_id + written, first_id + written + size),
+                "Name": names[picks],
+                "Year": rng.choice(years, size=size, p=year_weights),
+                "Gender": genders,
+                "Count": 5 + np.minimum(rng.zipf(1.8, size=size), 100000),
+            })
+            chunk.to_csv(csv_file, index=False, header=written == 0)
+            if sample is None:
+                sample = chunk.sample(min(len(chunk), 5000), random_state=0)[["Name", "Year", "Gender"]]
+            written += size
+    return names, list(sample.itertuples(index=False, name=None))
+
+# ----------------------------------------------------------- #
+# MEASUREMENT
+# ----------------------------------------------------------- #
+def summarize(samples):
+    samples = np.asarray(samples) * 1000.0
+    total = samples.sum() / 1000.0
+    return {
+        "ops": int(len(samples)),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p90_ms": round(float(np.percentile(samples, 90)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "max_ms": round(float(samples.max()), 3),
+        "ops_per_sec": round(len(samples) / total, 1) if total > 0 else None,
+    }
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    return round(resource.getrusage(who).ru_maxrss / 1024.0, 1)  # ru_maxrss is in KiB on Linux
+
+# ----------------------------------------------------------- #
+# WORKLOAD
+# ----------------------------------------------------------- #
+def run_size(rows, workdir, seed):
+    rng = np.random.default_rng(seed)
+    directory = os.path.join(workdir, f"data_{rows}")
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    result = {"rows": rows}
+
+    source_path = os.path.join(workdir, f"names_{rows}.csv")
+    start = time.perf_counter()
+    names, existing = generate_dataset(source_path, rows, rng)
+    result["generate_seconds"] = round(time.perf_counter() - start, 3)
+
+    database = BabyNamesDatabase(os.path.join(directory, "dummy.csv"))
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    try:
+        # Batch loads: the whole dataset into an empty directory, then a small increment
+        with quiet:
+            seconds = timed(database.load_batch_data, directory, source_path)
+        result["batch_load"] = {"seconds": round(seconds, 3), "rows_per_sec": round(rows / seconds, 1)}
+
+        increment_path = os.path.join(workdir, f"increment_{rows}.csv")
+        increment_rows = min(WORKLOAD["incremental_rows"], rows)
+        generate_dataset(increment_path, increment_rows, rng, first_id=rows)
+        with quiet:
+            seconds = timed(database.load_batch_data, directory, increment_path)
+        result["batch_load_incremental"] = {"seconds": round(seconds, 3),
+                                            "rows_per_sec": round(increment_rows / seconds, 1)}
+        os.remove(increment_path)
+
+        # Point edits
+        popular = names[:1000]
+        inserts, deletes, updates = [], [], []
+        with quiet:
+            for i in range(WORKLOAD["inserts"]):
+                if rng.random() < WORKLOAD["new_name_share"]:
+                    name = f"Bench{seed}n{i}"
+                else:
+                    name = str(rng.choice(popular))
+                year = str(rng.integers(FIRST_YEAR, LAST_YEAR + 1))
+                inserts.append(timed(database.insert, directory, name, str(rng.choice(['M', 'F'])), year))
+            checkpoint_seconds = timed(database.checkpoint)
+
+            picks = rng.permutation(len(existing))
+            for i in picks[:WORKLOAD["deletes"]]:
+                name, year, gender = existing[i]
+                deletes.append(timed(database.delete, directory, name, str(year), gender, delete_count=1))
+            for i in picks[WORKLOAD["deletes"]:WORKLOAD["deletes"] + WORKLOAD["updates"]]:
+                name, year, gender = existing[i]
+                updates.append(timed(database.update, directory, name, str(year), gender,
+                                     new_count=int(rng.integers(5, 5000))))
+        result["insert"] = summarize(inserts)
+        result["insert_checkpoint_seconds"] = round(checkpoint_seconds, 3)
+        result["delete"] = summarize(deletes)
+        result["update"] = summarize(updates)
+
+        # Queries: the first run of each shape is cold, the rest hit the warm caches
+        result["queries"] = {}
+        for label, template in QUERIES.items():
+            name, name2, name3 = (str(name) for name in names[:3])
+            query = template.format(name=name, name2=name2, name3=name3, letter=name[0].lower())
+            samples = []
+            with quiet:
+                for _ in range(WORKLOAD["query_repeats"]):
+                    samples.append(timed(run_query, database, directory, query))
+            result["queries"][label] = dict(summarize(samples), query=query, cold_ms=round(samples[0] * 1000.0, 3))
+
+        database.checkpoint()
+        result["startup"] = measure_startup(directory, QUERIES["sum"].format(name=str(names[0])))
+    finally:
+        database.close()
+        os.remove(source_path)
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    result["peak_worker_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return result
+
+# Run a query the way the CLI does: the first rows are formatted, the rest only counted
+def run_query(database, directory, query):
+    data = database.run_query(directory, query)
+    if hasattr(data, 'head'):
+        data.head(25).to_string(index=False)
+        len(data)
+        data.close()
+
+# Whole-process time of a CLI-like invocation running one query, split into the import
+# of csv_cli and the query itself
+def measure_startup(directory, query):
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                              environment.get("PYTHONPATH")]))
+    processes, imports, queries = [], [], []
+    for _ in range(WORKLOAD["startup_runs"]):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", STARTUP_PROBE, directory, query], capture_output=True,
+                                text=True, env=environment, check=True).stdout
+        processes.append(time.perf_counter() - start)
+        probe = json.loads(output.splitlines()[-1])
+        imports.append(probe["import"])
+        queries.append(probe["query"])
+    return {"process": summarize(processes), "import": summarize(imports), "query": summarize(queries),
+            "query_text": query, "pandas_imported": probe["pandas_imported"]}
+
+def _run_size_in_child(rows, workdir, seed, connection):
+    try:
+        connection.send(run_size(rows, workdir, seed))
+    except Exception as e:
+        connection.send({"rows": rows, "error": repr(e)})
+    finally:
+        connection.close()
+
+# Each size gets a fresh process, so its peak RSS is not inflated by earlier sizes
+def run_isolated(rows, workdir, seed):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_size_in_child, args=(rows, workdir, seed, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"rows": rows, "error": f"benchmark process exited with code {process.exitcode}"}
+    process.join()
+    return result
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic-data benchmark for the baby names CSV database")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS,
+                        help="dataset sizes to benchmark (default: 1M 10M 50M)")
+    parser.add_argument("--workdir", help="directory for generated data (default: a temporary directory)")
+    parser.add_argument("--seed", type=int, default=42, help="seed for the dataset and workload")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="babynames_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        "benchmark": "csv_cli",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "workload": WORKLOAD,
+        "results": [],
+    }
+    try:
+        for rows in args.rows:
+            print(f"Benchmarking {rows:,} rows...", file=sys.stderr)
+            report["results"].append(run_isolated(rows, workdir, args.seed))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,3651 @@
 import os
+import io
+import re
+import sys
+import bz2
 import csv
+import gzip
+import lzma
+import zlib
+import json
+import fcntl
+import bisect
+import time
+import heapq
+import itertools
+import queue
+import pickle
 import string
-import pandas as pd
+import tempfile
+import argparse
+import threading
+import contextlib
+import importlib
+import tracemalloc
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# numpy and pandas are imported on first use. Importing pandas takes most of the CLI's
+# startup time, and inserts, deletes, updates, Display data and the sum/count queries
+# answered from aggregate cubes and the catalog never need either of them.
+class LazyModule:
+    def __init__(self, name, alias):
+        self.name = name
+        self.alias = alias
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.name)
+        globals()[self.alias] = module  # later lookups go straight to the module
+        return getattr(module, attribute)
+
+np = LazyModule('numpy', 'np')
+pd = LazyModule('pandas', 'pd')
+
+FIELDNAMES = ["Id", "Name", "Year", "Gender", "Count"]
+DISPLAY_PAGE_ROWS = 50  # rows per page of Display data (choice #5) unless --limit is given
+
+# Hidden per-chunk metadata files live next to the chunk (e.g. .male_k.csv.idx)
+def sidecar_path(file_path, suffix):
+    return os.path.join(os.path.dirname(file_path), f".{os.path.basename(file_path)}.{suffix}")
+
+# Temporary name a file is written under before os.replace() moves it into place. Readers
+# in different processes may rebuild the same sidecar at once, so it is unique to the
+# writing process and thread.
+def temp_name(path):
+    return f"{path}_{os.getpid()}_{threading.get_ident()}_temp"
+
+# Remove the index, cube, zone map, columnar metadata, compressed copy and cluster index
+# of a chunk that was rewritten
+def drop_sidecars(file_path):
+    for suffix in ("idx", "cube", "zones", "colmeta", "zindex", "zblocks", "cluster", "rows"):
+        if os.path.exists(sidecar_path(file_path, suffix)):
+            os.remove(sidecar_path(file_path, suffix))
+
+# Skip '#' tombstones left behind by in-place edits (see ChunkFile)
+def live_lines(csv_file):
+    for line in csv_file:
+        if not line.startswith('#'):
+            yield line
+
+# ----------------------------------------------------------- #
+# CHUNK FILE: (Name, Year) INDEX + APPEND-AND-PATCH EDITS
+# ----------------------------------------------------------- #
+# Every chunk CSV keeps a persistent sidecar index mapping (Name, Year) to the byte
+# offset of each matching row, so edits (applied in batches by apply_changes) never
+# rewrite the chunk:
+#   - a row whose new text has the same length is patched in place
+#   - otherwise the old row is overwritten with a '#' tombstone of the same length
+#     and the new row is appended to the end of the file
+# The index file is itself append-only ('+' adds a row, '-' kills one, 'h' marks the
+# header) and is replayed when the chunk is first opened. Tombstones are skipped by all
+# readers and removed by compaction once enough of them pile up. When an AggregateCube is
+# attached, every edit also applies its Count/row deltas to the cube, an attached
+# ZoneMap records the chunk's new stat (compaction rebuilds it), an attached
+# CompressedChunk recompresses the blocks the edit touched, and an attached ClusterIndex
+# records the new stat (compaction of a clustered chunk sorts it again).
+class ChunkFile:
+    COMPACT_MIN_DEAD = 1000  # never compact for fewer dead rows than this
+    COMPACT_RATIO = 0.25     # compact once dead rows exceed this share of live rows
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.index_path = sidecar_path(file_path, "idx")
+        self.cube = None  # AggregateCube kept in step with edits, if one exists
+        self.zones = None  # ZoneMap kept in step with edits, if one exists
+        self.compressed = None  # CompressedChunk kept in step with edits, if one exists
+        self.cluster = None  # ClusterIndex of a clustered chunk, if the chunk is clustered
+        self.index_stat = None  # stat of the index file as this object last read or wrote it
+        self.load()
+
+    def _reset(self):
+        self.rows = {}       # (Name, Year) -> list of row offsets
+        self.lengths = {}    # row offset -> row length in bytes
+        self.max_id = -1
+        self.dead_rows = 0
+        self.end_offset = 0  # number of chunk bytes covered by the index
+
+    def load(self):
+        self._reset()
+        if not os.path.exists(self.index_path):
+            self.rebuild()
+            return
+
+        with open(self.index_path, 'r', newline='') as index_file:
+            for entry in csv.reader(index_file):
+                self._apply_entry(entry)
+
+        self.index_stat = self._index_stat()
+        size = os.path.getsize(self.file_path)
+        if size < self.end_offset:
+            # chunk was rewritten behind our back
+            self.rebuild()
+        elif size > self.end_offset:
+            self._index_tail()
+
+    def _index_stat(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    # pick up rows appended to the chunk since the index was last read (e.g. batch loads),
+    # or read the index again if another process edited or rewrote the chunk
+    def refresh(self):
+        if self._index_stat() != self.index_stat:
+            self.load()
+            return
+        size = os.path.getsize(self.file_path)
+        if size > self.end_offset:
+            self._index_tail()
+        elif size < self.end_offset:
+            self.load()
+
+    # Re-index the chunk from scratch; max_id carries Ids of compacted-away rows forward
+    def rebuild(self, max_id=-1):
+        self._reset()
+        entries = self._scan(0)
+        if entries and entries[0][0] == "h":
+            entries[0][3] = max(self.max_id, max_id)
+            self.max_id = entries[0][3]
+        temp_path = temp_name(self.index_path)
+        with open(temp_path, 'w', newline='') as index_file:
+            csv.writer(index_file).writerows(entries)
+        os.replace(temp_path, self.index_path)
+        self.index_stat = self._index_stat()
+
+    def _index_tail(self):
+        self._log(self._scan(self.end_offset))
+
+    # Read chunk lines from offset onwards and index them
+    def _scan(self, offset):
+        entries = []
+        with open(self.file_path, 'rb') as chunk_file:
+            chunk_file.seek(offset)
+            for line in chunk_file:
+                if not line.endswith(b'\n'):
+                    break  # partial trailing row, leave it for the next refresh
+                if offset == 0:
+                    entry = ["h", 0, len(line), "", "", ""]
+                elif line.startswith(b'#'):
+                    entry = ["-", offset, len(line), "", "", ""]
+                else:
+                    record = self._parse_row(line)
+                    entry = ["+", offset, len(line), record["Id"], record["Name"], record["Year"]]
+                self._apply_entry(entry)
+                entries.append(entry)
+                offset += len(line)
+        return entries
+
+    def _apply_entry(self, entry):
+        op, offset, length, row_id, name, year = entry
+        offset, length = int(offset), int(length)
+        if op == "h" and row_id != "":
+            self.max_id = max(self.max_id, int(row_id))
+        elif op == "+":
+            self.rows.setdefault((name, year), []).append(offset)
+            self.lengths[offset] = length
+            self.max_id = max(self.max_id, int(row_id))
+        elif op == "-":
+            if name:
+                self.rows[(name, year)].remove(offset)
+                if not self.rows[(name, year)]:
+                    del self.rows[(name, year)]
+                del self.lengths[offset]
+            self.dead_rows += 1
+        self.end_offset = max(self.end_offset, offset + length)
+
+    def _log(self, entries):
+        if entries:
+            with open(self.index_path, 'a', newline='') as index_file:
+                csv.writer(index_file).writerows(entries)
+            self.index_stat = self._index_stat()
+
+    def _parse_row(self, line):
+        values = next(csv.reader([line.decode('utf-8')]))
+        return dict(zip(FIELDNAMES, values))
+
+    def _format_row(self, record, terminator=b'\r\n'):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='').writerow([record[field] for field in FIELDNAMES])
+        return buffer.getvalue().encode('utf-8') + terminator
+
+    @property
+    def live_rows(self):
+        return len(self.lengths)
+
+    # Return [(offset, record), ...] for every live row with this Name and Year
+    def find(self, name, year):
+        offsets = self.rows.get((name, str(year)), [])
+        matches = []
+        if offsets:
+            with open(self.file_path, 'rb') as chunk_file:
+                for offset in offsets:
+                    chunk_file.seek(offset)
+                    matches.append((offset, self._parse_row(chunk_file.read(self.lengths[offset]))))
+        return matches
+
+    # Apply a batch of row changes in a single pass over the chunk. changes is a list of
+    # (Name, Year, Id, record) where record is the row's new content, or None to delete
+    # it; a row missing from the chunk is appended (with its Id). Applying the same batch
+    # twice leaves the chunk unchanged, which is what write-ahead log replay relies on.
+    # In-place patches come first, then one write of every appended row, then an fsync.
+    # Returns the (record, Count delta, row delta) of every change.
+    def apply_changes(self, changes):
+        cube_current, zones_current = self._cube_current(), self._zones_current()
+        compressed_current = self.compressed is not None and self.compressed.is_current()
+        cluster_current = self.cluster is not None and self.cluster.is_current()
+        entries, appended, cube_deltas = [], [], []
+        patched = []  # offsets of rows rewritten in place
+
+        with open(self.file_path, 'r+b') as chunk_file:
+            for name, year, row_id, record in changes:
+                offset, old_line, old_record = None, None, None
+                for candidate in self.rows.get((name, str(year)), []):
+                    chunk_file.seek(candidate)
+                    line = chunk_file.read(self.lengths[candidate])
+                    row = self._parse_row(line)
+                    if row["Id"] == str(row_id):
+                        offset, old_line, old_record = candidate, line, row
+                        break
+
+                if offset is None:
+                    if record is not None:
+                        appended.append(record)
+                        cube_deltas.append((record, int(record["Count"]), 1))
+                    continue
+
+                length = len(old_line)
+                terminator = old_line[len(old_line.rstrip(b'\r\n')):]
+                if record is not None:
+                    cube_deltas.append((record, int(record["Count"]) - int(old_record["Count"]), 0))
+                    line = self._format_row(record, terminator)
+                    if len(line) == length:
+                        chunk_file.seek(offset)
+                        chunk_file.write(line)
+                        patched.append(offset)
+                        continue
+                    appended.append(record)  # grown row: tombstone it and move it to the end
+                else:
+                    cube_deltas.append((old_record, -int(old_record["Count"]), -1))
+                chunk_file.seek(offset)
+                chunk_file.write(b'#' + b' ' * (length - len(terminator) - 1) + terminator)
+                patched.append(offset)
+                entry = ["-", offset, length, "", name, str(year)]
+                self._apply_entry(entry)
+                entries.append(entry)
+
+            offset = append_offset = self.end_offset
+            lines = []
+            for record in appended:
+                line = self._format_row(record)
+                entry = ["+", offset, len(line), record["Id"], record["Name"], str(record["Year"])]
+                self._apply_entry(entry)
+                entries.append(entry)
+                lines.append(line)
+                offset += len(line)
+            chunk_file.seek(append_offset)
+            chunk_file.write(b''.join(lines))
+            chunk_file.truncate()  # drop any partial row left by an interrupted write
+            chunk_file.flush()
+            os.fsync(chunk_file.fileno())
+        self._log(entries)
+
+        if self.cube is not None:
+            if cube_current:
+                for record, count_delta, rows_delta in cube_deltas:
+                    self.cube.apply(record, count_delta, rows_delta)
+                self.cube.record_stat()
+            else:
+                self.cube.invalidate()
+        self._update_zones(zones_current)
+        if compressed_current:
+            self.compressed.update(patched)
+        if cluster_current:
+            self.cluster.record_stat()  # rows stay in place; appended ones join the tail
+        return cube_deltas
+
+    # Check the cube matches the chunk before an edit, so the edit's deltas can be applied
+    def _cube_current(self):
+        return self.cube is not None and self.cube.is_current()
+
+    # Edits keep the zone ranges a superset of each block, so only the stat needs recording
+    def _zones_current(self):
+        return self.zones is not None and self.zones.is_current()
+
+    def _update_zones(self, zones_current):
+        if zones_current:
+            self.zones.record_stat()
+
+    def maybe_compact(self):
+        if self.dead_rows >= self.COMPACT_MIN_DEAD and self.dead_rows > self.live_rows * self.COMPACT_RATIO:
+            self.compact()
+        elif self.cluster is not None and self.cluster.needs_merge():
+            self.compact()
+
+    # Drop tombstones from the chunk (sorting it again if it is clustered) and rebuild its index
+    def compact(self):
+        cube_current = self._cube_current()
+        temp_path = temp_name(self.file_path)
+        if self.cluster is not None:
+            self.cluster.sort_into(temp_path)
+        else:
+            with open(self.file_path, 'rb') as chunk_file, open(temp_path, 'wb') as temp_file:
+                for line in chunk_file:
+                    if not line.startswith(b'#'):
+                        temp_file.write(line)
+        os.replace(temp_path, self.file_path)
+        self.rebuild(self.max_id)
+        if self.cluster is not None:
+            self.cluster.save()
+
+        # Same rows, new file: the cube only needs the new stat
+        if cube_current:
+            self.cube.record_stat()
+        elif self.cube is not None:
+            self.cube.invalidate()
+
+        # Block byte ranges all moved
+        if self.zones is not None:
+            self.zones.build()
+        if self.compressed is not None:
+            self.compressed.build(self.compressed.codec)
+
+# ----------------------------------------------------------- #
+# COLUMNAR CHUNK FORMAT (READ-OPTIMIZED COPY FOR QUERIES)
+# ----------------------------------------------------------- #
+# A chunk CSV can be converted into typed binary column files stored as hidden sidecars:
+#   .male_k.csv.col.Year.data      int32 per row (Id and Count are int64)
+#   .male_k.csv.col.Name.codes     int32 per row, pointing into the name dictionary
+#   .male_k.csv.col.Name.offsets   int64 start of each distinct name in the heap (+ end)
+#   .male_k.csv.col.Name.heap      utf-8 bytes of the distinct names back to back
+#   .male_k.csv.colmeta            row count plus size/mtime of the CSV it was built from
+# Queries open the columns they need with numpy.memmap, so there is no parse cost. The
+# copy is only used while the CSV is unchanged; re-run the converter after edits.
+class ColumnarChunk:
+    INT_COLUMNS = {"Id": "int64", "Year": "int32", "Count": "int64"}
+    STRING_COLUMNS = ["Name", "Gender"]
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.meta_path = sidecar_path(file_path, "colmeta")
+        self._meta = None
+
+    def column_path(self, column, part):
+        return sidecar_path(self.file_path, f"col.{column}.{part}")
+
+    def _source_stat(self):
+        stat = os.stat(self.file_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            with open(self.meta_path, 'r') as meta_file:
+                self._meta = json.load(meta_file)
+        return self._meta
+
+    # True when columnar files exist and were built from the current CSV contents
+    def is_fresh(self):
+        if not os.path.exists(self.file_path) or not os.path.exists(self.meta_path):
+            return False
+        size, mtime_ns = self._source_stat()
+        return self.meta["source_size"] == size and self.meta["source_mtime_ns"] == mtime_ns
+
+    def convert(self):
+        size, mtime_ns = self._source_stat()
+        data = pd.read_csv(self.file_path, comment='#', dtype={"Name": str, "Gender": str})
+
+        for column, dtype in self.INT_COLUMNS.items():
+            data[column].to_numpy(dtype=dtype).tofile(self.column_path(column, "data"))
+
+        for column in self.STRING_COLUMNS:
+            codes, uniques = pd.factorize(data[column])
+            encoded = [value.encode('utf-8') for value in uniques]
+            offsets = np.zeros(len(encoded) + 1, dtype="int64")
+            offsets[1:] = np.cumsum([len(value) for value in encoded])
+            codes.astype("int32").tofile(self.column_path(column, "codes"))
+            offsets.tofile(self.column_path(column, "offsets"))
+            with open(self.column_path(column, "heap"), 'wb') as heap_file:
+                heap_file.write(b''.join(encoded))
+
+        # Written last so a half-finished conversion is never considered fresh
+        self._meta = {"rows": len(data), "source_size": size, "source_mtime_ns": mtime_ns}
+        with open(self.meta_path, 'w') as meta_file:
+            json.dump(self._meta, meta_file)
+
+    # Size of the column files a scan of columns memory-maps
+    def column_bytes(self, columns):
+        paths = [self.column_path(column, part) for column in columns for part in ("data", "codes", "offsets", "heap")]
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+    def _memmap(self, path, dtype, length):
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(length,))
+
+    def read_column(self, column, rows=slice(None)):
+        if column in self.INT_COLUMNS:
+            data = self._memmap(self.column_path(column, "data"), self.INT_COLUMNS[column], self.meta["rows"])
+            return np.asarray(data[rows])
+        return self.read_dictionary(column)[self.read_codes(column)[rows]]
+
+    def read_codes(self, column):
+        return self._memmap(self.column_path(column, "codes"), "int32", self.meta["rows"])
+
+    # Distinct values of a string column, in code order
+    def read_dictionary(self, column):
+        offsets = np.fromfile(self.column_path(column, "offsets"), dtype="int64")
+        with open(self.column_path(column, "heap"), 'rb') as heap_file:
+            heap = heap_file.read()
+        return np.array([heap[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)], dtype=object)
+
+    # Load the requested columns for rows matching the pushed-down predicates. Both
+    # predicates are evaluated on the memory-mapped arrays; the name prefixes are checked
+    # once per distinct name in the dictionary rather than once per row.
+    def scan(self, columns, name_prefixes=None, years=None):
+        mask = None
+        if years is not None:
+            mask = np.isin(self.read_column("Year"), years)
+        if name_prefixes is not None:
+            names = self.read_dictionary("Name")
+            matching = [code for code, name in enumerate(names) if name.lower().startswith(name_prefixes)]
+            name_mask = np.isin(self.read_codes("Name"), matching)
+            mask = name_mask if mask is None else mask & name_mask
+
+        rows = np.flatnonzero(mask) if mask is not None else slice(None)
+        return pd.DataFrame({column: self.read_column(column, rows) for column in columns})
+
+# ----------------------------------------------------------- #
+# BLOCK-COMPRESSED CHUNK COPY (LESS I/O FOR QUERIES)
+# ----------------------------------------------------------- #
+# A chunk CSV can also be kept as independently compressed blocks of BLOCK_ROWS lines
+# (zlib or lzma) in hidden sidecars:
+#   .male_k.csv.zblocks   the compressed blocks back to back
+#   .male_k.csv.zindex    b,<start>,<end>,<lines>,<offset>,<length> per block: the CSV
+#                         bytes [start, end) it holds and where they sit in .zblocks
+#                         s,<codec>,<size>,<mtime_ns>,<covered>,<dead bytes>
+# Queries read the byte ranges they need (narrowed by the zone map) through the block
+# index and decompress only the blocks those ranges touch; the CSV itself is not read.
+# Edits made through ChunkFile recompress just the blocks holding rows they patched or
+# tombstoned, and appended rows are compressed into new blocks (a short last block is
+# re-cut with them). Rewritten blocks go to the end of .zblocks, which is repacked once
+# its dead bytes outweigh the live ones. A copy that does not match the CSV's size and
+# mtime is ignored by queries until the converter is run again.
+class CompressedChunk:
+    BLOCK_ROWS = 8192
+    CODECS = {"zlib": (zlib.compress, zlib.decompress), "lzma": (lzma.compress, lzma.decompress)}
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.index_path = sidecar_path(file_path, "zindex")
+        self.blocks_path = sidecar_path(file_path, "zblocks")
+        self.codec = "zlib"
+        self.blocks = []    # [start, end, lines, offset, length]
+        self.stat = None    # (size, mtime_ns) of the chunk the copy matches
+        self.covered = 0    # chunk bytes held by the blocks (header included)
+        self.dead = 0       # bytes of .zblocks no block points at any more
+
+    def _chunk_stat(self):
+        stat = os.stat(self.file_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def is_current(self):
+        return self.stat is not None and os.path.exists(self.file_path) and self.stat == self._chunk_stat()
+
+    # Read the block index; returns False when it is missing or does not match the chunk
+    def load(self):
+        self.blocks, self.stat, self.covered, self.dead = [], None, 0, 0
+        if not os.path.exists(self.index_path):
+            return False
+        with open(self.index_path, 'r', newline='') as index_file:
+            for entry in csv.reader(index_file):
+                if entry[0] == "b":
+                    self.blocks.append([int(value) for value in entry[1:6]])
+                elif entry[0] == "s":
+                    self.codec = entry[1]
+                    self.stat = [int(entry[2]), int(entry[3])]
+                    self.covered, self.dead = int(entry[4]), int(entry[5])
+        return self.is_current()
+
+    def build(self, codec="zlib"):
+        self.codec, self.blocks, self.covered, self.dead = codec, [], 0, 0
+        open(self.blocks_path, 'wb').close()
+        self._compress_tail()
+        self._write_index()
+
+    # Bring the copy up to date after an edit: recompress the blocks holding the rows at
+    # the given offsets (patched or tombstoned in place) and compress appended rows
+    def update(self, offsets=()):
+        starts = [block[0] for block in self.blocks]
+        touched = sorted({bisect.bisect_right(starts, offset) - 1 for offset in offsets if offset < self.covered})
+        if touched:
+            compress = self.CODECS[self.codec][0]
+            with open(self.file_path, 'rb') as chunk_file, open(self.blocks_path, 'ab') as blocks_file:
+                for index in touched:
+                    block = self.blocks[index]
+                    chunk_file.seek(block[0])
+                    self._store(blocks_file, block, compress(chunk_file.read(block[1] - block[0])))
+        self._compress_tail()
+        self._write_index()
+
+    # Point a block at new compressed bytes, appended to the end of .zblocks
+    def _store(self, blocks_file, block, data):
+        self.dead += block[4]
+        block[3], block[4] = blocks_file.tell(), len(data)
+        blocks_file.write(data)
+
+    # Cut the chunk lines from the covered offset onwards into new blocks
+    def _compress_tail(self):
+        if self.blocks and self.blocks[-1][2] < self.BLOCK_ROWS:
+            # Re-cut a short last block together with the appended rows
+            last = self.blocks.pop()
+            self.dead += last[4]
+            self.covered = last[0]
+
+        compress = self.CODECS[self.codec][0]
+        with open(self.file_path, 'rb') as chunk_file, open(self.blocks_path, 'ab') as blocks_file:
+            chunk_file.seek(self.covered)
+            offset = self.covered
+            if offset == 0:
+                offset += len(chunk_file.readline())  # header
+            lines = []
+            for line in chunk_file:
+                if not line.endswith(b'\n'):
+                    break  # partial trailing row, picked up by a later update()
+                lines.append(line)
+                if len(lines) == self.BLOCK_ROWS:
+                    offset = self._add_block(blocks_file, offset, lines, compress)
+                    lines = []
+            if lines:
+                offset = self._add_block(blocks_file, offset, lines, compress)
+            self.covered = offset
+
+    def _add_block(self, blocks_file, start, lines, compress):
+        data = b''.join(lines)
+        block = [start, start + len(data), len(lines), 0, 0]
+        self._store(blocks_file, block, compress(data))
+        self.blocks.append(block)
+        return block[1]
+
+    def _write_index(self):
+        if self.dead > self.compressed_bytes():
+            self._repack()
+        self.stat = self._chunk_stat()
+        entries = [["b"] + block for block in self.blocks]
+        entries.append(["s", self.codec] + self.stat + [self.covered, self.dead])
+        temp_path = temp_name(self.index_path)
+        with open(temp_path, 'w', newline='') as index_file:
+            csv.writer(index_file).writerows(entries)
+        os.replace(temp_path, self.index_path)
+
+    # Rewrite .zblocks with only the live blocks
+    def _repack(self):
+        temp_path = temp_name(self.blocks_path)
+        with open(self.blocks_path, 'rb') as blocks_file, open(temp_path, 'wb') as temp_file:
+            for block in self.blocks:
+                blocks_file.seek(block[3])
+                data = blocks_file.read(block[4])
+                block[3] = temp_file.tell()
+                temp_file.write(data)
+        os.replace(temp_path, self.blocks_path)
+        self.dead = 0
+
+    def compressed_bytes(self):
+        return sum(block[4] for block in self.blocks)
+
+    # Chunk bytes [start, end) (whole lines past the header), decompressing only the
+    # blocks they overlap; bytes past the copy's end come from the CSV
+    def read(self, start, end):
+        decompress = self.CODECS[self.codec][1]
+        pieces = []
+        starts = [block[0] for block in self.blocks]
+        with open(self.blocks_path, 'rb') as blocks_file:
+            for block in self.blocks[max(0, bisect.bisect_right(starts, start) - 1):]:
+                if block[0] >= end:
+                    break
+                if block[1] <= start:
+                    continue
+                blocks_file.seek(block[3])
+                data = decompress(blocks_file.read(block[4]))
+                pieces.append(data[max(start, block[0]) - block[0]:min(end, block[1]) - block[0]])
+        if end > self.covered:
+            with open(self.file_path, 'rb') as chunk_file:
+                chunk_file.seek(max(start, self.covered))
+                pieces.append(chunk_file.read(end - max(start, self.covered)))
+        return b''.join(pieces)
+
+    # Byte ranges holding every row, merged into runs of at most max_bytes
+    def ranges(self, max_bytes):
+        ranges = []
+        for block in self.blocks:
+            if ranges and block[1] - ranges[-1][0] <= max_bytes:
+                ranges[-1][1] = block[1]
+            else:
+                ranges.append([block[0], block[1]])
+        if self.stat[0] > self.covered:
+            ranges.append([self.covered, self.stat[0]])
+        return ranges
+
+# ----------------------------------------------------------- #
+# ZONE MAP: PER-BLOCK Year AND Name RANGES FOR SKIPPING DATA
+# ----------------------------------------------------------- #
+# Splits a chunk CSV into blocks of BLOCK_ROWS lines and records, for each block, its
+# byte range, live row count, min/max Year and min/max lower-cased Name. The sidecar
+# (.male_k.csv.zones) holds
+#   b,<start>,<end>,<rows>,<min Year>,<max Year>,<min name>,<max name>
+# lines followed by s,<size>,<mtime_ns>,<covered bytes> lines (the last one wins). Edits
+# only tombstone rows, patch Counts in place or append, so the ranges stay a superset of
+# what each block holds; ChunkFile just records the new stat. Bytes past the covered
+# offset (rows appended since the map was built) are always read. A scan reads only the
+# blocks whose ranges can satisfy its Year and Name filters.
+class ZoneMap:
+    BLOCK_ROWS = 8192                     # chunk lines per block
+    MAX_READ_BYTES = 64 * 1024 * 1024     # largest run of adjacent blocks read at once
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.zones_path = sidecar_path(file_path, "zones")
+        self.blocks = []    # [start, end, rows, min Year, max Year, min name, max name]
+        self.stat = None    # (size, mtime_ns) of the chunk the map matches
+        self.covered = 0    # chunk bytes described by the blocks (header included)
+
+    def _chunk_stat(self):
+        stat = os.stat(self.file_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def is_current(self):
+        return self.stat is not None and os.path.exists(self.file_path) and self.stat == self._chunk_stat()
+
+    # Read the sidecar; returns False when it is missing or does not match the chunk
+    def load(self):
+        self.blocks, self.stat, self.covered = [], None, 0
+        if not os.path.exists(self.zones_path):
+            return False
+        with open(self.zones_path, 'r', newline='') as zones_file:
+            for entry in csv.reader(zones_file):
+                if entry[0] == "b":
+                    self.blocks.append([int(value) for value in entry[1:6]] + entry[6:8])
+                elif entry[0] == "s":
+                    self.stat = [int(entry[1]), int(entry[2])]
+                    self.covered = int(entry[3])
+        return self.is_current()
+
+    def build(self):
+        self.blocks, self.covered = [], 0
+        self._write(self._scan_blocks(), 'w')
+
+    # Add blocks for rows appended since the map was built (the map must be current first)
+    def extend(self):
+        self._write(self._scan_blocks(), 'a')
+
+    def record_stat(self):
+        self._write([], 'a')
+
+    def _write(self, blocks, mode):
+        self.blocks.extend(blocks)
+        self.stat = self._chunk_stat()
+        entries = [["b"] + block for block in (self.blocks if mode == 'w' else blocks)]
+        entries.append(["s"] + self.stat + [self.covered])
+        if mode == 'a':
+            with open(self.zones_path, 'a', newline='') as zones_file:
+                csv.writer(zones_file).writerows(entries)
+            return
+        temp_path = temp_name(self.zones_path)
+        with open(temp_path, 'w', newline='') as zones_file:
+            csv.writer(zones_file).writerows(entries)
+        os.replace(temp_path, self.zones_path)
+
+    # Cut the chunk lines from the covered offset onwards into blocks
+    def _scan_blocks(self):
+        blocks = []
+        with open(self.file_path, 'rb') as chunk_file:
+            chunk_file.seek(self.covered)
+            offset = self.covered
+            if offset == 0:
+                offset += len(chunk_file.readline())  # header
+
+            block = None
+            for line in chunk_file:
+                if not line.endswith(b'\n'):
+                    break  # partial trailing row, picked up by a later extend()
+                if block is None:
+                    block = [offset, offset, 0, None, None, None, None]
+                    lines = 0
+                offset += len(line)
+                block[1] = offset
+                lines += 1
+                if not line.startswith(b'#'):
+                    fields = line.split(b',', 3)
+                    if fields[1].startswith(b'"'):
+                        fields = next(csv.reader([line.decode('utf-8')]))
+                        name, year = fields[1], int(fields[2])
+                    else:
+                        name, year = fields[1].decode('utf-8'), int(fields[2])
+                    name = name.lower()
+                    if block[2] == 0:
+                        block[3:7] = [year, year, name, name]
+                    else:
+                        block[3], block[4] = min(block[3], year), max(block[4], year)
+                        block[5], block[6] = min(block[5], name), max(block[6], name)
+                    block[2] += 1
+                if lines == self.BLOCK_ROWS:
+                    blocks.append(block)
+                    block = None
+            if block is not None:
+                blocks.append(block)
+            self.covered = offset
+        # all-dead blocks are dropped; their bytes are never read
+        return [block for block in blocks if block[2] > 0]
+
+    def _block_matches(self, block, name_prefixes, years):
+        if years is not None:
+            position = bisect.bisect_left(years, block[3])
+            if position == len(years) or years[position] > block[4]:
+                return False
+        if name_prefixes is not None:
+            return any(block[5][:len(prefix)] <= prefix <= block[6][:len(prefix)] for prefix in name_prefixes)
+        return True
+
+    # Byte ranges to read for a scan, plus the number of blocks skipped
+    def ranges(self, name_prefixes=None, years=None):
+        if years is not None:
+            years = sorted({int(year) for year in years})
+        ranges, skipped = [], 0
+        for block in self.blocks:
+            if not self._block_matches(block, name_prefixes, years):
+                skipped += 1
+            elif ranges and ranges[-1][1] == block[0] and block[1] - ranges[-1][0] <= self.MAX_READ_BYTES:
+                ranges[-1][1] = block[1]
+            else:
+                ranges.append([block[0], block[1]])
+        size = self.stat[0]
+        if size > self.covered:
+            ranges.append([self.covered, size])
+        return ranges, skipped
+
+# ----------------------------------------------------------- #
+# CLUSTERED LAYOUT: CHUNK ROWS SORTED BY (Name, Year)
+# ----------------------------------------------------------- #
+# A clustered chunk keeps its rows sorted by lowercase Name (then Name, Year and Id), so
+# the rows of a name, or of a name prefix, are contiguous. Rows are still appended at the
+# end, so the chunk is a sorted region followed by an unsorted tail. The sidecar
+#   .male_k.csv.cluster   'n' lines: lowercase Name and byte offset of every SPARSE_ROWS-th
+#                         sorted row; 's' lines: header end, sorted region end, chunk stat
+# turns a name prefix into one byte range of the sorted region by binary search, and a
+# scan reads that range plus the tail. Edits through ChunkFile patch rows in place or
+# append them, so only the stat is recorded; compaction re-sorts the chunk, merging the
+# sorted tail into the sorted region, as do batch loads once they finish.
+class ClusterIndex:
+    SPARSE_ROWS = 256     # sorted rows between index entries
+    MERGE_RATIO = 0.25    # merge the tail once it outgrows this share of the sorted region
+    MERGE_MIN_BYTES = 1024 * 1024
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.index_path = sidecar_path(file_path, "cluster")
+        self.names = []       # lowercase Name of every SPARSE_ROWS-th sorted row
+        self.offsets = []     # byte offset of that row
+        self.data_start = 0   # end of the header
+        self.sorted_end = 0   # end of the sorted region, where the tail starts
+        self.stat = None      # (size, mtime_ns) of the chunk the index matches
+
+    def _chunk_stat(self):
+        stat = os.stat(self.file_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def is_current(self):
+        return self.stat is not None and os.path.exists(self.file_path) and self.stat == self._chunk_stat()
+
+    # Read the sidecar; returns False when it is missing or does not match the chunk
+    def load(self):
+        self.names, self.offsets, self.stat = [], [], None
+        if not os.path.exists(self.index_path):
+            return False
+        with open(self.index_path, 'r', newline='') as index_file:
+            for entry in csv.reader(index_file):
+                if entry[0] == "n":
+                    self.names.append(entry[1])
+                    self.offsets.append(int(entry[2]))
+                elif entry[0] == "s":
+                    self.data_start, self.sorted_end = int(entry[1]), int(entry[2])
+                    self.stat = [int(entry[3]), int(entry[4])]
+        return self.is_current()
+
+    def record_stat(self):
+        self.stat = self._chunk_stat()
+        with open(self.index_path, 'a', newline='') as index_file:
+            csv.writer(index_file).writerow(["s", self.data_start, self.sorted_end] + self.stat)
+
+    def save(self):
+        self.stat = self._chunk_stat()
+        entries = [["n", name, offset] for name, offset in zip(self.names, self.offsets)]
+        entries.append(["s", self.data_start, self.sorted_end] + self.stat)
+        temp_path = temp_name(self.index_path)
+        with open(temp_path, 'w', newline='') as index_file:
+            csv.writer(index_file).writerows(entries)
+        os.replace(temp_path, self.index_path)
+
+    @staticmethod
+    def _key(line):
+        fields = line.split(b',', 3)
+        if fields[1].startswith(b'"'):
+            fields = next(csv.reader([line.decode('utf-8')]))
+            name = fields[1]
+        else:
+            name = fields[1].decode('utf-8')
+        return name.lower(), name, int(fields[2]), int(fields[0])
+
+    def tail_bytes(self):
+        return os.path.getsize(self.file_path) - self.sorted_end
+
+    # True once enough rows were appended since the last sort to merge them in
+    def needs_merge(self):
+        tail = self.tail_bytes()
+        return tail >= self.MERGE_MIN_BYTES and tail > (self.sorted_end - self.data_start) * self.MERGE_RATIO
+
+    # Write the chunk's live rows to temp_path in clustered order and index them. A
+    # current index means the sorted region is already in order: it is streamed and
+    # merged with the sorted tail, so only the tail is held in memory.
+    def sort_into(self, temp_path):
+        merge = self.load()
+        with open(self.file_path, 'rb') as chunk_file, open(self.file_path, 'rb') as tail_file, \
+                open(temp_path, 'wb') as temp_file:
+            header = chunk_file.readline()
+            if merge:
+                tail_file.seek(self.sorted_end)
+                tail = sorted(self._live_lines(tail_file), key=self._key)
+                rows = heapq.merge(self._live_lines(chunk_file, self.sorted_end), tail, key=self._key)
+            else:
+                rows = sorted(self._live_lines(chunk_file), key=self._key)
+
+            temp_file.write(header)
+            self.names, self.offsets = [], []
+            self.data_start = offset = len(header)
+            for position, line in enumerate(rows):
+                if position % self.SPARSE_ROWS == 0:
+                    self.names.append(self._key(line)[0])
+                    self.offsets.append(offset)
+                temp_file.write(line)
+                offset += len(line)
+            self.sorted_end = offset
+
+    # Live lines from the current position up to end (None = end of file), terminated
+    def _live_lines(self, chunk_file, end=None):
+        offset = chunk_file.tell()
+        for line in chunk_file:
+            if end is not None and offset >= end:
+                return
+            offset += len(line)
+            if line.startswith(b'#') or not line.strip():
+                continue
+            yield line if line.endswith(b'\n') else line + b'\r\n'
+
+    # Byte ranges holding the rows whose lowercase names start with one of the prefixes:
+    # one range of the sorted region per prefix (cut at index entries into pieces of
+    # about max_bytes) followed by the tail
+    def ranges(self, name_prefixes, max_bytes):
+        spans = []
+        for prefix in sorted(set(name_prefixes)):
+            first = bisect.bisect_left(self.names, prefix) - 1
+            last = bisect.bisect_left(self.names, prefix + '\U0010ffff')
+            start = self.offsets[first] if first >= 0 else self.data_start
+            end = self.offsets[last] if last < len(self.offsets) else self.sorted_end
+            if spans and start <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], end)
+            elif start < end:
+                spans.append([start, end])
+
+        ranges = []
+        for start, end in spans:
+            cut = start
+            for offset in self.offsets[bisect.bisect_right(self.offsets, start):bisect.bisect_left(self.offsets, end)]:
+                if offset - cut >= max_bytes:
+                    ranges.append([cut, offset])
+                    cut = offset
+            ranges.append([cut, end])
+        if self.stat[0] > self.sorted_end:
+            ranges.append([self.sorted_end, self.stat[0]])
+        return ranges
+
+# ----------------------------------------------------------- #
+# ROW INDEX: SPARSE LIVE-ROW OFFSETS FOR PAGED DISPLAY
+# ----------------------------------------------------------- #
+# Display data pages through a chunk by live row number. The sidecar
+#   .male_k.csv.rows   'r' lines: byte offset of every SPARSE_ROWS-th live row;
+#                      's' line: live rows in the chunk and the chunk stat
+# lets a page start reading at the nearest indexed row before it and skip at most
+# SPARSE_ROWS - 1 rows, instead of reading the chunk from the top. Tombstones renumber
+# the rows after them, so the index is only used while it matches the chunk's size and
+# mtime and is rebuilt (one pass over the lines, without parsing them) otherwise.
+class RowIndex:
+    SPARSE_ROWS = 1024    # live rows between index entries
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.index_path = sidecar_path(file_path, "rows")
+        self.offsets = []     # byte offset of every SPARSE_ROWS-th live row
+        self.rows = 0         # live rows in the chunk
+        self.stat = None      # (size, mtime_ns) of the chunk the index matches
+
+    def _chunk_stat(self):
+        stat = os.stat(self.file_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def is_current(self):
+        return self.stat is not None and os.path.exists(self.file_path) and self.stat == self._chunk_stat()
+
+    # Read the sidecar; returns False when it is missing or does not match the chunk
+    def load(self):
+        self.offsets, self.rows, self.stat = [], 0, None
+        if not os.path.exists(self.index_path):
+            return False
+        with open(self.index_path, 'r', newline='') as index_file:
+            for entry in csv.reader(index_file):
+                if entry[0] == "r":
+                    self.offsets.append(int(entry[1]))
+                elif entry[0] == "s":
+                    self.rows = int(entry[1])
+                    self.stat = [int(entry[2]), int(entry[3])]
+        return self.is_current()
+
+    def build(self):
+        self.offsets, self.rows = [], 0
+        with open(self.file_path, 'rb') as chunk_file:
+            offset = len(chunk_file.readline())  # header
+            for line in chunk_file:
+                if not line.startswith(b'#'):
+                    if self.rows % self.SPARSE_ROWS == 0:
+                        self.offsets.append(offset)
+                    self.rows += 1
+                offset += len(line)
+        self.stat = self._chunk_stat()
+        entries = [["r", offset] for offset in self.offsets]
+        entries.append(["s", self.rows] + self.stat)
+        temp_path = temp_name(self.index_path)
+        with open(temp_path, 'w', newline='') as index_file:
+            csv.writer(index_file).writerows(entries)
+        os.replace(temp_path, self.index_path)
+
+    # (byte offset, live rows to skip from there) of live row number row; None past the end
+    def seek(self, row):
+        if row >= self.rows:
+            return None
+        return self.offsets[row // self.SPARSE_ROWS], row % self.SPARSE_ROWS
+
+# ----------------------------------------------------------- #
+# CHUNK CACHE: DECODED CHUNKS SHARED ACROSS QUERIES
+# ----------------------------------------------------------- #
+# Keeps whole chunks decoded as DataFrames (tombstones dropped) in a size-bounded LRU
+# keyed by chunk path. An entry is reused while the chunk's size and mtime are unchanged
+# and reloaded otherwise. Long-running processes (csv_server.py) attach one to the
+# database so repeated queries are served from memory; it is safe to use from threads.
+class ChunkCache:
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()  # chunk path -> (stat, DataFrame, lowercase names, bytes)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def frame(self, file_path):
+        stat = os.stat(file_path)
+        stat = [stat.st_size, stat.st_mtime_ns]
+        with self.lock:
+            cached = self.frames.get(file_path)
+            if cached is not None and cached[0] == stat:
+                self.frames.move_to_end(file_path)
+                self.hits += 1
+                return cached[1], cached[2]
+            self.misses += 1
+
+        # Decode outside the lock so other chunks can be served meanwhile. Frames are kept
+        # compact (see SCAN_DTYPES), with Id and Count downcast to the smallest integer type.
+        frame = pd.read_csv(file_path, comment='#', dtype=SCAN_DTYPES)
+        for column in ('Id', 'Count'):
+            frame[column] = pd.to_numeric(frame[column], downcast='integer')
+        lower_names = frame['Name'].cat.categories.str.lower()
+        size = int(frame.memory_usage(deep=True).sum()) + int(lower_names.memory_usage(deep=True))
+        with self.lock:
+            old = self.frames.pop(file_path, None)
+            if old is not None:
+                self.total_bytes -= old[3]
+            if size <= self.max_bytes:
+                self.frames[file_path] = (stat, frame, lower_names, size)
+                self.total_bytes += size
+                while self.total_bytes > self.max_bytes:
+                    _, (_, _, _, evicted) = self.frames.popitem(last=False)
+                    self.total_bytes -= evicted
+        return frame, lower_names
+
+    def stats(self):
+        with self.lock:
+            return {"chunks": len(self.frames), "bytes": self.total_bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+# ----------------------------------------------------------- #
+# QUERY ENGINE: PARSER -> LOGICAL PLAN -> OPTIMIZER
+# ----------------------------------------------------------- #
+# FIND <name> <gender> <year> [CONDITION <aggregate> <value>] [ORDER <order> BY <col name>] [RETURN <col names>]
+# is parsed into a QueryPlan: a Scan of the selected chunk files followed by a pipeline
+# of operators (Filter, Aggregate, TopN, GroupBy, Sort, Project). optimize_plan() then
+# pushes the filters into the scan and prunes the columns the scan has to read, and
+# the executor (BabyNamesDatabase.execute_plan) runs the pipeline chunk by chunk.
+class QuerySyntaxError(ValueError):
+    pass
+
+AGGREGATES = ('count', 'sum', 'top', 'bottom', 'group', 'none')
+CLAUSE_KEYWORDS = ('CONDITION', 'ORDER', 'BY', 'RETURN')
+
+class Scan:
+    def __init__(self, files):
+        self.files = files                 # chunk filenames, e.g. ['male_k.csv']
+        self.columns = list(FIELDNAMES)    # columns the scan has to produce
+        self.name_prefixes = None          # pushed-down name filter (None = every name)
+        self.years = None                  # pushed-down year filter (None = every year)
+
+class Filter:
+    def __init__(self, column, values):
+        self.column = column  # 'Name' keeps names starting with a value, 'Year' keeps listed years
+        self.values = values
+
+class Aggregate:
+    def __init__(self, func):
+        self.func = func  # 'sum' or 'count', computed without materializing rows
+
+class TopN:
+    def __init__(self, n, ascending):
+        self.n = n
+        self.ascending = ascending  # False keeps the n highest counts (top), True the lowest (bottom)
+
+class GroupBy:
+    def __init__(self, column):
+        self.column = column
+
+class Sort:
+    def __init__(self, by, ascending):
+        self.by = by
+        self.ascending = ascending
+
+class Project:
+    def __init__(self, columns):
+        self.columns = columns  # list of columns, or a single column name (printed as a bare column)
+
+class QueryPlan:
+    def __init__(self, name_text, genders, year_text, scan, operators):
+        self.name_text = name_text  # <name> and <year> as typed, used in result messages
+        self.genders = genders
+        self.year_text = year_text
+        self.scan = scan
+        self.operators = operators
+        self.optimized = False
+
+    @property
+    def aggregate(self):
+        for operator in self.operators:
+            if isinstance(operator, Aggregate):
+                return operator.func
+        return None
+
+# '[a,b,c]' -> ['a', 'b', 'c'], 'a' -> ['a']
+def split_list(token):
+    if token.startswith('[') and token.endswith(']'):
+        return [item.strip() for item in token[1:-1].split(',') if item.strip()]
+    return [token]
+
+def _check_columns(columns, available):
+    for column in columns:
+        if column not in available:
+            raise QuerySyntaxError(f"Unknown column '{column}'. Available columns: {', '.join(available)}")
+
+def parse_find(query):
+    tokens = query.split()
+    if len(tokens) < 4 or tokens[0].upper() != 'FIND':
+        raise QuerySyntaxError("Query must start with FIND <name> <gender> <year>.")
+    name_text, gender_text, year_text = tokens[1:4]
+
+    # <name>: a-z, a, [a,b,d,m], Kevin, or [Kevin,Sarah,Dave]
+    if name_text == '[a-z]':
+        raise QuerySyntaxError("Invalid syntax. Strictly requires, a-z, [a,b,d,m], Kevin, or [Kevin,Sarah,Dave]. NO SPACES")
+    elif name_text == 'a-z':
+        name_prefixes = None
+        alphabet = list(string.ascii_lowercase)
+    else:
+        name_prefixes = [name.lower() for name in split_list(name_text)]
+        alphabet = []
+        for prefix in name_prefixes:
+            if prefix[0] not in alphabet:
+                alphabet.append(prefix[0])
+
+    # <gender>: M, F, M-F or M/F
+    if 'M' in gender_text and 'F' in gender_text:
+        genders = ['male', 'female']
+    elif gender_text == 'F':
+        genders = ['female']
+    elif gender_text == 'M':
+        genders = ['male']
+    else:
+        raise QuerySyntaxError("Invalid gender information. Enter case-sensitive value, e.g., M, F, Female, M-F or M/F")
+
+    # <year>: 2009, 2000-2009, or [2000,1999,2010]
+    if "-" in year_text:
+        start_year, _, end_year = year_text.partition('-')
+        if not (start_year.isnumeric() and end_year.isnumeric() and len(start_year) == 4 and len(end_year) == 4):
+            raise QuerySyntaxError("Invalid year range. Start and end years must be numeric 4-digit values.")
+        if int(start_year) >= int(end_year):
+            raise QuerySyntaxError("Invalid year range. Start year must be less than end year.")
+        years = list(range(int(start_year), int(end_year) + 1))
+    elif year_text.startswith('[') and year_text.endswith(']'):
+        years = split_list(year_text)
+        if not all(year.isnumeric() and len(year) == 4 for year in years):
+            raise QuerySyntaxError("Invalid year range. Year must be numeric 4-digit values.")
+        years = [int(year) for year in years]
+    else:
+        if not (year_text.isnumeric() and len(year_text) == 4):
+            raise QuerySyntaxError("Invalid year. Must be numeric 4-digits.")
+        years = [int(year_text)]
+
+    # Optional clauses, matched by keyword
+    aggregate, value, order_text, by_text, return_text = 'None', None, 'None', 'None', 'all'
+    position = 4
+    while position < len(tokens):
+        keyword = tokens[position].upper()
+        if keyword == 'CONDITION' and position + 1 < len(tokens):
+            aggregate = tokens[position + 1]
+            position += 2
+            if position < len(tokens) and tokens[position].upper() not in CLAUSE_KEYWORDS:
+                value = tokens[position]
+                position += 1
+        elif keyword == 'ORDER' and position + 3 < len(tokens) and tokens[position + 2].upper() == 'BY':
+            order_text, by_text = tokens[position + 1], tokens[position + 3]
+            position += 4
+        elif keyword == 'RETURN' and position + 1 < len(tokens):
+            return_text = tokens[position + 1]
+            position += 2
+        else:
+            raise QuerySyntaxError(f"Unexpected '{' '.join(tokens[position:])}'. Expected CONDITION <aggregate> <value>, ORDER <order> BY <col name> or RETURN <col names>.")
+
+    operators = []
+    if name_prefixes is not None:
+        operators.append(Filter('Name', name_prefixes))
+    operators.append(Filter('Year', years))
+
+    files = [f"{gender}_{letter}.csv" for gender in genders for letter in alphabet]
+    plan = QueryPlan(name_text, genders, year_text, Scan(files), operators)
+
+    # <aggregate> <value>
+    func = aggregate.lower()
+    if func not in AGGREGATES:
+        raise QuerySyntaxError(f"Invalid aggregate '{aggregate}'. Use count, sum, top, bottom, group or None.")
+    if func in ('sum', 'count'):
+        # A single total: ORDER and RETURN do not apply
+        operators.append(Aggregate(func))
+        return plan
+
+    available = list(FIELDNAMES)
+    if func in ('top', 'bottom'):
+        if value is None or not value.isnumeric():
+            raise QuerySyntaxError(f"Please enter numerical value for {func} condition.")
+        operators.append(TopN(int(value), ascending=(func == 'bottom')))
+    elif func == 'group':
+        if value not in FIELDNAMES or value == 'Count':
+            raise QuerySyntaxError("Please enter a column to group by, e.g. CONDITION group Name.")
+        operators.append(GroupBy(value))
+        available = [value, 'Count']
+
+    # ORDER <order> BY <col name>
+    if order_text != 'None' and by_text != 'None':
+        orders, by = split_list(order_text), split_list(by_text)
+        if any(order not in ('asc', 'desc') for order in orders):
+            raise QuerySyntaxError("Invalid ORDER or BY entry. <order> must be desc, asc, [desc,asc] or None.")
+        ascending = [order == 'asc' for order in orders]
+        if len(ascending) == 1:
+            ascending = ascending * len(by)
+        if len(ascending) != len(by):
+            raise QuerySyntaxError("Invalid ORDER or BY entry. Give one <order> per <col name>.")
+        _check_columns(by, available)
+        operators.append(Sort(by, ascending))
+
+    # RETURN <col names>
+    if return_text != 'all':
+        if return_text.startswith('[') and return_text.endswith(']'):
+            columns = split_list(return_text)
+            _check_columns(columns, available)
+        else:
+            columns = return_text
+            _check_columns([columns], available)
+        operators.append(Project(columns))
+
+    return plan
+
+def optimize_plan(plan):
+    scan = plan.scan
+
+    # Predicate pushdown: filters become part of the scan
+    operators = []
+    for operator in plan.operators:
+        if isinstance(operator, Filter) and operator.column == 'Year':
+            scan.years = operator.values
+        elif isinstance(operator, Filter) and operator.column == 'Name':
+            scan.name_prefixes = tuple(operator.values)
+        else:
+            operators.append(operator)
+
+    # Column pruning: walk the pipeline backwards collecting the columns it references
+    needed = set(FIELDNAMES)
+    for operator in reversed(operators):
+        if isinstance(operator, Project):
+            needed = {operator.columns} if isinstance(operator.columns, str) else set(operator.columns)
+        elif isinstance(operator, Sort):
+            needed |= set(operator.by)
+        elif isinstance(operator, TopN):
+            needed |= {'Count'}
+        elif isinstance(operator, GroupBy):
+            needed = {operator.column, 'Count'}
+        elif isinstance(operator, Aggregate):
+            needed = {'Count'} if operator.func == 'sum' else set()
+    if scan.years is not None:
+        needed.add('Year')
+    if scan.name_prefixes is not None:
+        needed.add('Name')
+    scan.columns = [column for column in FIELDNAMES if column in needed] or ['Year']
+
+    plan.operators = operators
+    plan.optimized = True
+    return plan
+
+# ----------------------------------------------------------- #
+# QUERY PROFILE: EXPLAIN AND EXPLAIN ANALYZE
+# ----------------------------------------------------------- #
+# EXPLAIN [ANALYZE] [JSON] FIND ... shows the optimized plan and the chunk files it reads
+# (and how: chunk cache, columnar copy, compressed blocks, zone map ranges or the whole
+# CSV). With ANALYZE the plan is also run, bypassing the result cache, and a QueryProfile
+# collects rows in/out, bytes read and wall/CPU time for every stage. Stage times are
+# exclusive (time spent in a nested stage is not counted again in the outer one), and
+# stages run by process pool workers are summed over the workers.
+EXPLAIN_STAGES = ('checkpoint', 'parse', 'optimize', 'read', 'filter year', 'filter name', 'decode',
+                  'catalog', 'cube', 'reduce', 'concat', 'pool wait', 'prefetch wait', 'merge', 'sort',
+                  'spill', 'merge runs', 'project')
+
+# 'EXPLAIN [ANALYZE] [JSON] FIND ...' -> (analyze, as_json, FIND query); None without EXPLAIN
+def parse_explain(query):
+    tokens = query.split()
+    if not tokens or tokens[0].upper() != 'EXPLAIN':
+        return None
+    tokens = tokens[1:]
+    analyze = bool(tokens) and tokens[0].upper() == 'ANALYZE'
+    tokens = tokens[analyze:]
+    as_json = bool(tokens) and tokens[0].upper() == 'JSON'
+    tokens = tokens[as_json:]
+    if not tokens or tokens[0].upper() != 'FIND':
+        raise QuerySyntaxError("Usage: EXPLAIN [ANALYZE] [JSON] FIND <name> <gender> <year> ...")
+    return analyze, as_json, ' '.join(tokens)
+
+def describe_operator(operator):
+    if isinstance(operator, Aggregate):
+        return f"Aggregate {operator.func}"
+    if isinstance(operator, TopN):
+        return f"{'Bottom' if operator.ascending else 'Top'} {operator.n} by Count"
+    if isinstance(operator, GroupBy):
+        return f"Group by {operator.column}, sum Count"
+    if isinstance(operator, Sort):
+        return "Sort by " + ', '.join(f"{column} {'asc' if ascending else 'desc'}"
+                                      for column, ascending in zip(operator.by, operator.ascending))
+    if isinstance(operator, Project):
+        columns = operator.columns
+        return "Project " + (columns if isinstance(columns, str) else ', '.join(columns))
+    return f"Filter {operator.column} in {operator.values}"
+
+# The plan in execution order, one line per step
+def describe_plan(plan):
+    scan = plan.scan
+    line = f"Scan {', '.join(scan.files)} columns=[{','.join(scan.columns)}]"
+    if scan.name_prefixes is not None:
+        line += f" names=[{','.join(scan.name_prefixes)}]"
+    if scan.years is not None:
+        years = sorted(scan.years)
+        line += f" years={years[0]}-{years[-1]} ({len(years)} year{'s' if len(years) != 1 else ''})" if years else " years=[]"
+    return [line] + [describe_operator(operator) for operator in plan.operators]
+
+class QueryProfile:
+    def __init__(self):
+        self.stages = {}   # stage name -> totals (see new_entry)
+        self.files = []    # chunk files read: file, source, bytes, zone map blocks and blocks skipped
+        self._nested = []  # [wall, cpu] spent in stages nested in each open stage
+
+    @staticmethod
+    def new_entry():
+        return {'rows_in': 0, 'rows_out': 0, 'bytes': 0, 'wall': 0.0, 'cpu': 0.0}
+
+    # Time a stage; the body adds its output rows (and bytes) to the yielded totals
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=0):
+        entry = self.stages.setdefault(name, self.new_entry())
+        entry['rows_in'] += rows_in
+        self._nested.append([0.0, 0.0])
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield entry
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            nested_wall, nested_cpu = self._nested.pop()
+            entry['wall'] += wall - nested_wall
+            entry['cpu'] += cpu - nested_cpu
+            if self._nested:
+                self._nested[-1][0] += wall
+                self._nested[-1][1] += cpu
+
+    # Time each step of an iterator of DataFrame batches as one stage
+    def iterate(self, name, batches, nbytes=0):
+        batches = iter(batches)
+        self.stages.setdefault(name, self.new_entry())['bytes'] += nbytes
+        while True:
+            with self.stage(name) as entry:
+                batch = next(batches, None)
+                if batch is not None:
+                    entry['rows_out'] += len(batch)
+            if batch is None:
+                return
+            yield batch
+
+    def add_file(self, file_path, source, nbytes=0, blocks=0, skipped=0):
+        self.files.append({'file': os.path.basename(file_path), 'source': source, 'bytes': nbytes,
+                           'blocks': blocks, 'skipped': skipped})
+
+    # Fold in the profile a pool worker collected for one chunk
+    def merge(self, other):
+        for name, totals in other.stages.items():
+            entry = self.stages.setdefault(name, self.new_entry())
+            for key, value in totals.items():
+                entry[key] += value
+        self.files.extend(other.files)
+
+    def stage_report(self):
+        order = {name: position for position, name in enumerate(EXPLAIN_STAGES)}
+        return [{'stage': name, 'rows_in': entry['rows_in'], 'rows_out': entry['rows_out'],
+                 'bytes': entry['bytes'], 'wall_ms': round(entry['wall'] * 1000, 3),
+                 'cpu_ms': round(entry['cpu'] * 1000, 3)}
+                for name, entry in sorted(self.stages.items(), key=lambda item: order.get(item[0], len(order)))]
+
+# Time a stage when a profile is given; otherwise run the body with throwaway totals
+def profile_stage(profile, name, rows_in=0):
+    if profile is None:
+        return contextlib.nullcontext(QueryProfile.new_entry())
+    return profile.stage(name, rows_in)
+
+# Rows of a partial result: a frame or series, or 1 for a scalar sum/count
+def partial_rows(partial):
+    return len(partial) if hasattr(partial, '__len__') else 1
+
+# Text form of an EXPLAIN report (BabyNamesDatabase.explain)
+def format_explain(report):
+    lines = [f"\n{'EXPLAIN ANALYZE' if report['analyze'] else 'EXPLAIN'} {report['query']}", "\nPLAN:"]
+    lines += [f"  {step}. {line}" for step, line in enumerate(report['plan'], 1)]
+    lines.append(f"  Strategy: {report['strategy']}")
+    if report['pending_changes']:
+        lines.append(f"  {report['pending_changes']:,} logged changes are checkpointed before the scan.")
+
+    lines.append("\nFILES:")
+    if not report['files']:
+        lines.append("  (none)")
+    for entry in report['files']:
+        line = f"  {entry['file']:<20} {entry['source']:<18} {entry['bytes']:>14,} bytes"
+        if entry['blocks']:
+            line += f"  zone map skipped {entry['skipped']:,} of {entry['blocks']:,} blocks"
+        lines.append(line)
+    lines.append(f"  Total: {len(report['files'])} files, {sum(entry['bytes'] for entry in report['files']):,} bytes")
+
+    if report['analyze']:
+        lines.append("\nSTAGES:")
+        lines.append(f"  {'stage':<12} {'rows in':>12} {'rows out':>12} {'bytes':>14} {'wall ms':>10} {'cpu ms':>10}")
+        for entry in report['stages']:
+            lines.append(f"  {entry['stage']:<12} {entry['rows_in']:>12,} {entry['rows_out']:>12,} {entry['bytes']:>14,}"
+                         f" {entry['wall_ms']:>10.1f} {entry['cpu_ms']:>10.1f}")
+        total = report['total']
+        lines.append(f"\nTOTAL: {total['rows']:,} result rows, {total['wall_ms']:.1f} ms wall, "
+                     f"{total['cpu_ms']:.1f} ms CPU in this process, peak traced memory "
+                     f"{total['peak_memory_bytes'] / (1024 * 1024):.1f} MiB")
+        if 'value' in total:
+            lines.append(f"RESULT: {total['value']:,}")
+    return lines
+
+# ----------------------------------------------------------- #
+# QUERY ENGINE: PER-CHUNK EXECUTION
+# ----------------------------------------------------------- #
+# Each selected chunk file is scanned and reduced to a partial result on its own
+# (a sum, a row count, top-N candidates, per-group Count sums or the filtered rows),
+# either in this process or in a worker of the process pool. merge_partials() then
+# combines the partials in file order. These are module-level functions so the pool
+# workers can run them.
+
+# Chunk rows are parsed into compact dtypes: Name and Gender dictionary-encoded (each
+# distinct string stored once, rows hold small integer codes) and Year as int16. Name
+# filters are then evaluated once per distinct name, and only the rows a scan keeps are
+# decoded back to the plain dtypes the rest of the engine works with.
+SCAN_DTYPES = {'Name': 'category', 'Gender': 'category', 'Year': 'int16'}
+
+def scan_dtypes(columns):
+    return {column: dtype for column, dtype in SCAN_DTYPES.items() if column in columns}
+
+# Row mask of the names starting with one of prefixes. For a dictionary-encoded column
+# the test runs on its (optionally precomputed) lowercase dictionary, not on every row.
+def name_mask(names, prefixes, lower_names=None):
+    if not isinstance(names.dtype, pd.CategoricalDtype):
+        return names.str.lower().str.startswith(prefixes).to_numpy(dtype=bool)
+    if lower_names is None:
+        lower_names = names.cat.categories.str.lower()
+    keep = np.append(np.asarray(lower_names.str.startswith(prefixes), dtype=bool), False)  # code -1: no name
+    return keep[names.cat.codes.to_numpy()]
+
+def decode_frame(chunk):
+    dtypes = {}
+    for column, dtype in chunk.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtypes[column] = dtype.categories.dtype
+        elif column in ('Id', 'Year', 'Count') and dtype != np.int64:
+            dtypes[column] = np.int64
+    return chunk.astype(dtypes) if dtypes else chunk
+
+def filter_chunk(chunk, scan, lower_names=None, profile=None):
+    # Cheap integer year test first, then the name test on the surviving rows
+    if scan.years is not None:
+        with profile_stage(profile, 'filter year', len(chunk)) as entry:
+            chunk = chunk[chunk['Year'].isin(scan.years)]
+            entry['rows_out'] += len(chunk)
+    if scan.name_prefixes is not None:
+        with profile_stage(profile, 'filter name', len(chunk)) as entry:
+            chunk = chunk[name_mask(chunk['Name'], scan.name_prefixes, lower_names)]
+            entry['rows_out'] += len(chunk)
+    with profile_stage(profile, 'decode', len(chunk)) as entry:
+        chunk = decode_frame(chunk)
+        entry['rows_out'] += len(chunk)
+    return chunk
+
+# How scan_chunk reads a chunk file: its source ('cache', 'columnar', 'compressed' or
+# 'csv', plus '/cluster' when a cluster index narrows a name scan), the bytes it reads, the [start, end) byte ranges to parse (None = the whole CSV),
+# the read function of a compressed copy, and the zone map blocks seen and skipped.
+def chunk_access(file_path, scan, cache=None):
+    access = {'source': 'csv', 'bytes': os.path.getsize(file_path), 'ranges': None, 'read': None,
+              'blocks': 0, 'skipped': 0}
+    if cache is not None:
+        access.update(source='cache', bytes=0)
+        return access
+
+    # Prefer an up-to-date columnar copy of the chunk over parsing the CSV
+    columnar = ColumnarChunk(file_path)
+    if columnar.is_fresh():
+        access.update(source='columnar', bytes=columnar.column_bytes(scan.columns))
+        return access
+
+    zones = ZoneMap(file_path)
+    compressed = CompressedChunk(file_path)
+    cluster = ClusterIndex(file_path)
+    if compressed.load():
+        access.update(source='compressed', read=compressed.read)  # decompress blocks instead of reading the CSV
+    if scan.name_prefixes is not None and cluster.load():
+        # Clustered chunk: one binary-searched range per name prefix, plus the tail
+        access['ranges'] = cluster.ranges(scan.name_prefixes, ZoneMap.MAX_READ_BYTES)
+        access['source'] += '/cluster'
+    elif (scan.years is not None or scan.name_prefixes is not None) and zones.load():
+        access['ranges'], access['skipped'] = zones.ranges(scan.name_prefixes, scan.years)
+        access['blocks'] = len(zones.blocks)
+    elif access['read'] is not None:
+        access['ranges'] = compressed.ranges(ZoneMap.MAX_READ_BYTES)
+    if access['ranges'] is not None:
+        access['bytes'] = sum(end - start for start, end in access['ranges'])
+    return access
+
+# Stream filtered DataFrame pieces of one chunk file. When stats is given, the blocks
+# a current zone map let the scan skip are added to stats['skipped'] (of stats['blocks']).
+# With a ChunkCache the chunk is filtered in memory instead of being read from disk.
+# A QueryProfile, when given, records the file and times the read and filter stages.
+# access is the file's chunk_access(), when already taken (see ReadAhead).
+def scan_chunk(file_path, scan, stats=None, cache=None, profile=None, access=None):
+    if access is None:
+        access = chunk_access(file_path, scan, cache)
+    if stats is not None:
+        stats['blocks'] += access['blocks']
+        stats['skipped'] += access['skipped']
+    if profile is not None:
+        profile.add_file(file_path, access['source'], access['bytes'], access['blocks'], access['skipped'])
+
+    if access['source'] == 'cache':
+        with profile_stage(profile, 'read') as entry:
+            chunk, lower_names = cache.frame(file_path)
+            entry['rows_out'] += len(chunk)
+        yield filter_chunk(chunk[scan.columns], scan, lower_names, profile)
+        return
+
+    if access['source'] == 'columnar':
+        # The columnar scan applies the filters itself
+        with profile_stage(profile, 'read') as entry:
+            chunk = ColumnarChunk(file_path).scan(scan.columns, scan.name_prefixes, scan.years)
+            entry['rows_out'] += len(chunk)
+            entry['bytes'] += access['bytes']
+        yield chunk
+        return
+
+    # Define chunk size to read in the data
+    chunk_size = 2000000
+    if access.get('data') is not None:
+        # Bytes read ahead: the whole CSV, or the ranges to parse
+        if access['ranges'] is None:
+            chunks = pd.read_csv(io.BytesIO(access['data'][0]), chunksize=chunk_size, comment='#',
+                                 usecols=scan.columns, dtype=scan_dtypes(scan.columns))
+        else:
+            chunks = parse_ranges(access['data'], scan.columns, chunk_size)
+    elif access['ranges'] is not None:
+        chunks = read_ranges(file_path, access['ranges'], scan.columns, chunk_size, access['read'])
+    else:
+        chunks = pd.read_csv(file_path, chunksize=chunk_size, comment='#', usecols=scan.columns,
+                             dtype=scan_dtypes(scan.columns))
+    if profile is not None:
+        chunks = profile.iterate('read', chunks, access['bytes'])
+
+    for chunk in chunks:
+        yield filter_chunk(chunk, scan, profile=profile)
+
+# Parse only the given [start, end) byte ranges of a chunk CSV (whole lines, no header).
+# read(start, end) returns the bytes of a range; by default they are read from the CSV.
+def read_ranges(file_path, ranges, columns, chunk_size, read=None):
+    return parse_ranges(range_bytes(file_path, ranges, read), columns, chunk_size)
+
+def range_bytes(file_path, ranges, read=None):
+    with open(file_path, 'rb') as chunk_file:
+        for start, end in ranges:
+            if read is not None:
+                yield read(start, end)
+            else:
+                chunk_file.seek(start)
+                yield chunk_file.read(end - start)
+
+def parse_ranges(buffers, columns, chunk_size):
+    for data in buffers:
+        try:
+            yield from pd.read_csv(io.BytesIO(data), header=None, names=FIELDNAMES, chunksize=chunk_size,
+                                   comment='#', usecols=columns, dtype=scan_dtypes(columns))
+        except pd.errors.EmptyDataError:
+            continue  # nothing but tombstones
+
+# chunk_access() of a chunk file plus, in access['data'], the bytes scan_chunk would read
+# from disk (the whole CSV when there are no ranges). Run by ReadAhead's threads.
+def fetch_chunk(file_path, scan):
+    access = chunk_access(file_path, scan)
+    if access['source'] != 'columnar':
+        ranges = access['ranges'] if access['ranges'] is not None else [[0, os.path.getsize(file_path)]]
+        access['data'] = list(range_bytes(file_path, ranges, access['read']))
+    return access
+
+# ----------------------------------------------------------- #
+# READ-AHEAD: PREFETCHING CHUNK FILES FOR IN-PROCESS SCANS
+# ----------------------------------------------------------- #
+# Scans run in this process read the chunk files one after another, so each file's disk
+# reads wait until the previous one is filtered. ReadAhead overlaps the two: while one
+# file is parsed and filtered, up to depth of the following files are read into memory
+# on background threads (only the byte ranges the scan needs, decompressed blocks for a
+# compressed copy). The files in flight for a scan hold at most max_bytes, each counted
+# at its CSV size; a file that does not fit is read when its turn comes, as it would be
+# without read-ahead. Columnar copies are memory-mapped and not read ahead.
+class ReadAhead:
+    def __init__(self, depth=2, max_bytes=256 * 1024 * 1024):
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.executor = None  # started on the first scan that reads ahead
+        self.lock = threading.Lock()
+
+    # (file path, access) for each file in order, with access as from fetch_chunk() for
+    # the files read ahead and from chunk_access() for the others
+    def accesses(self, file_paths, scan, profile=None):
+        pending = deque(file_paths)
+        if self.depth <= 0 or len(pending) < 2:
+            for file_path in pending:
+                yield file_path, chunk_access(file_path, scan)
+            return
+
+        window = deque()  # (file path, bytes held, future or None), in file order
+        held = 0
+        try:
+            while pending or window:
+                while pending and len(window) <= self.depth:
+                    size = os.path.getsize(pending[0])
+                    if held + size > self.max_bytes:
+                        if window:
+                            break  # wait for memory to be handed back
+                        window.append((pending.popleft(), 0, None))  # too big to read ahead
+                        continue
+                    file_path = pending.popleft()
+                    window.append((file_path, size, self._executor().submit(fetch_chunk, file_path, scan)))
+                    held += size
+
+                file_path, size, future = window.popleft()
+                if future is None:
+                    access = chunk_access(file_path, scan)
+                else:
+                    with profile_stage(profile, 'prefetch wait'):
+                        access = future.result()
+                yield file_path, access
+                held -= size
+        finally:
+            for _, _, future in window:
+                if future is not None:
+                    future.cancel()
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.depth, thread_name_prefix='read-ahead')
+            return self.executor
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+# Empty frame with the dtypes of decoded chunk rows, so a chunk whose blocks were all
+# skipped still yields a partial that nlargest(), sorting and concat() accept
+ROW_DTYPES = {'Id': 'int64', 'Name': 'object', 'Year': 'int64', 'Gender': 'object', 'Count': 'int64'}
+
+def empty_frame(columns):
+    return pd.DataFrame({column: pd.Series(dtype=ROW_DTYPES.get(column, 'object')) for column in columns})
+
+def materialize(batches, columns):
+    batches = list(batches)
+    if not batches:
+        return empty_frame(columns)
+    return pd.concat(batches, ignore_index=True)
+
+# Scan one chunk file and reduce it to a partial result for operator (None = keep rows).
+# Returns (partial, zone map stats) so pool workers can report the blocks they skipped;
+# a profile passed to a pool worker comes back filled in as stats['profile'].
+def reduce_chunk(file_path, scan, operator, cache=None, profile=None, access=None):
+    stats = {'blocks': 0, 'skipped': 0}
+    batches = scan_chunk(file_path, scan, stats, cache, profile, access)
+    if profile is None:
+        return _reduce_batches(batches, scan, operator), stats
+
+    stats['profile'] = profile
+    with profile.stage('concat' if operator is None else 'reduce') as entry:
+        partial = _reduce_batches(count_rows(batches, entry), scan, operator)
+        entry['rows_out'] += partial_rows(partial)
+    return partial, stats
+
+# Pass batches through, adding their rows to a profile stage's rows_in
+# Add one chunk's zone map block counts into a query's totals
+def add_zone_stats(zone_stats, stats):
+    if zone_stats is not None:
+        zone_stats['blocks'] += stats['blocks']
+        zone_stats['skipped'] += stats['skipped']
+
+def count_rows(batches, entry):
+    for batch in batches:
+        entry['rows_in'] += partial_rows(batch)
+        yield batch
+
+def _reduce_batches(batches, scan, operator):
+
+    if isinstance(operator, Aggregate):
+        if operator.func == 'sum':
+            return sum(int(batch['Count'].sum()) for batch in batches)
+        return sum(len(batch) for batch in batches)
+
+    if isinstance(operator, TopN):
+        # Only the best n rows of each piece can make the final cut; keep them in file order
+        candidates = []
+        for batch in batches:
+            if operator.ascending:
+                candidates.append(batch.nsmallest(operator.n, 'Count').sort_index())
+            else:
+                candidates.append(batch.nlargest(operator.n, 'Count').sort_index())
+        return materialize(candidates, scan.columns)
+
+    if isinstance(operator, GroupBy):
+        partials = [batch.groupby(operator.column)['Count'].sum() for batch in batches]
+        if not partials:
+            return pd.Series(dtype='int64', name='Count').rename_axis(operator.column)
+        return pd.concat(partials).groupby(level=0).sum()
+
+    return materialize(batches, scan.columns)
+
+# Keep only the n highest (or lowest) counts in a bounded heap while consuming batches
+def top_n(batches, top, columns):
+    heap = []
+    seen = 0  # rows consumed so far; earlier rows win ties
+    sign = -1 if top.ascending else 1
+
+    for batch in batches:
+        if top.n == 0:
+            break
+        batch = batch.reset_index(drop=True)
+        if top.ascending:
+            candidates = batch.nsmallest(top.n, 'Count')
+        else:
+            candidates = batch.nlargest(top.n, 'Count')
+
+        count_position = list(batch.columns).index('Count')
+        for position, row in zip(candidates.index, candidates.itertuples(index=False, name=None)):
+            entry = (sign * row[count_position], -(seen + position), row)
+            if len(heap) < top.n:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+        seen += len(batch)
+
+    rows = [row for _, _, row in sorted(heap, reverse=True)]
+    if not rows:
+        return empty_frame(columns)
+    return pd.DataFrame(rows, columns=columns)
+
+# Combine the per-chunk partial results, given in file order
+def merge_partials(partials, operator, columns):
+    if isinstance(operator, Aggregate):
+        return sum(partials)
+
+    if isinstance(operator, TopN):
+        return top_n(partials, operator, columns)
+
+    if isinstance(operator, GroupBy):
+        partials = list(partials)
+        if not partials:
+            return pd.DataFrame(columns=[operator.column, 'Count'])
+        return pd.concat(partials).groupby(level=0).sum().rename_axis(operator.column).reset_index()
+
+    return materialize(partials, columns)
+
+# ----------------------------------------------------------- #
+# QUERY RESULT: IN-MEMORY ROWS OR SORTED RUNS SPILLED TO DISK
+# ----------------------------------------------------------- #
+# Rows of a FIND result are buffered up to RUN_ROWS at a time. A full buffer is sorted
+# (when the query has ORDER ... BY) and spilled to a temporary run file as pickled blocks
+# of BLOCK_ROWS rows. Reading the result back k-way merges the runs block by block, so
+# memory stays bounded however many rows match. Small results never touch the disk.
+class _Descending:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+class QueryResult:
+    RUN_ROWS = 500000   # rows held in memory before a sorted run is spilled
+    BLOCK_ROWS = 10000  # rows per block in a run file
+
+    def __init__(self, columns, by=None, ascending=None, projection=None, profile=None):
+        self.columns = columns
+        self.by = by
+        self.ascending = ascending
+        self.projection = projection  # RETURN columns (a single name gives a bare column)
+        self.buffer = []
+        self.buffered_rows = 0
+        self.row_count = 0
+        self.runs = []
+        self.temp_dir = None
+        self.profile = profile  # QueryProfile timing the sort, spill and projection (EXPLAIN ANALYZE)
+        self.zone_stats = {'blocks': 0, 'skipped': 0}  # zone map blocks the scan saw/skipped
+
+    def __len__(self):
+        return self.row_count
+
+    # Header of the rows batches() yields
+    @property
+    def output_columns(self):
+        if self.projection is None:
+            return list(self.columns)
+        if isinstance(self.projection, str):
+            return [self.projection]
+        return list(self.projection)
+
+    def add(self, batch):
+        if len(batch) == 0:
+            return
+        self.buffer.append(batch)
+        self.buffered_rows += len(batch)
+        self.row_count += len(batch)
+        if self.buffered_rows >= self.RUN_ROWS:
+            self._spill()
+
+    def _sorted_buffer(self):
+        with profile_stage(self.profile, 'concat', self.buffered_rows) as entry:
+            data = materialize(self.buffer, self.columns)
+            entry['rows_out'] += len(data)
+        if self.by is not None:
+            with profile_stage(self.profile, 'sort', len(data)) as entry:
+                data = data.sort_values(by=self.by, ascending=self.ascending, kind='stable')
+                entry['rows_out'] += len(data)
+        return data.reset_index(drop=True)
+
+    def _spill(self):
+        if self.temp_dir is None:
+            self.temp_dir = tempfile.TemporaryDirectory(prefix="babynames_result_")
+        data = self._sorted_buffer()
+        run_path = os.path.join(self.temp_dir.name, f"run_{len(self.runs)}.pkl")
+        with profile_stage(self.profile, 'spill', len(data)) as entry, open(run_path, 'wb') as run_file:
+            for start in range(0, len(data), self.BLOCK_ROWS):
+                pickle.dump(data.iloc[start:start + self.BLOCK_ROWS], run_file, pickle.HIGHEST_PROTOCOL)
+            entry['bytes'] += run_file.tell()
+        self.runs.append(run_path)
+        self.buffer, self.buffered_rows = [], 0
+
+    def _run_blocks(self, run_path):
+        with open(run_path, 'rb') as run_file:
+            while True:
+                try:
+                    yield pickle.load(run_file)
+                except EOFError:
+                    return
+
+    def _run_rows(self, run_path):
+        for block in self._run_blocks(run_path):
+            yield from block.itertuples(index=False, name=None)
+
+    def _merged_batches(self):
+        positions = [self.columns.index(column) for column in self.by]
+
+        def sort_key(row):
+            return tuple(row[position] if ascending else _Descending(row[position])
+                         for position, ascending in zip(positions, self.ascending))
+
+        # heapq.merge is stable across runs, which were spilled in scan order
+        rows = []
+        for row in heapq.merge(*[self._run_rows(run_path) for run_path in self.runs], key=sort_key):
+            rows.append(row)
+            if len(rows) == self.BLOCK_ROWS:
+                yield pd.DataFrame(rows, columns=self.columns)
+                rows = []
+        if rows:
+            yield pd.DataFrame(rows, columns=self.columns)
+
+    # Result rows in order, as DataFrame (or bare column) blocks
+    def batches(self):
+        if not self.runs:
+            data = self._sorted_buffer() if self.buffer else []
+            blocks = (data.iloc[start:start + self.BLOCK_ROWS] for start in range(0, len(data), self.BLOCK_ROWS))
+        else:
+            if self.buffer:
+                self._spill()
+            if self.by is None:
+                blocks = (block for run_path in self.runs for block in self._run_blocks(run_path))
+            else:
+                blocks = self._merged_batches()
+            if self.profile is not None:
+                blocks = self.profile.iterate('merge runs', blocks)
+
+        for block in blocks:
+            if self.projection is None:
+                yield block
+                continue
+            with profile_stage(self.profile, 'project', len(block)) as entry:
+                block = block[self.projection]
+                entry['rows_out'] += len(block)
+            yield block
+
+    def head(self, n):
+        rows, taken = [], 0
+        for block in self.batches():
+            if taken >= n:
+                break
+            rows.append(block.iloc[:n - taken])
+            taken += len(rows[-1])
+        if rows:
+            return pd.concat(rows)
+        empty = empty_frame(self.columns)
+        return empty if self.projection is None else empty[self.projection]
+
+    # The whole result as one sorted frame, or None once runs were spilled to disk
+    def in_memory_rows(self):
+        if self.runs:
+            return None
+        data = self._sorted_buffer() if self.buffer else empty_frame(self.columns)
+        self.buffer, self.by = [data], None  # already in order
+        return data
+
+    # The first n rows as text, as the CLI prints them
+    def to_text(self, n):
+        return self.head(n).to_string(index=False)
+
+    def close(self):
+        if self.temp_dir is not None:
+            self.temp_dir.cleanup()
+            self.temp_dir = None
+        self.buffer, self.runs = [], []
+
+# ----------------------------------------------------------- #
+# ROW LOOKUPS: SMALL NAME SCANS WITHOUT PANDAS
+# ----------------------------------------------------------- #
+# A row query with a name filter that reads few chunk bytes (an exact name, or a prefix in
+# one chunk) is parsed with the csv module rather than pandas: lookup_rows() filters the
+# byte ranges the zone map, cluster index or compressed copy selects, and RowResult keeps
+# the rows as tuples. RowResult prints its rows without pandas; batches() and head() still
+# build DataFrames, for saving the result and for the query server.
+
+# Rows of one chunk that pass a scan's filters, as tuples of scan.columns (Id, Year and
+# Count as ints). access is the chunk's chunk_access().
+def lookup_rows(file_path, scan, access):
+    ranges = access['ranges'] if access['ranges'] is not None else [[0, os.path.getsize(file_path)]]
+    years = set(scan.years) if scan.years is not None else None
+    positions = [FIELDNAMES.index(column) for column in scan.columns]
+    rows = []
+    for (start, _), data in zip(ranges, range_bytes(file_path, ranges, access['read'])):
+        lines = data.decode('utf-8').splitlines(keepends=True)
+        if start == 0:
+            lines = lines[1:]  # header
+        for row_id, name, year, gender, count in csv.reader(live_lines(lines)):
+            year = int(year)
+            if (years is None or year in years) and name.lower().startswith(scan.name_prefixes):
+                row = (int(row_id), name, year, gender, int(count))
+                rows.append(tuple(row[position] for position in positions))
+    return rows
+
+# Rows as DataFrame.to_string(index=False) prints them: columns right-aligned to their
+# widest value or header (a space in front of the header of a number column), one space
+# apart. A bare column (Series) has no header.
+def format_rows(columns, rows, header=True):
+    if not rows:
+        return "Series([], )" if not header else f"Empty DataFrame\nColumns: [{', '.join(columns)}]\nIndex: []"
+    texts = [[str(value) for value in row] for row in rows]
+    if header:
+        texts.insert(0, [" " + column if ROW_DTYPES.get(column) == 'int64' else column for column in columns])
+    widths = [max(len(row[i]) for row in texts) for i in range(len(columns))]
+    return '\n'.join(' '.join(text.rjust(width) for text, width in zip(row, widths)) for row in texts)
+
+class RowResult(QueryResult):
+    def __init__(self, columns, rows, by=None, ascending=None, projection=None, profile=None):
+        super().__init__(columns, projection=projection, profile=profile)
+        if by is not None:
+            # Stable sorts from the last key to the first, as sort_values(kind='stable')
+            with profile_stage(profile, 'sort', len(rows)) as entry:
+                for column, ascending_key in reversed(list(zip(by, ascending))):
+                    position = columns.index(column)
+                    rows.sort(key=lambda row: row[position], reverse=not ascending_key)
+                entry['rows_out'] += len(rows)
+        self.rows = rows
+        self.row_count = len(rows)
+
+    def _frame(self, rows):
+        frame = pd.DataFrame(rows, columns=self.columns) if rows else empty_frame(self.columns)
+        return frame if self.projection is None else frame[self.projection]
+
+    def batches(self):
+        for start in range(0, len(self.rows), self.BLOCK_ROWS):
+            yield self._frame(self.rows[start:start + self.BLOCK_ROWS])
+
+    def head(self, n):
+        return self._frame(self.rows[:n])
+
+    def to_text(self, n):
+        rows = self.rows[:n]
+        if self.projection is None:
+            return format_rows(self.columns, rows)
+        columns = [self.projection] if isinstance(self.projection, str) else self.projection
+        positions = [self.columns.index(column) for column in columns]
+        return format_rows(columns, [[row[position] for position in positions] for row in rows],
+                           header=not isinstance(self.projection, str))
+
+    # The rows, already in order (cached by execute_plan as a list of tuples)
+    def in_memory_rows(self):
+        return self.rows
+
+    def close(self):
+        self.rows = []
+
+# ----------------------------------------------------------- #
+# RESULT CACHE: FIND RESULTS KEYED BY PLAN AND CHUNK VERSIONS
+# ----------------------------------------------------------- #
+# Sums, counts and in-memory row results of executed plans, in an LRU bounded by memory
+# size. The key is the optimized plan (plan_key) plus the size and mtime of every chunk
+# the plan scans, so a changed chunk never serves an old answer; writes also drop the
+# entries of the chunks they touch right away through invalidate().
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+# Normalized form of an optimized plan: equal keys always produce the same result
+def plan_key(plan):
+    scan = plan.scan
+    key = [tuple(scan.files), tuple(scan.columns),
+           None if scan.name_prefixes is None else tuple(sorted(scan.name_prefixes)),
+           None if scan.years is None else tuple(sorted(scan.years))]
+    for operator in plan.operators:
+        key.append((type(operator).__name__,) + tuple(_freeze(value) for _, value in sorted(vars(operator).items())))
+    return tuple(key)
+
+class ResultCache:
+    ENTRY_OVERHEAD = 256  # rough bytes per entry besides its rows
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, zone stats, chunk paths, bytes)
+        self.by_chunk = {}  # chunk path -> keys of the entries that read it
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, value, zone_stats, file_paths):
+        size = self.ENTRY_OVERHEAD
+        if isinstance(value, list):  # RowResult rows
+            size += sum(sys.getsizeof(row) + sum(sys.getsizeof(field) for field in row) for row in value)
+        elif not isinstance(value, int):
+            size += int(value.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self._drop(key)
+            self.entries[key] = (value, dict(zone_stats), file_paths, size)
+            self.total_bytes += size
+            for file_path in file_paths:
+                self.by_chunk.setdefault(file_path, set()).add(key)
+            while self.total_bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[3]
+            for file_path in entry[2]:
+                keys = self.by_chunk.get(file_path)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.by_chunk[file_path]
+
+    # Forget every result that read a chunk that was just written
+    def invalidate(self, file_path):
+        with self.lock:
+            for key in list(self.by_chunk.get(file_path, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries, self.by_chunk, self.total_bytes = OrderedDict(), {}, 0
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+# ----------------------------------------------------------- #
+# AGGREGATE CUBE: (Name, Gender, Year) -> Count TOTAL, ROW COUNT
+# ----------------------------------------------------------- #
+# Materialized per-chunk totals that answer CONDITION sum / count / group queries without
+# touching chunk rows. Every edit made through ChunkFile and every batch load applies its
+# Count/row deltas and records the chunk's size and mtime after the write; a cube whose
+# recorded stat no longer matches its chunk is discarded and rebuilt from the CSV on the
+# next query. The sidecar (.male_k.csv.cube) is an append-only log of
+#   d,Name,Gender,Year,<Count delta>,<row delta>     and     s,<size>,<mtime_ns>
+# lines, rewritten as a snapshot when it grows too long. Year-range totals come from
+# per-name prefix sums over a dense year array, built on first use.
+class AggregateCube:
+    SNAPSHOT_MIN_LINES = 10000  # rewrite the log once it is this long and 4x the cell count
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.cube_path = sidecar_path(file_path, "cube")
+        self.cells = {}   # (Name, Gender) -> {Year: [Count total, row count]}
+        self.prefix = {}  # (Name, Gender) -> (first year, Count prefix sums, row prefix sums)
+        self.stat = None  # (size, mtime_ns) of the chunk the cube matches
+        self.pending = []
+        self.log_lines = 0
+
+    def _chunk_stat(self):
+        stat = os.stat(self.file_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def is_current(self):
+        return self.stat is not None and os.path.exists(self.file_path) and self.stat == self._chunk_stat()
+
+    # Replay the cube log; returns False when it is missing or does not match the chunk
+    def load(self):
+        if not os.path.exists(self.cube_path):
+            return False
+        with open(self.cube_path, 'r', newline='') as cube_file:
+            for entry in csv.reader(cube_file):
+                if entry[0] == "d":
+                    self._add(entry[1], entry[2], int(entry[3]), int(entry[4]), int(entry[5]))
+                elif entry[0] == "s":
+                    self.stat = [int(entry[1]), int(entry[2])]
+                self.log_lines += 1
+        return self.is_current()
+
+    # One streaming pass over the chunk rows; cells are added in (Name, Gender, Year) order
+    def build(self):
+        self.cells, self.prefix = {}, {}
+        totals = {}
+        with open(self.file_path, 'r', newline='') as chunk_file:
+            reader = csv.reader(live_lines(chunk_file))
+            next(reader, None)  # header
+            for _, name, year, gender, count in reader:
+                cell = totals.setdefault((name, gender, int(year)), [0, 0])
+                cell[0] += int(count)
+                cell[1] += 1
+        for (name, gender, year), (count, rows) in sorted(totals.items()):
+            self._add(name, gender, year, count, rows)
+        self.stat = self._chunk_stat()
+        self._write_snapshot()
+
+    def invalidate(self):
+        self.cells, self.prefix, self.pending, self.stat = {}, {}, [], None
+        if os.path.exists(self.cube_path):
+            os.remove(self.cube_path)
+
+    def _add(self, name, gender, year, count_delta, rows_delta):
+        years = self.cells.setdefault((name, gender), {})
+        cell = years.setdefault(year, [0, 0])
+        cell[0] += count_delta
+        cell[1] += rows_delta
+        if cell[1] <= 0:
+            del years[year]
+            if not years:
+                del self.cells[(name, gender)]
+        self.prefix.pop((name, gender), None)
+
+    # Apply the effect of one row edit (call record_stat() once the chunk write is done)
+    def apply(self, record, count_delta, rows_delta):
+        year = int(record["Year"])
+        self._add(record["Name"], record["Gender"], year, count_delta, rows_delta)
+        self.pending.append(["d", record["Name"], record["Gender"], year, count_delta, rows_delta])
+
+    def record_stat(self):
+        self.stat = self._chunk_stat()
+        if self.log_lines >= self.SNAPSHOT_MIN_LINES and self.log_lines > 4 * sum(len(years) for years in self.cells.values()):
+            self._write_snapshot()
+            return
+        self.pending.append(["s"] + self.stat)
+        with open(self.cube_path, 'a', newline='') as cube_file:
+            csv.writer(cube_file).writerows(self.pending)
+        self.log_lines += len(self.pending)
+        self.pending = []
+
+    def _write_snapshot(self):
+        entries = [["d", name, gender, year, count, rows]
+                   for (name, gender), years in self.cells.items() for year, (count, rows) in years.items()]
+        entries.append(["s"] + self.stat)
+        temp_path = temp_name(self.cube_path)
+        with open(temp_path, 'w', newline='') as cube_file:
+            csv.writer(cube_file).writerows(entries)
+        os.replace(temp_path, self.cube_path)
+        self.log_lines = len(entries)
+        self.pending = []
+
+    # (Count total, row count) of one (Name, Gender) over a year span (low, high) or year set
+    def range_totals(self, key, year_span=None, year_set=None):
+        cells = self.cells[key]
+
+        if year_span is not None:
+            # Contiguous year range: O(1) difference of prefix sums
+            if key not in self.prefix:
+                first_year = min(cells)
+                counts = array('q', bytes(8 * (max(cells) - first_year + 2)))
+                rows = array('q', counts)
+                for year, (count, row_count) in cells.items():
+                    counts[year - first_year + 1] = count
+                    rows[year - first_year + 1] = row_count
+                self.prefix[key] = (first_year, array('q', itertools.accumulate(counts)),
+                                    array('q', itertools.accumulate(rows)))
+            first_year, count_prefix, row_prefix = self.prefix[key]
+            low = min(max(year_span[0] - first_year, 0), len(count_prefix) - 1)
+            high = min(max(year_span[1] - first_year + 1, 0), len(count_prefix) - 1)
+            return int(count_prefix[high] - count_prefix[low]), int(row_prefix[high] - row_prefix[low])
+
+        count, rows = 0, 0
+        for year, cell in cells.items():
+            if year_set is None or year in year_set:
+                count += cell[0]
+                rows += cell[1]
+        return count, rows
+
+    # Same partial result reduce_chunk() would produce for a sum/count/group operator
+    def partial(self, scan, operator):
+        year_span, year_set = None, None
+        if scan.years is not None:
+            year_set = set(scan.years)
+            if len(year_set) > 1 and max(year_set) - min(year_set) == len(year_set) - 1:
+                year_span = (min(year_set), max(year_set))
+
+        totals = {}
+        for key, cells in self.cells.items():
+            name, gender = key
+            if scan.name_prefixes is not None and not name.lower().startswith(scan.name_prefixes):
+                continue
+
+            if isinstance(operator, GroupBy) and operator.column == 'Year':
+                for year, (count, rows) in cells.items():
+                    if year_set is None or year in year_set:
+                        totals[year] = totals.get(year, 0) + count
+                continue
+
+            count, rows = self.range_totals(key, year_span, year_set)
+            if rows == 0:
+                continue
+            if isinstance(operator, Aggregate):
+                group = operator.func
+                count = count if operator.func == 'sum' else rows
+            else:
+                group = name if operator.column == 'Name' else gender
+            totals[group] = totals.get(group, 0) + count
+
+        if isinstance(operator, Aggregate):
+            return totals.get(operator.func, 0)
+        return pd.Series(totals, dtype='int64', name='Count')
+
+# ----------------------------------------------------------- #
+# CHUNK CATALOG: ROWS, MAX Id, Count TOTAL AND YEAR RANGE PER FILE
+# ----------------------------------------------------------- #
+# <directory>/.catalog is a JSON manifest of every chunk file in the directory:
+#   {"male_k.csv": {"rows": .., "max_id": .., "count": .., "min_year": .., "max_year": ..,
+#                   "size": .., "mtime_ns": ..}, ...}
+# Write paths validate a chunk's entry before they write (entry()), apply their row and
+# Count deltas after it (apply()) and then rewrite the file atomically (save()). The year
+# range only ever widens, so it bounds the years present. An entry whose size/mtime no
+# longer match its chunk is rebuilt from the chunk, and a missing catalog is rebuilt from
+# the chunk files in the directory listing; other files (a README, unrelated CSVs) are
+# left out of it.
+class ChunkCatalog:
+    CHUNK_NAME = re.compile(r"(male|female)_[^./]+\.csv")  # male_k.csv, or a partition such as male_jo.csv
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.catalog_path = os.path.join(directory, ".catalog")
+        self.entries = None  # filename -> entry, read on first use
+        self.file_stat = None  # stat of the catalog file as last read or written here
+        self.lock = threading.RLock()  # the query server writes different chunks concurrently
+
+    def _catalog_stat(self):
+        try:
+            stat = os.stat(self.catalog_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _read(self):
+        with open(self.catalog_path, 'r') as catalog_file:
+            self.file_stat = self._catalog_stat()
+            return json.load(catalog_file)
+
+    def _load(self):
+        with self.lock:
+            if self.entries is None:
+                if os.path.exists(self.catalog_path):
+                    self.entries = self._read()
+                else:
+                    self.entries = {}
+                    for filename in os.listdir(self.directory):
+                        if self.is_chunk(filename):
+                            self.entries[filename] = self._scan(filename)
+                    self.save()
+            return self.entries
+
+    def filenames(self):
+        with self.lock:
+            return sorted(self._load())
+
+    # Whether a file in the directory is a chunk: named like one, with the chunk header
+    def is_chunk(self, filename):
+        file_path = os.path.join(self.directory, filename)
+        if not self.CHUNK_NAME.fullmatch(filename) or not os.path.isfile(file_path):
+            return False
+        with open(file_path, 'r', newline='') as chunk_file:
+            return next(csv.reader(chunk_file), None) == FIELDNAMES
+
+    def _stat(self, filename):
+        stat = os.stat(os.path.join(self.directory, filename))
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    # Recompute an entry from the chunk rows; max_id never goes below a previous value
+    def _scan(self, filename, max_id=-1):
+        entry = {"rows": 0, "max_id": max_id, "count": 0, "min_year": None, "max_year": None}
+        with open(os.path.join(self.directory, filename), 'r', newline='') as chunk_file:
+            reader = csv.reader(live_lines(chunk_file))
+            next(reader, None)  # header
+            years = set()
+            for row_id, _, year, _, count in reader:
+                entry["rows"] += 1
+                entry["count"] += int(count)
+                entry["max_id"] = max(entry["max_id"], int(row_id))
+                years.add(year)
+        if years:
+            entry["min_year"], entry["max_year"] = min(map(int, years)), max(map(int, years))
+        entry.update(self._stat(filename))
+        return entry
+
+    # Entry for a chunk (None if there is no such file), rebuilt first if the chunk
+    # changed behind the catalog's back
+    def entry(self, filename):
+        with self.lock:
+            entries = self._load()
+            entry = entries.get(filename)
+            if not os.path.exists(os.path.join(self.directory, filename)):
+                if entries.pop(filename, None) is not None:
+                    self.save()
+                return None
+            if entry is None or [entry["size"], entry["mtime_ns"]] != list(self._stat(filename).values()):
+                entry = entries[filename] = self._scan(filename, entry["max_id"] if entry else -1)
+                self.save()
+            return entry
+
+    # Record a write: deltas are (record, Count delta, row delta) tuples
+    def apply(self, filename, deltas, max_id=-1):
+        with self.lock:
+            entry = self._load().setdefault(filename, {"rows": 0, "max_id": -1, "count": 0,
+                                                       "min_year": None, "max_year": None})
+            for record, count_delta, rows_delta in deltas:
+                entry["rows"] += rows_delta
+                entry["count"] += count_delta
+                year = int(record["Year"])
+                entry["min_year"] = year if entry["min_year"] is None else min(entry["min_year"], year)
+                entry["max_year"] = year if entry["max_year"] is None else max(entry["max_year"], year)
+                entry["max_id"] = max(entry["max_id"], int(record["Id"]))
+            entry["max_id"] = max(entry["max_id"], max_id)
+            entry.update(self._stat(filename))
+
+    # Start a fresh entry for a newly created chunk file
+    def reset(self, filename):
+        with self.lock:
+            self._load()[filename] = dict({"rows": 0, "max_id": -1, "count": 0, "min_year": None, "max_year": None},
+                                          **self._stat(filename))
+
+    def save(self):
+        with self.lock:
+            if self.file_stat is not None and self._catalog_stat() not in (None, self.file_stat):
+                self._merge(self._read())
+            temp_path = temp_name(self.catalog_path)
+            with open(temp_path, 'w') as catalog_file:
+                json.dump(self.entries, catalog_file, indent=1, sort_keys=True)
+            os.replace(temp_path, self.catalog_path)
+            self.file_stat = self._catalog_stat()
+
+    # Take the entries another process saved for chunks it wrote since this catalog read
+    # them, so saving does not put stale entries back (they would only cost a rescan)
+    def _merge(self, saved):
+        for filename, entry in saved.items():
+            if not os.path.exists(os.path.join(self.directory, filename)):
+                continue
+            stat = list(self._stat(filename).values())
+            ours = self.entries.get(filename)
+            if [entry["size"], entry["mtime_ns"]] == stat and \
+                    (ours is None or [ours["size"], ours["mtime_ns"]] != stat):
+                self.entries[filename] = entry
+
+# ----------------------------------------------------------- #
+# PARTITION MAP: ADAPTIVE SPLITTING OF SKEWED CHUNK GROUPS
+# ----------------------------------------------------------- #
+# A chunk group holds the rows of one gender and first letter (male_j.csv in the plain
+# layout). Once a group file grows past BabyNamesDatabase.partition_bytes it is split
+# into partitions covering ranges of lowercase names, each named after the name prefix
+# its range starts at: male_j.csv then holds [j, jo) and male_jo.csv holds [jo, k).
+# Partitions that shrink are merged back into a neighbour. <directory>/.partitions (JSON)
+# lists the range starts of every split group; groups it does not list are one file.
+# A repartition writes the new files under hidden .repartition names, records the renames
+# still to do in the map (the commit point), then performs them. Loading the map finishes
+# a committed repartition that was interrupted and discards one that never committed.
+class PartitionMap:
+    def __init__(self, directory):
+        self.directory = directory
+        self.map_path = os.path.join(directory, ".partitions")
+        self.groups = None  # group ('male_j') -> sorted range starts, read on first use
+        self.recovered = []  # files rewritten while finishing an interrupted repartition
+        self.file_stat = None  # stat of the map file as last read or written here
+        self.lock = threading.RLock()
+
+    def _map_stat(self):
+        try:
+            stat = os.stat(self.map_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _load(self):
+        with self.lock:
+            if self.groups is None:
+                state = {"groups": {}}
+                self.file_stat = self._map_stat()
+                if os.path.exists(self.map_path):
+                    with open(self.map_path, 'r') as map_file:
+                        state = json.load(map_file)
+                self.groups = state["groups"]
+                if state.get("pending"):
+                    self._finish(state["pending"])
+                    self.save()
+                    self.recovered = state["pending"]["replace"] + state["pending"]["remove"]
+                for filename in os.listdir(self.directory):
+                    if filename.startswith(".") and filename.endswith(".repartition"):
+                        os.remove(os.path.join(self.directory, filename))
+            return self.groups
+
+    # Load the map; returns the filenames an interrupted repartition rewrote or removed
+    def recover(self):
+        with self.lock:
+            self._load()
+            recovered, self.recovered = self.recovered, []
+            return recovered
+
+    # Whether another process saved the map since it was read here
+    def changed(self):
+        return self._map_stat() != self.file_stat
+
+    # Read the map again (see recover())
+    def reload(self):
+        with self.lock:
+            self.groups = None
+            return self.recover()
+
+    # 'male_jo.csv' -> ('male_j', 'jo')
+    @staticmethod
+    def group_of(filename):
+        gender, _, start = filename[:-len(".csv")].partition('_')
+        return f"{gender}_{start[:1]}", start
+
+    def starts(self, group):
+        return self._load().get(group) or [group.partition('_')[2]]
+
+    # Filename of the partition of group that holds name
+    def route(self, group, name):
+        starts = self.starts(group)
+        start = starts[max(0, bisect.bisect_right(starts, name.lower()) - 1)]
+        return f"{group.partition('_')[0]}_{start}.csv"
+
+    # Partition filenames of group, in name order, that can hold a name starting with one
+    # of name_prefixes (None = every partition)
+    def files(self, group, name_prefixes=None):
+        starts = self.starts(group)
+        filenames = []
+        for i, start in enumerate(starts):
+            end = starts[i + 1] if i + 1 < len(starts) else None
+            if name_prefixes is None or any((end is None or prefix < end)
+                                            and (start <= prefix or start.startswith(prefix))
+                                            for prefix in name_prefixes):
+                filenames.append(f"{group.partition('_')[0]}_{start}.csv")
+        return filenames
+
+    # Range starts that cut a partition into about `parts` pieces of equal size. A cut
+    # goes before a name, at its shortest prefix sorting after the name preceding it.
+    def split_starts(self, filename, parts):
+        sizes = {}
+        for line, name in self._rows(filename):
+            sizes[name] = sizes.get(name, 0) + len(line)
+        starts = [self.group_of(filename)[1]]
+        names = sorted(sizes)
+        total, taken = sum(sizes.values()), 0
+        for previous, name in zip(names, names[1:]):
+            taken += sizes[previous]
+            if len(starts) == parts:
+                break
+            if taken >= total * len(starts) / parts:
+                start = next(name[:i] for i in range(1, len(name) + 1) if name[:i] > previous)
+                if all(char in string.ascii_lowercase for char in start):
+                    starts.append(start)
+        return starts
+
+    # Live row lines of a partition with their lowercase names
+    def _rows(self, filename):
+        with open(os.path.join(self.directory, filename), 'r', newline='') as source:
+            next(source, None)  # header
+            for line in live_lines(source):
+                if '"' in line:
+                    name = next(csv.reader([line]))[1]
+                else:
+                    name = line.split(',', 2)[1]
+                yield line, name.lower()
+
+    # Rewrite adjacent partitions `filenames` of group as partitions starting at
+    # new_starts. Returns the filenames written and the filenames removed.
+    def repartition(self, group, filenames, new_starts):
+        with self.lock:
+            gender = group.partition('_')[0]
+            written = [f"{gender}_{start}.csv" for start in new_starts]
+            outputs = []
+            try:
+                for filename in written:
+                    outputs.append(open(sidecar_path(os.path.join(self.directory, filename), "repartition"),
+                                        'w', newline=''))
+                    csv.writer(outputs[-1]).writerow(FIELDNAMES)
+                for filename in filenames:
+                    for line, name in self._rows(filename):
+                        outputs[max(0, bisect.bisect_right(new_starts, name) - 1)].write(line)
+                for output in outputs:
+                    output.flush()
+                    os.fsync(output.fileno())
+            finally:
+                for output in outputs:
+                    output.close()
+
+            starts = set(self.starts(group))
+            starts.difference_update(self.group_of(filename)[1] for filename in filenames)
+            starts = sorted(starts.union(new_starts))
+            if len(starts) > 1:
+                self.groups[group] = starts
+            else:
+                self.groups.pop(group, None)
+            pending = {"replace": written, "remove": [filename for filename in filenames if filename not in written]}
+            self.save(pending)
+            self._finish(pending)
+            self.save()
+            return written, pending["remove"]
+
+    def _finish(self, pending):
+        for filename in pending["replace"]:
+            file_path = os.path.join(self.directory, filename)
+            if os.path.exists(sidecar_path(file_path, "repartition")):
+                drop_sidecars(file_path)
+                os.replace(sidecar_path(file_path, "repartition"), file_path)
+        for filename in pending["remove"]:
+            file_path = os.path.join(self.directory, filename)
+            drop_sidecars(file_path)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def save(self, pending=None):
+        with self.lock:
+            state = {"groups": self.groups}
+            if pending:
+                state["pending"] = pending
+            temp_path = temp_name(self.map_path)
+            with open(temp_path, 'w') as map_file:
+                json.dump(state, map_file, indent=1, sort_keys=True)
+                map_file.flush()
+                os.fsync(map_file.fileno())
+            os.replace(temp_path, self.map_path)
+            self.file_stat = self._map_stat()
+
+# ----------------------------------------------------------- #
+# CHUNK LOCKS: READERS-WRITER LOCKS SHARED BETWEEN PROCESSES
+# ----------------------------------------------------------- #
+# Advisory fcntl.flock() locks on hidden lock files, so several CLI, server and script
+# processes can work on one data directory. BabyNamesDatabase keeps one lock file per
+# chunk group (.male_k.csv.lock, covering every partition of the group): queries hold
+# shared locks on the groups they scan, and inserts, deletes, updates and batch loads
+# hold exclusive locks on the groups they write, so writers of different letters and
+# genders run in parallel. Around those sit <directory>/.lock (shared by every operation,
+# exclusive while the directory is cleared), <directory>/.load.lock (one batch load at a
+# time) and <directory>/.partitions.lock (repartitions and reloads of the partition map).
+#
+# Locks belong to the process: threads share them (csv_server.py orders its own threads)
+# and taking a lock the process already holds just counts another user. An exclusive
+# lock can be retained past its last user, until the changes made under it are
+# checkpointed (see BabyNamesDatabase._write_locks); when a lock is contended while
+# others are retained, on_contention is called first to checkpoint and let them go, so
+# processes never wait on each other's retained locks. While a writer holds a group,
+# the lock file names the log holding the group's changes that may not be in its chunks
+# yet (a mark); a process that takes over the lock from a writer that died replays them
+# before writing.
+class ChunkLocks:
+    def __init__(self, on_contention=None):
+        self.on_contention = on_contention
+        self.condition = threading.Condition()
+        self.held = {}  # lock file path -> {file, exclusive, users, retained, busy, mark}
+
+    # Take a lock; returns False (without waiting) when blocking is False and it is taken
+    def acquire(self, path, exclusive=False, blocking=True):
+        if self._acquire(path, exclusive, wait=False):
+            return True
+        if not blocking:
+            return False
+        if self.on_contention is not None and self._retaining():
+            self.on_contention()
+        return self._acquire(path, exclusive, wait=True)
+
+    def _acquire(self, path, exclusive, wait):
+        with self.condition:
+            while True:
+                entry = self.held.get(path)
+                if entry is None:
+                    entry = self.held[path] = {"file": None, "exclusive": False, "users": 0,
+                                               "retained": False, "busy": True, "mark": None}
+                    break
+                if entry["busy"]:
+                    self.condition.wait()
+                elif entry["exclusive"] or not exclusive:
+                    entry["users"] += 1
+                    return True
+                else:
+                    entry["busy"] = True  # shared -> exclusive; flock() converts the lock
+                    break
+
+        acquired = False
+        try:
+            if entry["file"] is None:
+                entry["file"] = open(path, 'a+b')
+            mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            try:
+                fcntl.flock(entry["file"].fileno(), mode if wait else mode | fcntl.LOCK_NB)
+                acquired = True
+            except BlockingIOError:
+                pass
+        finally:
+            with self.condition:
+                entry["busy"] = False
+                if acquired:
+                    entry["exclusive"] = entry["exclusive"] or exclusive
+                    entry["users"] += 1
+                elif entry["users"] == 0 and not entry["retained"]:
+                    self._unlock(path, entry)
+                self.condition.notify_all()
+        return acquired
+
+    def release(self, path):
+        with self.condition:
+            entry = self.held[path]
+            entry["users"] -= 1
+            if entry["users"] == 0 and not entry["retained"]:
+                self._unlock(path, entry)
+
+    # Take several locks in a fixed order (so processes cannot deadlock), release them on exit
+    @contextlib.contextmanager
+    def hold(self, paths, exclusive=False):
+        taken = []
+        try:
+            for path in sorted(set(paths)):
+                self.acquire(path, exclusive)
+                taken.append(path)
+            yield
+        finally:
+            for path in reversed(taken):
+                self.release(path)
+
+    # Keep a held exclusive lock after its last release, until release_retained()
+    def retain(self, path):
+        with self.condition:
+            self.held[path]["retained"] = True
+
+    def _retaining(self):
+        with self.condition:
+            return any(entry["retained"] for entry in self.held.values())
+
+    def release_retained(self):
+        with self.condition:
+            for path, entry in list(self.held.items()):
+                if entry["retained"]:
+                    entry["retained"] = False
+                    if entry["users"] == 0:
+                        self._unlock(path, entry)
+
+    # Mark written by whoever held the lock exclusively before, or '' when there is none
+    def read_mark(self, path):
+        lock_file = self.held[path]["file"]
+        lock_file.seek(0)
+        return lock_file.read().decode('utf-8')
+
+    # Our own mark on a lock this process holds, or None when it has not marked it
+    def own_mark(self, path):
+        with self.condition:
+            return self.held[path]["mark"]
+
+    # Name the log of the changes made under a held exclusive lock; on disk before any of
+    # them, since a takeover after a crash goes by it. Cleared when the lock is released.
+    def mark(self, path, owner):
+        with self.condition:
+            entry = self.held[path]
+            entry["file"].truncate(0)
+            entry["file"].write(owner.encode('utf-8'))
+            entry["file"].flush()
+            os.fsync(entry["file"].fileno())
+            entry["mark"] = owner
+
+    def _unlock(self, path, entry):
+        if entry["file"] is not None:
+            if entry["mark"]:
+                entry["file"].truncate(0)
+            fcntl.flock(entry["file"].fileno(), fcntl.LOCK_UN)
+            entry["file"].close()
+        del self.held[path]
+
+# ----------------------------------------------------------- #
+# WRITE-AHEAD LOG (GROUP COMMIT)
+# ----------------------------------------------------------- #
+# Inserts, deletes and updates are first appended to a log of the writing process,
+# <directory>/.wal-<pid>-<random>, as
+#   <seq>,u,<chunk filename>,Id,Name,Year,Gender,Count     (row's new content)
+#   <seq>,x,<chunk filename>,Id,Name,Year,,                (row deleted)
+# lines. Entries record a row's resulting state rather than a delta, so replaying a log
+# whose changes already partly reached the chunks is harmless. Commits are grouped: a
+# caller that finds no flush in progress writes out every queued entry with one fsync,
+# and callers arriving meanwhile wait for the next flush, which covers all of them.
+# BabyNamesDatabase applies the logged changes to the chunk CSVs in checkpoints and
+# empties the log once they are durable there. The process holds an flock on its log
+# while it lives, so a log whose lock is free was left by a crash (orphans()) and is
+# replayed by the next process to open the directory (.wal is the log of earlier
+# versions, which had one per directory).
+class WriteAheadLog:
+    def __init__(self, directory):
+        self.directory = directory
+        self.log_path = os.path.join(directory, f".wal-{os.getpid()}-{os.urandom(4).hex()}")
+        self.condition = threading.Condition()
+        self.queue = []          # encoded entries waiting for the next flush
+        self.last_seq = 0        # sequence number of the last queued entry
+        self.durable_seq = 0     # sequence number of the last fsynced entry
+        self.flushing = False
+        self.log_file = None
+        self.reset_seq = 0       # last_seq when the log was last emptied
+        self._open()
+
+    def _open(self):
+        self.log_file = open(self.log_path, 'a', newline='')
+        fcntl.flock(self.log_file.fileno(), fcntl.LOCK_EX)
+
+    # Complete entries of a log, as [op, filename, Id, Name, Year, Gender, Count]
+    @staticmethod
+    def read(log_path):
+        entries = []
+        with open(log_path, 'r', newline='') as log_file:
+            for line in log_file:
+                entry = next(csv.reader([line]), [])
+                if not line.endswith('\n') or len(entry) != 8:
+                    break  # torn write at the tail, never acknowledged
+                entries.append(entry[1:])
+        return entries
+
+    # Logs of other processes that are gone, as (path, open file) pairs; close the file
+    # once done. A log of earlier versions is held exclusively, so only one process
+    # replays it.
+    def orphans(self):
+        for filename in sorted(os.listdir(self.directory)):
+            log_path = os.path.join(self.directory, filename)
+            if (filename != ".wal" and not filename.startswith(".wal-")) or log_path == self.log_path:
+                continue
+            log_file = self.owner_gone(log_path, exclusive=filename == ".wal")
+            if log_file is not None:
+                yield log_path, log_file
+
+    # The log, opened and locked, when the process that wrote it is gone; else None. The
+    # lock is shared unless exclusive is set, so processes checking at once all see it.
+    @staticmethod
+    def owner_gone(log_path, exclusive=False):
+        try:
+            log_file = open(log_path, 'r', newline='')
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(log_file.fileno(), (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log_file.close()
+            return None
+        return log_file
+
+    # Queue entries for the next group commit; returns the sequence number to wait for
+    def append(self, entries):
+        with self.condition:
+            for entry in entries:
+                self.last_seq += 1
+                buffer = io.StringIO()
+                csv.writer(buffer, lineterminator='\n').writerow([self.last_seq] + list(entry))
+                self.queue.append(buffer.getvalue())
+            return self.last_seq
+
+    # Block until every entry up to seq is on disk, flushing the queue if nobody else is
+    def wait(self, seq):
+        with self.condition:
+            while self.durable_seq < seq:
+                if self.flushing:
+                    self.condition.wait()
+                    continue
+                self.flushing = True
+                batch, self.queue = self.queue, []
+                batch_seq = self.last_seq
+                self.condition.release()
+                try:
+                    if self.log_file is None:
+                        self._open()
+                    self.log_file.write(''.join(batch))
+                    self.log_file.flush()
+                    os.fsync(self.log_file.fileno())
+                except BaseException:
+                    self.condition.acquire()
+                    self.queue = batch + self.queue  # retried by the next flush
+                    self.flushing = False
+                    self.condition.notify_all()
+                    raise
+                self.condition.acquire()
+                self.flushing = False
+                self.durable_seq = batch_seq
+                self.condition.notify_all()
+
+    def commit(self, entries):
+        self.wait(self.append(entries))
+
+    # Empty the log once everything in it has been checkpointed into the chunks
+    def reset(self):
+        self.wait(self.last_seq)
+        with self.condition:
+            if self.last_seq == self.reset_seq:
+                return
+            if self.log_file is None:
+                self._open()
+            self.log_file.truncate(0)
+            os.fsync(self.log_file.fileno())
+            self.reset_seq = self.last_seq
+
+    # Close the log, removing it when everything in it was checkpointed
+    def close(self):
+        if self.log_file is not None:
+            if self.last_seq == self.reset_seq:
+                os.remove(self.log_path)
+            self.log_file.close()
+            self.log_file = None
+
+# ----------------------------------------------------------- #
+# LOAD CHECKPOINT: RESUMABLE BATCH LOADS
+# ----------------------------------------------------------- #
+# A batch load records its progress in <directory>/.load (JSON):
+#   source, source_size, source_mtime_ns   the file being loaded
+#   id, batches       random id of the load, and the number of batches it has finished
+#   offset            source bytes loaded so far (whole rows, header included)
+#   rows, merged      source rows loaded so far, and how many were merged into duplicates
+#   chunks            rows appended to each chunk file so far
+#   batch             chunk sizes before the batch being written (null for a new chunk)
+# The sizes are saved before a batch is written. Once its rows are synced to disk the
+# offset moves past it and the sizes are cleared. After a crash, rollback() truncates the
+# chunks of the unfinished batch back to those sizes and removes the chunks it created, and
+# the next load of the same, unchanged file can resume from the saved offset. A load
+# holds <directory>/.load.lock throughout. Before a batch is written, the lock file of
+# each chunk group it writes is marked with batch_mark() (see ChunkLocks), and a group
+# is only rolled back while it still carries the mark of the unfinished batch: then no
+# other process has written it since, and a writer taking over the group from a load
+# that died rolls it back first.
+class LoadCheckpoint:
+    MARK = ".load"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.state_path = os.path.join(directory, ".load")
+        self.lock_path = os.path.join(directory, ".load.lock")
+        self.state = None
+
+    def load(self):
+        self.state = None
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as state_file:
+                self.state = json.load(state_file)
+        return self.state
+
+    @staticmethod
+    def _source(csv_file_path):
+        stat = os.stat(csv_file_path)
+        return {"source": os.path.abspath(csv_file_path), "source_size": stat.st_size,
+                "source_mtime_ns": stat.st_mtime_ns}
+
+    # True when the saved progress is for this source file, unchanged since
+    def matches(self, csv_file_path):
+        return self.state is not None and all(self.state.get(key) == value
+                                              for key, value in self._source(csv_file_path).items())
+
+    def start(self, csv_file_path):
+        self.state = dict(self._source(csv_file_path), id=os.urandom(4).hex(), batches=0, offset=0, rows=0,
+                          merged=0, chunks={}, batch=None)
+        self.save()
+
+    # Lock file mark of the groups written by the batch after the last finished one
+    def batch_mark(self):
+        return f"{self.MARK} {self.state.get('id')} {self.state.get('batches', 0) + 1}"
+
+    def begin_batch(self, sizes):
+        self.state["batch"] = sizes
+        self.save()
+
+    def commit_batch(self, offset, rows, merged, chunk_rows):
+        self.state["offset"] = offset
+        self.state["batches"] = self.state.get("batches", 0) + 1
+        self.state["rows"] += rows
+        self.state["merged"] += merged
+        for filename, count in chunk_rows.items():
+            self.state["chunks"][filename] = self.state["chunks"].get(filename, 0) + count
+        self.state["batch"] = None
+        self.save()
+
+    # Chunk filenames of the unfinished batch, if any
+    def batch_files(self):
+        if self.load() is None or not self.state.get("batch"):
+            return []
+        return sorted(self.state["batch"])
+
+    # Undo the unfinished batch (only its chunks in filenames, when given); returns the
+    # chunk paths it touched. The state is only saved by the process holding the load lock.
+    def rollback(self, filenames=None, save=True):
+        if self.load() is None or not self.state.get("batch"):
+            return []
+        file_paths = []
+        for filename, size in list(self.state["batch"].items()):
+            if filenames is not None and filename not in filenames:
+                continue
+            del self.state["batch"][filename]
+            file_path = os.path.join(self.directory, filename)
+            file_paths.append(file_path)
+            if not os.path.exists(file_path):
+                continue
+            if size is None:
+                os.remove(file_path)
+                drop_sidecars(file_path)
+            elif os.path.getsize(file_path) > size:
+                with open(file_path, 'r+b') as chunk_file:
+                    chunk_file.truncate(size)
+                    os.fsync(chunk_file.fileno())
+        self.state["batch"] = self.state["batch"] or None
+        if save:
+            self.save()
+        return file_paths
+
+    def clear(self):
+        self.state = None
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def save(self):
+        temp_path = temp_name(self.state_path)
+        with open(temp_path, 'w') as state_file:
+            json.dump(self.state, state_file, indent=1, sort_keys=True)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(temp_path, self.state_path)
+
+# ----------------------------------------------------------- #
+# CHUNK WRITER POOL (BATCH LOADS)
+# ----------------------------------------------------------- #
+# Keeps a bounded LRU set of open, buffered chunk writers so batch loads do not open
+# and close a chunk file for every row. The least recently used writer is closed
+# once more than max_open chunks are being written.
+class ChunkWriterPool:
+    def __init__(self, max_open=32, buffer_size=1024 * 1024):
+        self.max_open = max_open
+        self.buffer_size = buffer_size
+        self.writers = OrderedDict()  # chunk file path -> (file, csv.DictWriter)
+
+    def writer(self, file_path):
+        if file_path in self.writers:
+            self.writers.move_to_end(file_path)
+            return self.writers[file_path][1]
+
+        if len(self.writers) >= self.max_open:
+            _, (old_file, _) = self.writers.popitem(last=False)
+            old_file.flush()
+            os.fsync(old_file.fileno())  # rows written since the last flush(sync=True) must be durable too
+            old_file.close()
+
+        # Write header only if the file is newly created
+        write_header = not os.path.exists(file_path) or os.path.getsize(file_path) == 0
+        chunk_csvfile = open(file_path, 'a', newline='', buffering=self.buffer_size)
+        chunk_writer = csv.DictWriter(chunk_csvfile, fieldnames=FIELDNAMES)
+        if write_header:
+            chunk_writer.writeheader()
+
+        self.writers[file_path] = (chunk_csvfile, chunk_writer)
+        return chunk_writer
+
+    # Push buffered rows to the chunk files; with sync=True also force them to disk
+    def flush(self, sync=False):
+        for chunk_csvfile, _ in self.writers.values():
+            chunk_csvfile.flush()
+            if sync:
+                os.fsync(chunk_csvfile.fileno())
+
+    def close(self):
+        while self.writers:
+            _, (chunk_csvfile, _) = self.writers.popitem(last=False)
+            chunk_csvfile.close()
+
+# ----------------------------------------------------------- #
+# RESULT SINK (SAVED QUERY RESULTS)
+# ----------------------------------------------------------- #
+# Streams DataFrame blocks to a CSV file, gzip/bz2/xz-compressed when the filename ends
+# in .gz/.bz2/.xz. A writer thread formats, compresses and writes the blocks while the
+# caller goes on scanning or merging; it holds at most max_pending blocks plus one write
+# buffer of buffer_size bytes, so a save runs in constant memory however many rows it
+# exports.
+class ResultSink:
+    COMPRESSORS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+    def __init__(self, csv_filename, columns, buffer_size=1024 * 1024, max_pending=4):
+        opener = self.COMPRESSORS.get(os.path.splitext(csv_filename)[1].lower(), open)
+        self.file = opener(csv_filename, 'wb')
+        self.buffer_size = buffer_size
+        self.buffer = bytearray((','.join(columns) + os.linesep).encode())
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_blocks, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_blocks(self):
+        while True:
+            block = self.pending.get()
+            if block is None:
+                break
+            if self.error is not None:
+                continue  # drain the queue so the producer is never blocked
+            try:
+                self.buffer += block.to_csv(index=False, header=False).encode()
+                if len(self.buffer) >= self.buffer_size:
+                    self.file.write(self.buffer)
+                    self.buffer = bytearray()
+            except Exception as e:
+                self.error = e
+
+    def write(self, block):
+        if self.error is not None:
+            raise self.error
+        if len(block):
+            self.pending.put(block)
+
+    def close(self):
+        if self.file is None:
+            return
+        self.pending.put(None)
+        self.thread.join()
+        try:
+            if self.error is None:
+                self.file.write(self.buffer)
+        finally:
+            self.file.close()
+            self.file = None
+        if self.error is not None:
+            raise self.error
 
 class BabyNamesDatabase:
+    PLAN_CACHE_SIZE = 128  # compiled FIND plans kept for repeated statements
+    PARALLEL_MIN_BYTES = 16 * 1024 * 1024  # scans smaller than this stay in-process
+    ROW_LOOKUP_BYTES = 4 * 1024 * 1024     # row queries with a name filter reading less are csv lookups
+    CHECKPOINT_DELAY = 1.0        # seconds logged changes may wait before a checkpoint
+    CHECKPOINT_CHANGES = 10000    # checkpoint at once when this many changes are pending
+
     def __init__(self, file_path):
         self.file_path = file_path
         self.names_data = []  #Initialize a list
+        self.chunks = {}  # chunk file path -> ChunkFile, opened lazily
+        self.cubes = {}  # chunk file path -> AggregateCube, loaded lazily
+        self.plan_cache = OrderedDict()  # normalized query text -> optimized QueryPlan
+        self.result_cache = ResultCache()  # results of repeated plans over unchanged chunks
+        self.max_workers = os.cpu_count() or 1  # process pool size for multi-chunk scans
+        self.process_pool = None  # started on the first wide scan
+        self.read_ahead = ReadAhead()  # prefetches the next chunk files of in-process scans
+        self.save_buffer_size = 1024 * 1024  # write buffer for saved query results, in bytes
+        self.zone_maps = {}  # chunk file path -> ZoneMap, loaded lazily
+        self.wals = {}  # data directory -> WriteAheadLog, replayed when first opened
+        self.catalogs = {}  # data directory -> ChunkCatalog
+        self.partition_maps = {}  # data directory -> PartitionMap
+        self.partition_bytes = 64 * 1024 * 1024  # chunk files past this size are split (see PartitionMap)
+        self.chunk_cache = None  # optional ChunkCache of decoded chunks (server mode)
+        self.metadata_lock = threading.RLock()  # guards cube, zone map and catalog setup across threads
+        self.pending = {}  # chunk file path -> {(Name, Year): {Id: new row or None}} not yet checkpointed
+        self.next_ids = {}  # chunk file path -> next Id to hand out while changes are pending
+        self.pending_changes = 0
+        self.pending_lock = threading.Lock()
+        self.checkpoint_timer = None  # background checkpoint, armed by the first pending change
+        self.locks = ChunkLocks(on_contention=self.checkpoint)  # file locks shared with other processes
+
+    # Open (or refresh) the indexed ChunkFile for an existing chunk path
+    def chunk_file(self, file_path):
+        chunk = self.chunks.get(file_path)
+        if chunk is None:
+            chunk = self.chunks[file_path] = ChunkFile(file_path)
+        else:
+            chunk.refresh()
+        chunk.cube = self.aggregate_cube(file_path, build=False)
+        chunk.zones = self.zone_map(file_path, build=False)
+        chunk.compressed = self.compressed_chunk(file_path)
+        chunk.cluster = self.cluster_index(file_path)
+        return chunk
+
+    # Block-compressed copy of a chunk, or None when the chunk has none
+    def compressed_chunk(self, file_path):
+        compressed = CompressedChunk(file_path)
+        if not os.path.exists(compressed.index_path):
+            return None
+        compressed.load()
+        return compressed
+
+    # Cluster index of a clustered chunk, or None when the chunk is not clustered
+    def cluster_index(self, file_path):
+        cluster = ClusterIndex(file_path)
+        if not os.path.exists(cluster.index_path):
+            return None
+        cluster.load()
+        return cluster
+
+    # Aggregate cube for a chunk that matches its current contents. With build=False a
+    # missing or stale cube is not built (None is returned); queries build it on demand.
+    def aggregate_cube(self, file_path, build=True):
+        with self.metadata_lock:
+            return self._aggregate_cube(file_path, build)
+
+    def _aggregate_cube(self, file_path, build):
+        cube = self.cubes.get(file_path)
+        if cube is None:
+            cube = AggregateCube(file_path)
+            if not cube.load():
+                cube.invalidate()
+            self.cubes[file_path] = cube
+        elif cube.stat is not None and not cube.is_current():
+            # Another process may have written the chunk and kept the cube file in step
+            cube = self.cubes[file_path] = AggregateCube(file_path)
+            if not cube.load():
+                cube.invalidate()
+
+        if cube.stat is None:
+            if not build:
+                return None
+            cube.build()
+        return cube
+
+    # Zone map for a chunk that matches its current contents. With build=False a missing
+    # or stale map is not built (None is returned); filtered scans build it on demand.
+    def zone_map(self, file_path, build=True):
+        with self.metadata_lock:
+            return self._zone_map(file_path, build)
+
+    def _zone_map(self, file_path, build):
+        zones = self.zone_maps.get(file_path)
+        if zones is None:
+            zones = self.zone_maps[file_path] = ZoneMap(file_path)
+            zones.load()
+        elif not zones.is_current():
+            zones.load()  # the file may have been kept in step by another process
+
+        if not zones.is_current():
+            if not build:
+                return None
+            zones.build()
+        return zones
+
+    def catalog(self, directory):
+        directory = os.path.normpath(directory)
+        with self.metadata_lock:
+            if directory not in self.catalogs:
+                self.catalogs[directory] = ChunkCatalog(directory)
+            return self.catalogs[directory]
+
+    def partition_map(self, directory):
+        directory = os.path.normpath(directory)
+        with self.metadata_lock:
+            if directory not in self.partition_maps:
+                partitions = self.partition_maps[directory] = PartitionMap(directory)
+                with self.locks.hold([os.path.join(directory, ".partitions.lock")], exclusive=True):
+                    self._recovered_partitions(directory, partitions.recover())
+            return self.partition_maps[directory]
+
+    # Read the partition map again if another process repartitioned a group
+    def _refresh_partitions(self, directory):
+        partitions = self.partition_map(directory)
+        if partitions.changed():
+            with self.locks.hold([os.path.join(directory, ".partitions.lock")], exclusive=True):
+                self._recovered_partitions(directory, partitions.reload())
+
+    def _recovered_partitions(self, directory, recovered):
+        for filename in recovered:
+            self._forget_chunk(os.path.join(directory, filename))
+            self.catalog(directory).entry(filename)
+        if recovered:
+            self.catalog(directory).save()
+
+    # Split chunk files grown past partition_bytes; merge a partition that fell below an
+    # eighth of it into a neighbour when both fit in half of it
+    def _rebalance(self, file_paths):
+        for file_path in file_paths:
+            if not os.path.exists(file_path):
+                continue  # merged away by an earlier step
+            directory, filename = os.path.split(file_path)
+            partitions = self.partition_map(directory)
+            group = PartitionMap.group_of(filename)[0]
+            siblings = partitions.files(group)
+            if filename not in siblings:
+                continue
+            size = os.path.getsize(file_path)
+            if size > self.partition_bytes:
+                half = self.partition_bytes // 2
+                starts = partitions.split_starts(filename, -(-size // half))
+                if len(starts) > 1:
+                    self._repartition(directory, group, [filename], starts)
+            elif size < self.partition_bytes // 8 and len(siblings) > 1:
+                index = siblings.index(filename)
+                pair = siblings[index:index + 2] if index + 1 < len(siblings) else siblings[index - 1:index + 1]
+                if sum(os.path.getsize(os.path.join(directory, name)) for name in pair) <= self.partition_bytes // 2:
+                    self._repartition(directory, group, pair, [PartitionMap.group_of(pair[0])[1]])
+
+    # The group's lock is held by the caller; the map is saved under .partitions.lock
+    def _repartition(self, directory, group, filenames, starts):
+        max_id = self._group_max_id(directory, group)
+        clustered = any(os.path.exists(sidecar_path(os.path.join(directory, filename), "cluster"))
+                        for filename in filenames)
+        with self.locks.hold([os.path.join(directory, ".partitions.lock")], exclusive=True):
+            self._refresh_partitions(directory)  # keep other processes' splits of other groups
+            written, removed = self.partition_map(directory).repartition(group, filenames, starts)
+        catalog = self.catalog(directory)
+        for filename in written + removed:
+            self._forget_chunk(os.path.join(directory, filename))
+            catalog.entry(filename)  # rescanned, or dropped for a removed file
+        # Ids stay unique within the group, so the group keeps its highest Id
+        catalog.apply(written[0], [], max_id)
+        # Partitions of a clustered chunk are clustered too
+        if clustered:
+            for filename in written:
+                self._cluster(os.path.join(directory, filename))
+        catalog.save()
+
+    def _group_max_id(self, directory, group):
+        catalog = self.catalog(directory)
+        entries = [catalog.entry(filename) for filename in self.partition_map(directory).files(group)]
+        return max((entry["max_id"] for entry in entries if entry is not None), default=-1)
+
+    # Validate the catalog entries of chunks about to be written, so deltas can be applied
+    def _catalog_entries(self, file_paths):
+        for file_path in file_paths:
+            self.catalog(os.path.dirname(file_path)).entry(os.path.basename(file_path))
+
+    # Record a chunk write in the catalog (call save() on it afterwards) and drop the
+    # cached query results that read the chunk
+    def _catalog_apply(self, file_path, deltas, max_id=-1):
+        self.catalog(os.path.dirname(file_path)).apply(os.path.basename(file_path), deltas, max_id)
+        self.result_cache.invalidate(file_path)
+
+    # Parse and optimize a FIND statement, reusing the compiled plan for repeated statements
+    def compile_query(self, query):
+        key = ' '.join(query.split())
+        plan = self.plan_cache.get(key)
+        if plan is not None:
+            self.plan_cache.move_to_end(key)
+            return plan
+
+        plan = optimize_plan(parse_find(query))
+        self.plan_cache[key] = plan
+        if len(self.plan_cache) > self.PLAN_CACHE_SIZE:
+            self.plan_cache.popitem(last=False)
+        return plan
+
+    # Non-interactive FIND: returns the total for sum/count, otherwise the result rows
+    def run_query(self, directory, query):
+        return self.execute_plan(directory, self.compile_query(query))
+
+    # EXPLAIN [ANALYZE] of a FIND query as a JSON-ready report (printed by format_explain).
+    # Plain EXPLAIN lists the chunk files the plan would read and how, without reading
+    # them; ANALYZE runs the plan, bypassing the result cache, and adds per-stage totals
+    # and the peak memory traced while it ran.
+    def explain(self, directory, query, analyze=False):
+        profile = QueryProfile() if analyze else None
+        started_tracing = analyze and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            with profile_stage(profile, 'parse'):
+                plan = parse_find(query)
+            with profile_stage(profile, 'optimize'):
+                plan = optimize_plan(plan)
+            head, _ = self._head_operator(plan)
+            with self._group_locks(directory, [self._group(filename) for filename in plan.scan.files]):
+                file_paths = [file_path for file_path in self._partition_paths(directory, plan.scan)
+                              if os.path.exists(file_path)]
+                report = {'query': ' '.join(query.split()), 'analyze': analyze, 'plan': describe_plan(plan),
+                          'strategy': self._strategy(file_paths, plan.scan, head),
+                          'pending_changes': self.pending_changes}
+                if not analyze:
+                    report['files'] = self._planned_files(file_paths, plan.scan, head)
+                    return report
+
+                with profile_stage(profile, 'checkpoint'):
+                    self.checkpoint()
+                result = self._execute_plan(directory, plan, profile)
+                if isinstance(result, QueryResult):
+                    for _ in result.batches():
+                        pass  # sort, merge and project the rows as a reader of the result would
+                    total = {'rows': len(result)}
+                    result.close()
+                else:
+                    total = {'rows': 1, 'value': int(result)}
+                total.update(wall_ms=round((time.perf_counter() - wall) * 1000, 3),
+                             cpu_ms=round((time.process_time() - cpu) * 1000, 3),
+                             peak_memory_bytes=tracemalloc.get_traced_memory()[1])
+                report.update(files=profile.files, stages=profile.stage_report(), total=total)
+                return report
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+    def _strategy(self, file_paths, scan, head):
+        if self._uses_cubes(head):
+            return "aggregate cubes (whole-chunk sums and counts from the chunk catalog)"
+        if head is None and self._lookup_accesses(file_paths, scan) is not None:
+            return "row lookup in this process, parsed with the csv module"
+        if self.chunk_cache is not None:
+            return "scan of cached chunks in this process"
+        if self._parallel(file_paths):
+            return f"parallel scan on a pool of {self.max_workers} processes, partials merged in file order"
+        if self.read_ahead.depth > 0 and len(file_paths) > 1:
+            return f"scan in this process, reading up to {self.read_ahead.depth} files ahead"
+        return "scan in this process"
+
+    # The files entries of a plain EXPLAIN: how each chunk would be read
+    def _planned_files(self, file_paths, scan, head):
+        planned = QueryProfile()
+        catalog = self.catalog(os.path.dirname(file_paths[0])) if file_paths and self._uses_cubes(head) else None
+        for file_path in file_paths:
+            if catalog is not None:
+                entry = self._catalog_answer(catalog, file_path, scan, head)
+                planned.add_file(file_path, 'catalog' if entry is not None else 'cube')
+                continue
+            if self.chunk_cache is None and (scan.years is not None or scan.name_prefixes is not None):
+                self.zone_map(file_path)  # built before the scan, as the executor does
+            access = chunk_access(file_path, scan, self.chunk_cache)
+            planned.add_file(file_path, access['source'], access['bytes'], access['blocks'], access['skipped'])
+        return planned.files
+
+    # One-shot conversion of every CSV chunk into the columnar format
+    def convert_to_columnar(self, directory):
+        self.checkpoint()
+        for filename in self.list_files(directory):
+            with self._group_locks(directory, [self._group(filename)], exclusive=True):
+                ColumnarChunk(os.path.join(directory, filename)).convert()
+            print(f"Converted {filename} to columnar format.")
+
+    # One-shot conversion of every CSV chunk into the block-compressed format
+    def compress_chunks(self, directory, codec="zlib"):
+        self.checkpoint()
+        for filename in self.list_files(directory):
+            file_path = os.path.join(directory, filename)
+            compressed = CompressedChunk(file_path)
+            with self._group_locks(directory, [self._group(filename)], exclusive=True):
+                compressed.build(codec)
+            ratio = compressed.compressed_bytes() / max(1, os.path.getsize(file_path))
+            print(f"Compressed {filename} with {codec} ({ratio:.0%} of the CSV).")
+
+    # One-shot conversion of every chunk to the clustered layout (rows sorted by name)
+    def cluster_chunks(self, directory):
+        self.checkpoint()
+        for filename in self.list_files(directory):
+            file_path = os.path.join(directory, filename)
+            with self._group_locks(directory, [self._group(filename)], exclusive=True):
+                self._cluster(file_path)
+            print(f"Clustered {filename} by name ({self.chunk_file(file_path).live_rows:,} rows).")
+        self.catalog(directory).save()
+
+    # Sort a chunk into the clustered layout, or merge its tail into the sorted region
+    def _cluster(self, file_path):
+        chunk = self.chunk_file(file_path)
+        if chunk.cluster is None:
+            chunk.cluster = ClusterIndex(file_path)
+        self._catalog_entries([file_path])
+        chunk.compact()
+        self._catalog_apply(file_path, [])
+
+    # Compact every chunk carrying tombstones
+    def compact(self, directory):
+        self.checkpoint()
+        for filename in self.list_files(directory):
+            file_path = os.path.join(directory, filename)
+            with self._group_locks(directory, [self._group(filename)], exclusive=True):
+                chunk = self.chunk_file(file_path)
+                if chunk.dead_rows:
+                    self._catalog_entries([file_path])
+                    chunk.compact()
+                    self._catalog_apply(file_path, [])
+        self.catalog(directory).save()
+
+    #################### WRITE-AHEAD LOG AND CHECKPOINTS ######################
+    # Inserts, deletes and updates are logged to the directory's WriteAheadLog before any
+    # chunk changes. Inserts are then only staged in self.pending, an overlay of new row
+    # contents that later inserts read through, and reach the chunk CSVs in a checkpoint:
+    # after CHECKPOINT_DELAY seconds on a background timer, once CHECKPOINT_CHANGES are
+    # pending, or before anything reads the chunks. Deletes and updates checkpoint first
+    # and apply their logged changes to the chunk straight away.
+    def write_ahead_log(self, directory):
+        if directory not in self.wals:
+            self.recover(directory)
+        return self.wals[directory]
+
+    # Replay what crashed processes left in their logs; returns the number of entries replayed
+    def recover(self, directory):
+        self.partition_map(directory)  # finishes an interrupted repartition first
+        self._rollback_load(directory)
+        wal = self.wals[directory] = WriteAheadLog(directory)
+        replayed = 0
+        for log_path, log_file in wal.orphans():
+            with log_file:
+                owner = os.path.basename(log_path)
+                entries = WriteAheadLog.read(log_path)
+                groups = sorted({PartitionMap.group_of(entry[1])[0] for entry in entries})
+                with self._group_locks(directory, groups, exclusive=True) as paths:
+                    # Groups no longer marked with the log were taken over (or checkpointed)
+                    # since; the single log of earlier versions carries no marks
+                    replay = {group for group, path in zip(groups, paths)
+                              if owner == ".wal" or self.locks.read_mark(path) == owner}
+                    entries = [entry for entry in entries if PartitionMap.group_of(entry[1])[0] in replay]
+                    with self.pending_lock:
+                        replayed += self._stage_logged(directory, entries)
+                    self.checkpoint()
+                    for group, path in zip(groups, paths):
+                        if group in replay and owner != ".wal":
+                            self.locks.mark(path, "")
+                try:
+                    os.remove(log_path)
+                except FileNotFoundError:
+                    pass  # another process replayed it at the same time
+        return replayed
+
+    # Stage logged entries as pending changes (pending_lock held); returns how many
+    def _stage_logged(self, directory, entries):
+        partitions = self.partition_map(directory)
+        for op, filename, row_id, name, year, gender, count in entries:
+            record = None
+            if op == "u":
+                record = {"Id": row_id, "Name": name, "Year": year, "Gender": gender, "Count": count}
+            # The row may have moved to another partition of its group since it was logged
+            filename = partitions.route(PartitionMap.group_of(filename)[0], name)
+            self._stage(os.path.join(directory, filename), name, year, row_id, record)
+        return len(entries)
+
+    # Finish what a writer that died holding a group's lock left undone, going by the mark
+    # it left on the lock: roll back a batch load's unfinished batch, or replay the
+    # group's entries from the writer's log
+    def _take_over(self, directory, group, owner):
+        if owner.startswith(LoadCheckpoint.MARK + " "):
+            self._rollback_load(directory, [group])
+            return
+        log_file = WriteAheadLog.owner_gone(os.path.join(directory, owner))
+        if log_file is None:
+            return  # already replayed and removed
+        with log_file:
+            entries = [entry for entry in WriteAheadLog.read(log_file.name)
+                       if PartitionMap.group_of(entry[1])[0] == group]
+        if entries:
+            with self.pending_lock:
+                self._stage_logged(directory, entries)
+            self.checkpoint()
+
+    def _wal_entry(self, file_path, record, deleted=False):
+        filename = os.path.basename(file_path)
+        if deleted:
+            return ["x", filename, record["Id"], record["Name"], record["Year"], "", ""]
+        return ["u", filename, record["Id"], record["Name"], record["Year"], record["Gender"], record["Count"]]
+
+    def _stage(self, file_path, name, year, row_id, record):
+        self.pending.setdefault(file_path, {}).setdefault((name, str(year)), {})[str(row_id)] = record
+        self.pending_changes += 1
+
+    # Live rows for (name, year) in a chunk: its checkpointed rows overlaid with pending changes
+    def _current_records(self, file_path, name, year):
+        records = {}
+        if os.path.exists(file_path):
+            for _, record in self.chunk_file(file_path).find(name, year):
+                records[record["Id"]] = record
+        records.update(self.pending.get(file_path, {}).get((name, str(year)), {}))
+        return [record for record in records.values() if record is not None]
+
+    # Ids are unique within a chunk group, across its partitions
+    def _next_id(self, file_path):
+        directory, filename = os.path.split(file_path)
+        group = PartitionMap.group_of(filename)[0]
+        key = os.path.join(directory, group)
+        row_id = self.next_ids.get(key)
+        if row_id is None:
+            row_id = self._group_max_id(directory, group) + 1
+        self.next_ids[key] = row_id + 1
+        return row_id
+
+    def _schedule_checkpoint(self):
+        with self.pending_lock:
+            if self.checkpoint_timer is None and self.pending:
+                self.checkpoint_timer = threading.Timer(self.CHECKPOINT_DELAY, self.checkpoint)
+                self.checkpoint_timer.daemon = True
+                self.checkpoint_timer.start()
+
+    def _cancel_checkpoint(self):
+        with self.pending_lock:
+            timer, self.checkpoint_timer = self.checkpoint_timer, None
+        if timer is not None and timer is not threading.current_thread():
+            timer.cancel()
+            timer.join()
+
+    # Apply every pending change to its chunk CSV (chunks in parallel), then empty the logs
+    def checkpoint(self):
+        self._cancel_checkpoint()
+        with self.pending_lock:
+            # The log must be on disk before the changes it describes reach the chunks
+            for wal in self.wals.values():
+                wal.wait(wal.last_seq)
+
+            chunks = []
+            for file_path, keys in self.pending.items():
+                if not os.path.exists(file_path):
+                    self._create_empty_file(file_path)
+                changes = [(name, year, row_id, record)
+                           for (name, year), rows in keys.items() for row_id, record in rows.items()]
+                chunks.append((self.chunk_file(file_path), changes))
+            self._catalog_entries(self.pending)
+
+            def apply(item):
+                chunk, changes = item
+                deltas = chunk.apply_changes(changes)
+                chunk.maybe_compact()
+                return deltas
+
+            if self.max_workers > 1 and len(chunks) > 1:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+                    all_deltas = list(executor.map(apply, chunks))
+            else:
+                all_deltas = [apply(item) for item in chunks]
+
+            # Chunks first, then the catalog, then the log is emptied
+            for (chunk, _), deltas in zip(chunks, all_deltas):
+                self._catalog_apply(chunk.file_path, deltas, chunk.max_id)
+            for catalog in self.catalogs.values():
+                if catalog.entries is not None:
+                    catalog.save()
+            for wal in self.wals.values():
+                wal.reset()
+            self.pending, self.next_ids, self.pending_changes = {}, {}, 0
+            self._rebalance([chunk.file_path for chunk, _ in chunks])
+            self.locks.release_retained()  # the groups' changes are all in their chunks now
+
+    ############################## CHUNK LOCKS ################################
+    # Every read and write of chunk files holds the ChunkLocks of their chunk groups, so
+    # other processes can work on the same directory. A group's lock file is a sidecar of
+    # its unsplit chunk file (.male_k.csv.lock) and covers all of the group's partitions.
+    def _lock_path(self, directory, group):
+        return sidecar_path(os.path.join(directory, group + ".csv"), "lock")
+
+    # Shared directory lock plus shared or exclusive group locks; the partition map is
+    # read again under them when another process changed it. Yields the lock paths in
+    # sorted group order.
+    @contextlib.contextmanager
+    def _group_locks(self, directory, groups, exclusive=False):
+        if not os.path.isdir(directory):
+            yield []  # nothing to read
+            return
+        paths = [self._lock_path(directory, group) for group in sorted(set(groups))]
+        with self.locks.hold([os.path.join(directory, ".lock")]), self.locks.hold(paths, exclusive):
+            self._refresh_partitions(directory)
+            yield paths
+
+    # Exclusive group locks for logged writes (inserts, deletes and updates). Each group is
+    # marked with this process's log, after taking over what a writer that died holding
+    # the group left undone. On exit the locks are retained while changes are pending, for
+    # the next checkpoint to release; otherwise the log is emptied first, so a mark is only
+    # cleared once its log holds nothing for the group.
+    @contextlib.contextmanager
+    def _write_locks(self, directory, groups):
+        os.makedirs(directory, exist_ok=True)
+        owner = os.path.basename(self.write_ahead_log(directory).log_path)
+        with self._group_locks(directory, groups, exclusive=True) as paths:
+            for group, path in zip(sorted(set(groups)), paths):
+                if self.locks.own_mark(path) != owner:
+                    previous = self.locks.read_mark(path)
+                    if previous and previous != owner:
+                        self._take_over(directory, group, previous)
+                    self.locks.mark(path, owner)
+            completed = False
+            try:
+                yield
+                completed = True
+            finally:
+                with self.pending_lock:
+                    if self.pending or not completed:
+                        for path in paths:
+                            self.locks.retain(path)
+                    else:
+                        for wal in self.wals.values():
+                            wal.reset()
+
+    # Chunk group of a chunk file path
+    def _group(self, file_path):
+        return PartitionMap.group_of(os.path.basename(file_path))[0]
 
     #used by choices #1, 2
     def filename_path(self, directory, name, gender):
-        name_lower = name.lower()
-        gender_lower = gender.lower()
-        first_letter = name_lower[0]
-        gender_prefix = "female" if gender_lower == "f" else "male"
-        filename = f"{gender_prefix}_{first_letter}.csv"
+        # The partition of the name's chunk group that holds it (the group file unless split)
+        filename = self.partition_map(directory).route(self.chunk_group(name, gender), name)
         file_path = os.path.join(directory, filename)
         return filename, file_path
+
+    # Chunk group of a name: gender and first letter, e.g. 'male_j'
+    def chunk_group(self, name, gender):
+        gender_prefix = "female" if gender.lower() == "f" else "male"
+        return f"{gender_prefix}_{name.lower()[0]}"
     
     #used by choices #5
-    def read_data(self, directory, selected_file):
+    # Rows of a chunk as dicts, from live row number offset on: limit of them, or all the
+    # rest. A page further in starts from the chunk's RowIndex rather than the top.
+    def read_data(self, directory, selected_file, offset=0, limit=None):
+        self.checkpoint()
         file_path = os.path.join(directory, selected_file)
 
         if os.path.exists(file_path):
-            with open(file_path, 'r', newline='') as csv_file:
-                reader = csv.DictReader(csv_file)
-                data = [row for row in reader]
+            with self._group_locks(directory, [self._group(selected_file)]), \
+                    open(file_path, 'rb') as chunk_file:
+                if offset > 0:
+                    row_index = RowIndex(file_path)
+                    if not row_index.load():
+                        row_index.build()
+                    start = row_index.seek(offset)
+                    if start is None:
+                        return []
+                    chunk_file.seek(start[0])
+                    skip = start[1]
+                else:
+                    chunk_file.readline()  # header
+                    skip = 0
+                csv_file = io.TextIOWrapper(chunk_file, encoding='utf-8', newline='')
+                reader = csv.DictReader(live_lines(csv_file), fieldnames=FIELDNAMES)
+                end = None if limit is None else skip + limit
+                data = [row for row in itertools.islice(reader, skip, end)]
 
             return data
         else:
@@ -36,50 +3656,81 @@ class BabyNamesDatabase:
 # Choice #1: INSERT DATA
 # ----------------------------------------------------------- #
     def insert(self, directory, name, gender, year):
-        _, file_path = self.filename_path(directory, name, gender) 
+        # Create the directory if it doesn't exist, and lock the name's chunk group
+        with self._write_locks(directory, [self.chunk_group(name, gender)]):
+            _, file_path = self.filename_path(directory, name, gender)
 
-        # Create the directory if it doesn't exist
-        os.makedirs(directory, exist_ok=True)
+            # Check if the CSV file already exists
+            if not os.path.exists(file_path):
+                self._create_empty_file(file_path)
+                print(f"New file created: {file_path}")
 
-        # Check if the CSV file already exists
-        if os.path.exists(file_path):
-            self._update_existing_file(file_path, name, gender, year)
-        else:
-            self._create_new_file(file_path, name, gender, year)
+            # Log the insert; the chunk itself is updated at the next checkpoint
+            self.insert_many(directory, [(name, gender, year)])
 
-    def _create_new_file(self, file_path, name, gender, year):
-        # Create a new CSV file with the given record
+    def _create_empty_file(self, file_path):
         with open(file_path, 'w', newline='') as csv_file:
-            fieldnames = ["Id", "Name", "Year", "Gender", "Count"]
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerow({"Id": 0, "Name": name, "Year": year, "Gender": gender, "Count": 1})
-            print(f"New file created: {file_path}")
-
-    def _update_existing_file(self, file_path, name, gender, year):
-        # Read existing data using the read_data method
-        existing_data = self.read_data(os.path.dirname(file_path), os.path.basename(file_path))
-
-        # Check if a record with the same name and year already exists
-        matching_records = [record for record in existing_data if record["Name"] == name and record["Year"] == year]
-
-        if matching_records:
-            # Increment count of existing data
-            for record in existing_data:
-                if record["Name"] == name and record["Year"] == year:
-                    record["Count"] = str(int(record["Count"]) + 1)
+            csv.DictWriter(csv_file, fieldnames=FIELDNAMES).writeheader()
+        catalog = self.catalog(os.path.dirname(file_path))
+        catalog.reset(os.path.basename(file_path))
+        catalog.save()
+
+        # Drop any index, cube, zone map or result left over from a previous chunk with this name
+        self._forget_chunk(file_path)
+        drop_sidecars(file_path)
+
+    def _forget_chunk(self, file_path):
+        self.result_cache.invalidate(file_path)
+        with self.metadata_lock:
+            self.chunks.pop(file_path, None)
+            self.cubes.pop(file_path, None)
+            self.zone_maps.pop(file_path, None)
+
+    # Bulk version of insert() for streams of (name, gender, year) records. Each record adds
+    # 1 to the Count of its (Name, Year) row, or creates the row with a new Id. Increments
+    # are summed per row, turned into new row contents and logged with one group commit;
+    # the chunks are updated by the next checkpoint, one pass per chunk.
+    # Returns the number of records applied.
+    def insert_many(self, directory, records):
+        groups = {}  # chunk group -> {(name, year): [gender, records]}
+        applied = 0
+        for name, gender, year in records:
+            groups.setdefault(self.chunk_group(name, gender), {}).setdefault((name, str(year)), [gender, 0])[1] += 1
+            applied += 1
+
+        # The groups stay locked until the checkpoint that applies the increments
+        with self._write_locks(directory, groups):
+            self._insert_counts(directory, groups)
+
+        if self.pending_changes >= self.CHECKPOINT_CHANGES:
+            self.checkpoint()
         else:
-            # Append the new record to existing data
-            existing_ids = [int(row['Id']) for row in existing_data]
-            new_id = max(existing_ids) + 1
-            existing_data.append({"Id": new_id, "Name": name, "Year": year, "Gender": gender, "Count": 1})
+            self._schedule_checkpoint()
+        return applied
 
-        # Write the updated data back to the file
-        with open(file_path, 'w', newline='') as csv_file:
-            fieldnames = ["Id", "Name", "Year", "Gender", "Count"]
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(existing_data)
+    def _insert_counts(self, directory, groups):
+        wal = self.write_ahead_log(directory)
+        partitions = {}  # chunk file path -> {(name, year): [gender, records]}
+        for counts in groups.values():
+            for (name, year), (gender, count) in counts.items():
+                _, file_path = self.filename_path(directory, name, gender)
+                partitions.setdefault(file_path, {})[(name, year)] = [gender, count]
+
+        with self.pending_lock:
+            entries = []
+            for file_path, counts in partitions.items():
+                for (name, year), (gender, count) in counts.items():
+                    current = self._current_records(file_path, name, year)
+                    if current:
+                        changed = [dict(record, Count=str(int(record["Count"]) + count)) for record in current]
+                    else:
+                        changed = [{"Id": str(self._next_id(file_path)), "Name": name, "Year": year,
+                                    "Gender": gender, "Count": str(count)}]
+                    for record in changed:
+                        self._stage(file_path, name, year, record["Id"], record)
+                        entries.append(self._wal_entry(file_path, record))
+            seq = wal.append(entries)
+        wal.wait(seq)
 
 # ----------------------------------------------------------- #
 # Choice #2: BATCH UPLOAD
@@ -94,152 +3745,336 @@ class BabyNamesDatabase:
                 batch = []
         if batch:
             yield batch
-    
-    def load_batch_data(self, directory, csv_file_path, batch_size=200000):
+
+    # (record, source offset just past it) for every row of a CSV file from offset onwards
+    def _read_rows(self, csv_file_path, offset=0):
+        with open(csv_file_path, 'rb') as csvfile:
+            header = csvfile.readline()
+            fieldnames = next(csv.reader([header.decode('utf-8')]))
+            position = [max(offset, len(header))]
+            csvfile.seek(position[0])
+
+            def lines():
+                for line in csvfile:
+                    position[0] += len(line)
+                    yield line.decode('utf-8')
+
+            # the reader pulls only the lines of the row it returns, so position ends with it
+            for record in csv.DictReader(lines(), fieldnames=fieldnames):
+                yield record, position[0]
+
+    # Merge the rows of a batch sharing (Name, Year, Gender) into one row (the first one's
+    # Id) carrying their total Count
+    def _merge_duplicates(self, records):
+        merged = {}
+        for record in records:
+            key = (record['Name'], record['Year'], record['Gender'])
+            first = merged.get(key)
+            if first is None:
+                merged[key] = record
+            else:
+                first['Count'] = str(int(first['Count']) + int(record['Count']))
+        return list(merged.values())
+
+    # Rows are read and written batch_size at a time, so memory stays bounded however large
+    # the file is. Progress is checkpointed after every batch (see LoadCheckpoint); resume
+    # (prompted for unless given, e.g. by scripts) continues an interrupted load of the
+    # same file from its checkpoint instead of starting over.
+    def load_batch_data(self, directory, csv_file_path, batch_size=200000, resume=None):
+        # Create the directory if it doesn't exist
+        os.makedirs(directory, exist_ok=True)
+        self.checkpoint()  # batch rows are appended behind any logged inserts
+
+        # One load at a time; each batch holds the locks of the chunk groups it writes
+        progress = LoadCheckpoint(directory)
+        with self.locks.hold([progress.lock_path], exclusive=True):
+            self._rollback_load(directory)
+            state = progress.load()
+            if state is not None and state["rows"] and progress.matches(csv_file_path):
+                if resume is None:
+                    resume = input(f"\nA previous load of {csv_file_path} stopped after {state['rows']:,} rows. "
+                                   f"Resume it? (yes/no): ").lower() == 'yes'
+            else:
+                resume = False
+            if resume:
+                print(f"Resuming after {state['rows']:,} rows.")
+            else:
+                progress.start(csv_file_path)
+            self._load_batches(directory, csv_file_path, batch_size, progress)
+
+    def _load_batches(self, directory, csv_file_path, batch_size, progress):
+        writer_pool = ChunkWriterPool()
+        written = set()  # chunks to split once the load is done
+        clustered = set()  # clustered chunks whose appended rows are merged in once the load is done
+
         #open file indicated by choice #2
-        with open(csv_file_path, 'r') as csvfile:
-            csv_reader = csv.DictReader(csvfile)
+        try:
+            for batch in self.batch_iterator(self._read_rows(csv_file_path, progress.state["offset"]), batch_size):
+                start_time = time.perf_counter()
+                end_offset = batch[-1][1]
+                records = self._merge_duplicates(record for record, _ in batch)
+                groups = {self.chunk_group(record['Name'], record['Gender']) for record in records}
+
+                with self._group_locks(directory, groups, exclusive=True) as paths:
+                    # Marked before any chunk is written, so the batch can be rolled back
+                    # if this process dies holding the locks
+                    for path in paths:
+                        self.locks.mark(path, progress.batch_mark())
+                    try:
+                        partitions = self._write_batch(directory, records, writer_pool, progress, clustered)
+                    except BaseException:
+                        # Earlier batches stay loaded and the load can be resumed; the failed one is undone
+                        writer_pool.close()
+                        self._rollback_load(directory)
+                        raise
+                    written.update(partitions)
+                    progress.commit_batch(end_offset, len(batch), len(batch) - len(records),
+                                          {os.path.basename(file_path): len(chunk_records)
+                                           for file_path, chunk_records in partitions.items()})
+
+                elapsed = time.perf_counter() - start_time
+                rows_per_sec = len(batch) / elapsed if elapsed > 0 else float('inf')
+                merged = (f" ({len(batch) - len(records):,} duplicates merged)" if len(records) < len(batch) else "")
+                print(f"Batch of {len(batch):,} rows{merged} written to {len(partitions)} chunks ({rows_per_sec:,.0f} rows/sec). On to next...")
+            progress.clear()
+        finally:
+            writer_pool.close()
+            with self._group_locks(directory, {self._group(file_path) for file_path in written | clustered},
+                                   exclusive=True):
+                for file_path in sorted(clustered):
+                    self._cluster(file_path)
+                if clustered:
+                    self.catalog(directory).save()
+                self._rebalance(sorted(written))
 
-            for batch in self.batch_iterator(csv_reader, batch_size):
-                #organize data into chunks
-                for record in batch:
-                    gender = record['Gender']
-                    name = record['Name']
+    # Append one batch of records to their chunks (group locks held); returns them by chunk path
+    def _write_batch(self, directory, records, writer_pool, progress, clustered):
+        #organize data into chunks in memory first
+        partitions = {}
+        for record in records:
+            _, file_path = self.filename_path(directory, record['Name'], record['Gender'])
+            partitions.setdefault(file_path, []).append(record)
 
-                    _, file_path = self.filename_path(directory, name, gender)   
+        # Cubes must match their chunk before the write for the batch to be added to them;
+        # current zone maps and compressed copies are extended over the appended rows
+        # and clustered chunks get the rows as their unsorted tail until the load ends
+        cubes, zone_maps, compressed_copies, clusters = {}, {}, {}, {}
+        for file_path in partitions:
+            cube = self.aggregate_cube(file_path, build=False) if os.path.exists(file_path) else None
+            if cube is not None:
+                cubes[file_path] = cube
+            if os.path.exists(file_path):
+                zone_maps[file_path] = self.zone_map(file_path, build=False)
+                compressed = self.compressed_chunk(file_path)
+                if compressed is not None and compressed.is_current():
+                    compressed_copies[file_path] = compressed
+                cluster = self.cluster_index(file_path)
+                if cluster is not None:
+                    clustered.add(file_path)
+                    if cluster.is_current():
+                        clusters[file_path] = cluster
+        self._catalog_entries(partitions)
 
-                    # Create the directory if it doesn't exist
-                    os.makedirs(directory, exist_ok=True)
+        # Write each chunk's rows out in bulk through the pooled writers, noting the
+        # chunk sizes first so a crash mid-batch can be rolled back. The writers are
+        # closed with the batch, as other processes may write the chunks between batches.
+        progress.begin_batch({os.path.basename(file_path): os.path.getsize(file_path)
+                              if os.path.exists(file_path) else None for file_path in partitions})
+        for file_path, chunk_records in partitions.items():
+            writer_pool.writer(file_path).writerows(chunk_records)
+        writer_pool.flush(sync=True)
+        writer_pool.close()
 
-                    # Write header only if the file is newly created
-                    write_header = not os.path.exists(file_path)
+        # Keep existing aggregate cubes in step with the appended rows
+        for file_path, cube in cubes.items():
+            for record in partitions[file_path]:
+                cube.apply(record, int(record['Count']), 1)
+            cube.record_stat()
 
-                    with open(file_path, 'a', newline='') as chunk_csvfile:
-                        fieldnames = ["Id", "Name", "Year", "Gender", "Count"]
-                        chunk_writer = csv.DictWriter(chunk_csvfile, fieldnames=fieldnames)
-                        
-                        if write_header:
-                            chunk_writer.writeheader()
+        for file_path in partitions:
+            zones = zone_maps.get(file_path)
+            if zones is None:
+                self.zone_map(file_path)
+            else:
+                zones.extend()
+        for compressed in compressed_copies.values():
+            compressed.update()
+        for cluster in clusters.values():
+            cluster.record_stat()
 
-                        # Write data to the file
-                        chunk_writer.writerow(record)
+        for file_path, chunk_records in partitions.items():
+            self._catalog_apply(file_path, [(record, int(record['Count']), 1) for record in chunk_records])
+        self.catalog(directory).save()
+        return partitions
 
-                print("Batch run successfully. On to next...")
+    # Undo the rows an interrupted batch load left half-appended (see LoadCheckpoint), in
+    # the groups that still carry the mark of its unfinished batch. Without groups this
+    # is left to a running load, if there is one; with groups (a writer taking them over
+    # from a load that died) their locks are already held.
+    def _rollback_load(self, directory, groups=None):
+        progress = LoadCheckpoint(directory)
+        if groups is None:
+            if not os.path.isdir(directory) or not self.locks.acquire(progress.lock_path, True, blocking=False):
+                return
+            try:
+                self._rollback_groups(directory, progress, None)
+            finally:
+                self.locks.release(progress.lock_path)
+        else:
+            self._rollback_groups(directory, progress, groups)
 
-                self.names_data.extend(batch) #process batch and add to names_data
+    def _rollback_groups(self, directory, progress, groups):
+        by_group = {}
+        for filename in progress.batch_files():
+            by_group.setdefault(self._group(filename), []).append(filename)
+        if groups is not None:
+            by_group = {group: by_group[group] for group in groups if group in by_group}
+        if not by_group:
+            return
+        with self._group_locks(directory, by_group, exclusive=True) as paths:
+            mark = progress.batch_mark() if progress.load() is not None else None
+            for group, path in zip(sorted(by_group), paths):
+                if mark is None or self.locks.read_mark(path) != mark:
+                    continue  # written by another process since; the rows are not the batch's
+                for file_path in progress.rollback(by_group[group], save=groups is None):
+                    self._forget_chunk(file_path)
+                self.locks.mark(path, "")
 
 # ----------------------------------------------------------- #
 # Choice #3: DELETE DATA
 # ----------------------------------------------------------- #
-    def delete(self, directory, name, year, gender):
-        _, file_path = self.filename_path(directory, name, gender)
+    # delete_count ('all' or a number) is prompted for unless given, e.g. by scripts
+    def delete(self, directory, name, year, gender, delete_count=None):
+        # The name's chunk group stays locked from reading the rows to writing them
+        with self._write_locks(directory, [self.chunk_group(name, gender)]):
+            _, file_path = self.filename_path(directory, name, gender)
 
-        # Read existing data using the read_data method
-        existing_data = self.read_data(os.path.dirname(file_path), os.path.basename(file_path))
+            if not os.path.exists(file_path):
+                print(f"File not found: {file_path}")
+                print(f"No records found for {name} in {year} with gender {gender}.")
+                return False
 
-        # Find matching records
-        matching_records = [record for record in existing_data if record["Name"] == name and record["Year"] == year]
+            # Find matching records through the chunk index
+            self.checkpoint()
+            chunk = self.chunk_file(file_path)
+            matching_rows = chunk.find(name, year)
+            matching_records = [record for _, record in matching_rows]
 
-        if not matching_records:
-            print(f"No records found for {name} in {year} with gender {gender}.")
-            return False
+            if not matching_records:
+                print(f"No records found for {name} in {year} with gender {gender}.")
+                return False
 
-        # Display matching records and their counts
-        print(f"\nMatching records for {name} in {year} with gender {gender}:")
-        for i, record in enumerate(matching_records):
-            print(f"{i + 1}. {record}")
+            # Display matching records and their counts
+            print(f"\nMatching records for {name} in {year} with gender {gender}:")
+            for i, record in enumerate(matching_records):
+                print(f"{i + 1}. {record}")
 
-        # Prompt user for the number of records to delete
-        total_count = sum(int(record["Count"]) for record in matching_records)
-        delete_count = input(f"\nEnter the number of records to delete (1-{total_count} or 'all'): ")
+            changes = []  # (record, deleted) pairs
 
-        if delete_count.lower() == 'all':
-            # Delete all matching records
-            existing_data = [record for record in existing_data if record not in matching_records]
-        else:
-            # Delete specified number of records
-            try:
-                delete_count = int(delete_count)
-                if 1 <= delete_count <= total_count:
-                    for record in matching_records:
-                        if delete_count > 0:
-                            current_count = int(record["Count"])
-                            if delete_count >= current_count:
-                                # Delete the entire record
-                                existing_data.remove(record)
-                                delete_count -= current_count
-                            else:
-                                # Update the count of the remaining record
-                                record["Count"] = str(current_count - delete_count)
-                                delete_count = 0
-                else:
+            # Prompt user for the number of records to delete
+            total_count = sum(int(record["Count"]) for record in matching_records)
+            if delete_count is None:
+                delete_count = input(f"\nEnter the number of records to delete (1-{total_count} or 'all'): ")
+
+            if str(delete_count).lower() == 'all':
+                # Delete all matching records
+                for _, record in matching_rows:
+                    changes.append((record, True))
+            else:
+                # Delete specified number of records
+                try:
+                    delete_count = int(delete_count)
+                    if 1 <= delete_count <= total_count:
+                        for offset, record in matching_rows:
+                            if delete_count > 0:
+                                current_count = int(record["Count"])
+                                if delete_count >= current_count:
+                                    # Delete the entire record
+                                    changes.append((record, True))
+                                    delete_count -= current_count
+                                else:
+                                    # Update the count of the remaining record
+                                    record["Count"] = str(current_count - delete_count)
+                                    changes.append((record, False))
+                                    delete_count = 0
+                    else:
+                        print("Invalid input. Please enter a valid number.")
+                        return False
+                except ValueError:
                     print("Invalid input. Please enter a valid number.")
                     return False
-            except ValueError:
-                print("Invalid input. Please enter a valid number.")
-                return False
 
-        # Write the updated data back to the file
-        with open(file_path, 'w', newline='') as csv_file:
-            fieldnames = ["Id", "Name", "Year", "Gender", "Count"]
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(existing_data)
+            self._apply_logged(directory, chunk, changes)
 
-        print(f"\n{delete_count} records deleted successfully for {name} in {year} with gender {gender}.")
-        return True
+            print(f"\n{delete_count} records deleted successfully for {name} in {year} with gender {gender}.")
+            return True
+
+    # Log (record, deleted) changes to one chunk, then apply them to it
+    def _apply_logged(self, directory, chunk, changes):
+        self.write_ahead_log(directory).commit([self._wal_entry(chunk.file_path, record, deleted)
+                                                for record, deleted in changes])
+        self._catalog_entries([chunk.file_path])
+        deltas = chunk.apply_changes([(record["Name"], record["Year"], record["Id"], None if deleted else record)
+                                      for record, deleted in changes])
+        chunk.maybe_compact()
+        self._catalog_apply(chunk.file_path, deltas, chunk.max_id)
+        self.catalog(directory).save()
+        self._rebalance([chunk.file_path])
 
 # ----------------------------------------------------------- #
 # Choice #4: UPDATE DATA
 # ----------------------------------------------------------- #
-    def update(self, directory, name, year, gender):
-        _, file_path = self.filename_path(directory, name, gender)
-
-        # Read existing data using the read_data method
-        existing_data = self.read_data(os.path.dirname(file_path), os.path.basename(file_path))
+    # new_count is prompted for unless given, e.g. by scripts
+    def update(self, directory, name, year, gender, new_count=None):
+        # The name's chunk group stays locked from reading the rows to writing them
+        with self._write_locks(directory, [self.chunk_group(name, gender)]):
+            _, file_path = self.filename_path(directory, name, gender)
 
-        # Find matching records
-        matching_records = [record for record in existing_data if record["Name"] == name and record["Year"] == year]
+            if not os.path.exists(file_path):
+                print(f"File not found: {file_path}")
+                print(f"No records found for {name} in {year} with gender {gender}.")
+                return False
 
-        if not matching_records:
-            print(f"No records found for {name} in {year} with gender {gender}.")
-            return False
+            # Find matching records through the chunk index
+            self.checkpoint()
+            chunk = self.chunk_file(file_path)
+            matching_rows = chunk.find(name, year)
+            matching_records = [record for _, record in matching_rows]
 
-        # Display matching records and their counts
-        print(f"\nMatching records for {name} in {year} with gender {gender}:")
-        for i, record in enumerate(matching_records):
-            print(f"{i + 1}. {record}")
+            if not matching_records:
+                print(f"No records found for {name} in {year} with gender {gender}.")
+                return False
 
-        while True:
-            # Prompt user for the new count
-            new_count = input(f"\nEnter the new count for {name} in {year} with gender {gender}: ")
+            # Display matching records and their counts
+            print(f"\nMatching records for {name} in {year} with gender {gender}:")
+            for i, record in enumerate(matching_records):
+                print(f"{i + 1}. {record}")
 
-            if int(new_count) >= 0:
-                break
-            else:
-                print("New count must be greater than or equal to 0.")
+            while True:
+                # Prompt user for the new count
+                if new_count is None:
+                    new_count = input(f"\nEnter the new count for {name} in {year} with gender {gender}: ")
 
-        # Update the count of the matching records
-        for record in matching_records:
-            record["Count"] = str(new_count)
+                if int(new_count) >= 0:
+                    break
+                else:
+                    print("New count must be greater than or equal to 0.")
+                    new_count = None
 
-        # Write the updated data back to the file
-        with open(file_path, 'w', newline='') as csv_file:
-            fieldnames = ["Id", "Name", "Year", "Gender", "Count"]
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(existing_data)
+            # Update the count of the matching records in place
+            for record in matching_records:
+                record["Count"] = str(new_count)
+            self._apply_logged(directory, chunk, [(record, False) for record in matching_records])
 
-        print(f"\nCount updated successfully for {name} in {year} with gender {gender}.")
-        return True
+            print(f"\nCount updated successfully for {name} in {year} with gender {gender}.")
+            return True
 
 # ----------------------------------------------------------- #
 # Choice #5: DISPLAY DATA
 # ----------------------------------------------------------- #
     def list_files(self, directory):
-        files = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f)) and f != ".DS_Store"]
-        files.sort()  # Sort the filenames alphabetically
-        return files
+        # Chunk filenames, sorted alphabetically, come from the catalog
+        return self.catalog(directory).filenames()
 # ----------------------------------------------------------- #
 # Choice #6: QUERY DATA
 # ----------------------------------------------------------- #
@@ -266,218 +4101,47 @@ class BabyNamesDatabase:
         print(" " * indent + "FIND Kevin M 2010-2014 CONDITION sum")
         print(" " * indent + "FIND e F 2014 CONDITION top 10 ORDER desc BY Count Return all")
 
+        print("\nEXPLAIN: prefix a query with EXPLAIN for its plan, EXPLAIN ANALYZE to also run it with per-stage timings,")
+        print(" " * indent + "and add JSON for machine-readable output, e.g. EXPLAIN ANALYZE JSON FIND Kevin M 2010-2014 CONDITION sum")
+
         print("\nEXAMPLE ERROR HANDLING:")
         print(" " * indent + "FIND Kevin lksjdfljs 2010-2014 CONDITION sum")
         print(" " * indent + "FIND Kevin M 200009 CONDITION CONDITION sum")
         print("")
 
         query = input("ENTER YOUR QUERY: ")
-        
-        #################### QUERY PARSER ######################
-        try:
-            # Parse the query to extract table names, columns, and conditions
-            parse = query.split()
-
-            # PARSE[1] Find alphabet/names to prep for finding files
-            if parse[1] == '[a-z]':
-                print("\nInvalid syntax. Strictly requires, a-z, [a,b,d,m], Kevin, or [Kevin,Sarah,Dave]. NO SPACES")
-                
-            elif parse[1].startswith('[') and parse[1].endswith(']'):
-                content_in_brackets = parse[1][1:-1].replace(',', ', ').split(', ')
-                a_list = []
-                for i in content_in_brackets:
-                    a_list.append(i[0].lower())
-                    alphabet = a_list
-                
-            else:
-                if parse[1] == 'a-z':
-                    alphabet = string.ascii_lowercase
-                
-                elif isinstance(parse[1], str) and not parse[1].isspace():
-                    alphabet = parse[1][0].lower()
-
-            alphabet = list(alphabet)
-
-            # PARSE[2] GENDER
-            if 'M' in parse[2] and 'F' in parse[2]:
-                gender = ['male', 'female']
-            elif parse[2] == 'F':
-                gender = ['female']
-            elif parse[2] == 'M':
-                gender = ['male']
-            else:
-                print("\nInvalid gender inforamtion. Enter case-sensitive value, e.g., M, F, Female, M-F or M/F")
 
-            # PARSE[3] YEAR
-            if "-" in parse[3]:
-                year_range = parse[3]
-                start_year, end_year = map(str, year_range.split('-'))
-
-                if start_year.isnumeric() and end_year.isnumeric() and len(start_year) == 4 and len(end_year) == 4:
-                    start_year, end_year = int(start_year), int(end_year)
-
-                    if start_year < end_year:
-                        years = list(range(start_year, end_year + 1))
-                    else:
-                        print("\nInvalid year range. Start year must be less than end year.")
-                else:
-                    print("\nInvalid year range. Start and end years must be numeric 4-digit values.")
-
-            elif parse[3].startswith('[') and parse[3].endswith(']'):
-                content_in_brackets = parse[3][1:-1].replace(',', ', ').split(', ')
-                for i in content_in_brackets:
-                    if len(i) != 4:
-                        print("\nInvalid year range. Year must be numeric 4-digit values.")
-                years = content_in_brackets
-                
-            else:
-                if parse[3].isnumeric() and len(parse[3]) == 4:
-                    years = [int(parse[3])]
-                else:
-                    print("\nInvalid year. Must be numeric 4-digits.")
-
-            years = [int(i) for i in years]
-
-            # Create list of filenames according to the query based on name and gender
-            csv_filenames = []
-
-            for g in gender:
-                for l in alphabet:
-                    csv_filenames.append(f"{g}_{l}.csv")
-
-            #################### CREATE / JOIN TABLE ######################
-            # READ & CREATE TABLES based on projection criteria 
-            # JOIN & Filter Data based on criteria
-            # Merge all files / create temporary file
-
-            # Initialize lists to store filtered data and chunk sums
-            filtered_data_list = []
-            total_chunk_sum = []
-
-            for i in csv_filenames:
-                file_path = os.path.join(directory, i)
-
-                # Define chunk size to read in the data
-                chunk_size = 2000000
-                chunk_sum = 0  # Initialize chunk_sum for each file
+        try:
+            #################### EXPLAIN [ANALYZE] ######################
+            # Report the plan (and with ANALYZE, per-stage timings) instead of the rows
+            explain = parse_explain(query)
+            if explain is not None:
+                analyze, as_json, query = explain
+                report = self.explain(directory, query, analyze)
+                return [json.dumps(report, indent=2)] if as_json else format_explain(report)
 
-                try:
-                    data_chunks = pd.read_csv(file_path, chunksize=chunk_size)
-
-                    for chunk in data_chunks:
-                        # Filter for each name only within the chunk
-                        if parse[1].startswith('[') and parse[1].endswith(']'):
-                            content_in_brackets = parse[1][1:-1].replace(',', ', ').split(', ')
-                            # Filter the data for exact matches or names starting with the letters in the list
-                            filtered_for_names = chunk[chunk['Name'].str.lower().isin([name.lower() for name in content_in_brackets]) |
-                                                    chunk['Name'].str.lower().str.startswith(tuple([letter.lower() for letter in content_in_brackets]))]
-                        else:
-                            # Filter the data for exact matches or names starting with the specified letter
-                            filtered_for_names = chunk[chunk['Name'].str.lower().isin([parse[1].lower()]) |
-                                                    chunk['Name'].str.lower().str.startswith(parse[1].lower())]
-
-                        # Filter for the specified years
-                        filter_year = filtered_for_names[filtered_for_names['Year'].isin(years)]
-
-                        # Add the data filter_year to filtered_data_list
-                        filtered_data_list.append(filter_year)
-                        
-                        # APPLY CONDITIONS
-                        if parse[5] == "sum":
-                            chunk_sum += filter_year['Count'].sum()  # Sum for each chunk
-
-                    total_chunk_sum.append(chunk_sum)  # Add the total sum for the file
+            #################### QUERY PARSER ######################
+            # Parse the query into a logical plan and push its filters into the scan
+            plan = self.compile_query(query)
 
-                except FileNotFoundError:
-                    # Handle the case where the file is not found
-                    print(f"File not found: {file_path}. Skipping...")
-                    continue
+            #################### EXECUTE PLAN ######################
+            # Scan only the chunk files the plan selects, applying the filters per chunk
+            data = self.execute_plan(directory, plan)
 
-            # Concatenate all filtered data into one DataFrame
-            data = pd.concat(filtered_data_list, ignore_index=True)
-                
-            #################### APPLY CONDITIONS ######################
-            # Apply conditions to the joined table
-            # Prep Data
-            str_gender = '/'.join(gender)
+            #################### FORMAT RESULT ######################
+            str_gender = '/'.join(plan.genders)
             no_print = 25
 
-            # PARSE [5]: AGGREGATE
-            if parse[5] == 'count':
-                count_rows = len(data)
-                count_rows = '{:,.0f}'.format(count_rows)
-                print_out = (f"For {str_gender} names {parse[1]} during {parse[3]}, total number of rows/records is {count_rows}.")
-
-            elif parse[5] == 'sum':
-                total_sum = sum(total_chunk_sum)
-                total_sum = '{:,.0f}'.format(total_sum)
-                print_out = (f"For {str_gender} during {parse[3]}, total number named {parse[1]} is {total_sum}.")
-
-            elif parse[5] != 'sum' or parse[5] != 'count':
-
-                if parse[5] == 'top':
-                    if parse[6] == None or not parse[6].isnumeric() :
-                        print('/nQUERY ERROR: Please enter numerical value for top condition.')
-                    else:
-                        data = data.sort_values(by=['Count'], ascending=False)
-                        data = data.head(int(parse[6]))
-                        print_out = data.head(no_print).to_string(index=False)
-
-                elif parse[5] == 'bottom':
-                    if parse[6] == None or not parse[6].isnumeric() :
-                        print('/nQUERY ERROR: Please enter numerical value for bottom condition.')
-                    else:
-                        data = data.sort_values(by=['Count'], ascending=True)
-                        data = data.head(int(parse[6]))
-                        print_out = data.head(no_print).to_string(index=False)
+            if plan.aggregate == 'count':
+                count_rows = '{:,.0f}'.format(data)
+                print_out = (f"For {str_gender} names {plan.name_text} during {plan.year_text}, total number of rows/records is {count_rows}.")
 
-                elif parse[5] == 'group':
-                    if parse[6] == None:
-                        print('/nQUERY ERROR: Please enter numerical value for top condition.')
-                    else:
-                        data = data.groupby(parse[6], as_index=False)['Count'].sum()
-                        print_out = data.head(no_print).to_string(index=False)
-                
-                # PARSE[8]: ORDER BY
-                if parse[8].startswith('[') and parse[8].endswith(']'):
-                    content_in_8 = parse[8][1:-1].replace(',', ', ').split(', ')
-                    order_list = [False if i == 'desc' else True for i in content_in_8]
-                            
-                    content_in_10 = parse[10][1:-1].replace(',', ', ').split(', ')
-                    data = data.sort_values(by=content_in_10, ascending=order_list)
-                    print_out = data.head(no_print).to_string(index=False)
-
-                elif parse[8] == 'desc':
-                    if parse[10] == None:
-                        print('/nQUERY ERROR: Please enter value(s) for BY condition.')
-                    else:
-                        bool = False
-                        data = data.sort_values(by=parse[10], ascending=bool)
-                        print_out = data.head(no_print).to_string(index=False)
+            elif plan.aggregate == 'sum':
+                total_sum = '{:,.0f}'.format(data)
+                print_out = (f"For {str_gender} during {plan.year_text}, total number named {plan.name_text} is {total_sum}.")
 
-                elif parse[8] == 'asc':
-                    if parse[10] == None:
-                        print('/nQUERY ERROR: Please enter value(s) for BY condition.')
-                    else:
-                        bool = True
-                        data = data.sort_values(by=parse[10], ascending=bool)
-                        print_out = data.head(no_print).to_string(index=False)
-                       
-                else:
-                    print("/nQUERY ERROR: Invalid ORDER or BY entry.)")
-
-                # PARSE[12]: RETURN COLUMNS
-                if parse[12] == 'all':
-                    print_out = data.head(no_print).to_string(index=False)
-                 
-                elif parse[12].startswith('[') and parse[12].endswith(']'):
-                    content_in_12 = parse[12][1:-1].replace(',', ', ').split(', ')
-                    data = data[content_in_12]
-                    print_out = data.head(no_print).to_string(index=False)
-           
-                else:
-                    data = data[parse[12]]
-                    print_out = data.head(no_print).to_string(index=False)
+            else:
+                print_out = data.to_text(no_print)
 
             #################### OPTION TO SAVE QUERY RESULTS ######################
             # Ask the user if they want to save the results to a CSV file
@@ -489,8 +4153,13 @@ class BabyNamesDatabase:
 
                 # Save the results to the CSV file
                 try:
-                    query_result_df = pd.DataFrame(data)
-                    query_result_df.to_csv(csv_filename, index=False)
+                    if plan.aggregate in ('sum', 'count'):
+                        # Totals are computed without keeping the rows, so rescan for them
+                        self._save_rows(directory, plan.scan, csv_filename)
+                    else:
+                        with ResultSink(csv_filename, data.output_columns, self.save_buffer_size) as sink:
+                            for batch in data.batches():
+                                sink.write(batch)
                     saved_csv = (f"Results saved to {csv_filename} successfully.")
                 except Exception as e:
                     print(f"\nError saving results to CSV: {e}")
@@ -499,14 +4168,18 @@ class BabyNamesDatabase:
 
             #################### RETURN QUERY RESULT ######################
             print_line_2 = (f"\nRESULTS:")
-            no_rows = (f"\nTotal number of rows after applying all query conditions: {len(data)}")
-            note = (f"NOTE: Prints up to {no_print} results.")
 
-            if parse[5] == 'count' or parse[5] == 'sum':
+            if plan.aggregate in ('count', 'sum'):
                 query_result = [print_line_2, print_out, saved_csv]
 
             else:
+                no_rows = (f"\nTotal number of rows after applying all query conditions: {len(data)}")
+                note = (f"NOTE: Prints up to {no_print} results.")
                 query_result = [print_line_2, print_out, no_rows, note, saved_csv]
+                if data.zone_stats['blocks']:
+                    skipped = (f"Zone maps skipped {data.zone_stats['skipped']:,} of {data.zone_stats['blocks']:,} blocks.")
+                    query_result.insert(3, skipped)
+                data.close()  # remove any spilled sort runs
 
             return query_result
 
@@ -514,38 +4187,376 @@ class BabyNamesDatabase:
             print(f"Error executing the query: {e}")
             return []
 
+    #################### PLAN EXECUTION ######################
+    # Paths of the selected chunk files that exist
+    # Partition files of the chunk groups a scan selects that can hold its names
+    def _partition_paths(self, directory, scan):
+        partitions = self.partition_map(directory)
+        return [os.path.join(directory, partition) for filename in scan.files
+                for partition in partitions.files(filename[:-len(".csv")], scan.name_prefixes)]
+
+    def _chunk_paths(self, directory, scan):
+        file_paths = []
+        for file_path in self._partition_paths(directory, scan):
+            if os.path.exists(file_path):
+                file_paths.append(file_path)
+            else:
+                # Handle the case where the file is not found
+                print(f"File not found: {file_path}. Skipping...")
+        return file_paths
+
+    # Stream filtered DataFrame pieces for every chunk file the scan selects
+    def _scan(self, directory, scan):
+        file_paths = self._chunk_paths(directory, scan)
+        if self.chunk_cache is not None:
+            for file_path in file_paths:
+                yield from scan_chunk(file_path, scan, cache=self.chunk_cache)
+            return
+        for file_path, access in self.read_ahead.accesses(file_paths, scan):
+            yield from scan_chunk(file_path, scan, access=access)
+
+    # Whether a scan of these chunk files is fanned out across the process pool
+    def _parallel(self, file_paths):
+        total_bytes = sum(os.path.getsize(file_path) for file_path in file_paths)
+        return self.max_workers > 1 and len(file_paths) > 1 and total_bytes >= self.PARALLEL_MIN_BYTES
+
+    def _process_pool(self):
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.process_pool
+
+    # Partial results of every selected chunk, in file order. Wide scans fan the chunks
+    # out across the process pool; small ones are not worth shipping to other processes.
+    def _scan_partials(self, directory, scan, operator, profile=None, zone_stats=None):
+        file_paths = self._chunk_paths(directory, scan)
+
+        if self.chunk_cache is not None:
+            # Cached chunks live in this process; filtering them in memory beats the pool
+            for file_path in file_paths:
+                partial, _ = reduce_chunk(file_path, scan, operator, self.chunk_cache, profile)
+                yield partial
+            return
+
+        if scan.years is not None or scan.name_prefixes is not None:
+            for file_path in file_paths:
+                self.zone_map(file_path)
+
+        if self._parallel(file_paths):
+            pool = self._process_pool()
+            futures = [pool.submit(reduce_chunk, file_path, scan, operator, None,
+                                   QueryProfile() if profile is not None else None)
+                       for file_path in file_paths]
+            for future in futures:
+                with profile_stage(profile, 'pool wait'):
+                    partial, stats = future.result()
+                add_zone_stats(zone_stats, stats)
+                if profile is not None:
+                    profile.merge(stats['profile'])
+                yield partial
+        elif operator is None:
+            # Plain row scans are passed on piece by piece rather than chunk by chunk
+            for file_path, access in self.read_ahead.accesses(file_paths, scan, profile):
+                yield from scan_chunk(file_path, scan, zone_stats, profile=profile, access=access)
+        else:
+            for file_path, access in self.read_ahead.accesses(file_paths, scan, profile):
+                partial, stats = reduce_chunk(file_path, scan, operator, profile=profile, access=access)
+                add_zone_stats(zone_stats, stats)
+                yield partial
+
+    def _cube_partials(self, directory, scan, operator, profile=None):
+        catalog = self.catalog(directory)
+        for file_path in self._chunk_paths(directory, scan):
+            entry = self._catalog_answer(catalog, file_path, scan, operator)
+            if profile is not None:
+                profile.add_file(file_path, 'catalog' if entry is not None else 'cube')
+            if entry is not None:
+                yield entry["count"] if operator.func == 'sum' else entry["rows"]
+            else:
+                with profile_stage(profile, 'cube') as stage:
+                    partial = self.aggregate_cube(file_path).partial(scan, operator)
+                    stage['rows_out'] += partial_rows(partial)
+                yield partial
+
+    # With no name filter, a sum or count whose years cover a chunk's whole year range
+    # is read off the chunk's catalog entry; returns that entry, or None
+    def _catalog_answer(self, catalog, file_path, scan, operator):
+        if not isinstance(operator, Aggregate) or scan.name_prefixes is not None:
+            return None
+        entry = catalog.entry(os.path.basename(file_path))
+        if entry is None:
+            return None
+        if scan.years is None or entry["rows"] == 0 or \
+                set(scan.years).issuperset(range(entry["min_year"], entry["max_year"] + 1)):
+            return entry
+        return None
+
+    # Run a plan, answering repeats over unchanged chunks from the result cache
+    def execute_plan(self, directory, plan):
+        self.checkpoint()
+        with self._group_locks(directory, [self._group(filename) for filename in plan.scan.files]):
+            file_paths = self._partition_paths(directory, plan.scan)
+            versions = []
+            for file_path in file_paths:
+                try:
+                    stat = os.stat(file_path)
+                    versions.append((stat.st_size, stat.st_mtime_ns))
+                except FileNotFoundError:
+                    versions.append(None)
+            key = (os.path.normpath(directory), plan_key(plan), tuple(versions))
+
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                value, zone_stats, _, _ = cached
+                self._chunk_paths(directory, plan.scan)  # same missing-file notices as a scan
+                if isinstance(value, int):
+                    return value
+                projection = next((op.columns for op in plan.operators if isinstance(op, Project)), None)
+                if isinstance(value, list):
+                    result = RowResult(list(plan.scan.columns), value, projection=projection)
+                else:
+                    result = QueryResult(list(value.columns), projection=projection)
+                    result.add(value)
+                result.zone_stats = dict(zone_stats)
+                return result
+
+            result = self._execute_plan(directory, plan)
+            if isinstance(result, QueryResult):
+                value, zone_stats = result.in_memory_rows(), result.zone_stats
+            else:
+                value, zone_stats = result, {'blocks': 0, 'skipped': 0}
+            if value is not None:
+                self.result_cache.put(key, value, zone_stats, file_paths)
+            return result
+
+    # The leading aggregate / top-N / group operator of a plan (run per chunk, then
+    # merged) and the operators after it
+    def _head_operator(self, plan):
+        operators = list(plan.operators)
+        head = None
+        if operators and isinstance(operators[0], (Aggregate, TopN, GroupBy)):
+            head = operators.pop(0)
+        return head, operators
+
+    # Sums, counts and Name/Gender/Year groups are answered from the aggregate cubes
+    def _uses_cubes(self, head):
+        return isinstance(head, Aggregate) or (isinstance(head, GroupBy) and head.column in ('Name', 'Gender', 'Year'))
+
+    def _execute_plan(self, directory, plan, profile=None):
+        zone_stats = {'blocks': 0, 'skipped': 0}
+
+        head, operators = self._head_operator(plan)
+        if head is None:
+            file_paths = [file_path for file_path in self._partition_paths(directory, plan.scan)
+                          if os.path.exists(file_path)]
+            accesses = self._lookup_accesses(file_paths, plan.scan)
+            if accesses is not None:
+                return self._lookup(directory, plan, operators, accesses, profile)
+        if self._uses_cubes(head):
+            partials = self._cube_partials(directory, plan.scan, head, profile)
+        else:
+            partials = self._scan_partials(directory, plan.scan, head, profile, zone_stats)
+        if isinstance(head, Aggregate):
+            with profile_stage(profile, 'merge') as entry:
+                total = merge_partials(count_rows(partials, entry), head, plan.scan.columns)
+                entry['rows_out'] += 1
+            return total
+
+        columns = plan.scan.columns
+        if head is not None:
+            # Top-N and group results are small; merge them into a single batch
+            with profile_stage(profile, 'merge') as entry:
+                partials = [merge_partials(count_rows(partials, entry), head, columns)]
+                entry['rows_out'] += len(partials[0])
+            if isinstance(head, GroupBy):
+                columns = [head.column, 'Count']
+
+        # ORDER BY and RETURN are applied while the rows are spooled and read back
+        result = QueryResult(columns, profile=profile)
+        result.zone_stats = zone_stats  # filled in as the partials below are scanned
+        for operator in operators:
+            if isinstance(operator, Sort):
+                result.by, result.ascending = operator.by, operator.ascending
+            elif isinstance(operator, Project):
+                result.projection = operator.columns
+
+        for batch in partials:
+            result.add(batch)
+        return result
+
+    # chunk_access() of each file when a row query is a lookup (see RowResult): a name
+    # filter, chunks read from CSV or compressed blocks, and under ROW_LOOKUP_BYTES in all
+    def _lookup_accesses(self, file_paths, scan):
+        if self.chunk_cache is not None or scan.name_prefixes is None:
+            return None
+        accesses = {}
+        for file_path in file_paths:
+            self.zone_map(file_path)
+            access = accesses[file_path] = chunk_access(file_path, scan)
+            if access['source'] == 'columnar':
+                return None
+        if sum(access['bytes'] for access in accesses.values()) > self.ROW_LOOKUP_BYTES:
+            return None
+        return accesses
+
+    def _lookup(self, directory, plan, operators, accesses, profile=None):
+        rows, zone_stats = [], {'blocks': 0, 'skipped': 0}
+        for file_path in self._chunk_paths(directory, plan.scan):
+            access = accesses.get(file_path) or chunk_access(file_path, plan.scan)
+            add_zone_stats(zone_stats, access)
+            if profile is not None:
+                profile.add_file(file_path, access['source'], access['bytes'], access['blocks'], access['skipped'])
+            with profile_stage(profile, 'read') as entry:
+                found = lookup_rows(file_path, plan.scan, access)
+                entry['bytes'] += access['bytes']
+                entry['rows_out'] += len(found)
+            rows.extend(found)
+
+        by = ascending = projection = None
+        for operator in operators:
+            if isinstance(operator, Sort):
+                by, ascending = operator.by, operator.ascending
+            elif isinstance(operator, Project):
+                projection = operator.columns
+        result = RowResult(list(plan.scan.columns), rows, by, ascending, projection, profile)
+        result.zone_stats = zone_stats
+        return result
+
+    # Write every row matched by a scan to a CSV file, one chunk at a time
+    def _save_rows(self, directory, scan, csv_filename):
+        full_scan = Scan(scan.files)
+        full_scan.name_prefixes, full_scan.years = scan.name_prefixes, scan.years
+
+        with self._group_locks(directory, [self._group(filename) for filename in scan.files]), \
+                ResultSink(csv_filename, FIELDNAMES, self.save_buffer_size) as sink:
+            for batch in self._scan(directory, full_scan):
+                sink.write(batch)
+
 # ----------------------------------------------------------- #
 # Choice #7: CLEAR DATA
 # ----------------------------------------------------------- #
     def clear_data(self, directory):
-        # Clear local data
-        self.names_data = []
+        # Wait until no other process is using the directory: its lock, then every group lock
+        lock_paths = [os.path.join(directory, filename) for filename in os.listdir(directory)
+                      if filename.startswith(".") and filename.endswith(".csv.lock")]
+        with self.locks.hold([os.path.join(directory, ".lock")], exclusive=True), \
+                self.locks.hold(lock_paths, exclusive=True):
+            # Clear local data
+            self.names_data = []
+            self.chunks = {}
+            self.cubes = {}
+            self.zone_maps = {}
+            self.catalogs = {}
+            self.partition_maps = {}
+            self.result_cache.clear()
+
+            # Logged changes go with the data
+            self._cancel_checkpoint()
+            with self.pending_lock:
+                for wal in self.wals.values():
+                    wal.close()
+                self.wals, self.pending, self.next_ids, self.pending_changes = {}, {}, {}, 0
+
+            # Remove all files in the 'data_chunks' directory, except the lock files other
+            # processes may be waiting on and the logs of processes still running
+            for filename in os.listdir(directory):
+                file_path = os.path.join(directory, filename)
+                if filename.endswith(".lock"):
+                    continue
+                if filename.startswith(".wal-"):
+                    log_file = WriteAheadLog.owner_gone(file_path)
+                    if log_file is None:
+                        continue
+                    log_file.close()
+                try:
+                    os.remove(file_path)
+                    print(f"File '{filename}' removed.")
+                except OSError as e:
+                    print(f"Error removing file '{filename}': {e}")
+        self.locks.release_retained()
 
-        # Remove all files in the 'data_chunks' directory
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
-            try:
-                os.remove(file_path)
-                print(f"File '{filename}' removed.")
-            except OSError as e:
-                print(f"Error removing file '{filename}': {e}")
-                
 # ----------------------------------------------------------- #
 # Choice #8: CLOSE / EXIT
 # ----------------------------------------------------------- #
     def close(self):
-        pass
+        self.checkpoint()
+        for wal in self.wals.values():
+            wal.close()
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+            self.process_pool = None
+        self.read_ahead.close()
 
 # ----------------------------------------------------------- #
 # EXECUTE MAIN
 # ----------------------------------------------------------- #
 def main():
+    parser = argparse.ArgumentParser(description="Baby names relational database CLI")
+    parser.add_argument("--convert-columnar", metavar="DIRECTORY",
+                        help="convert the CSV chunks in DIRECTORY to the columnar format and exit")
+    parser.add_argument("--compress-chunks", metavar="DIRECTORY",
+                        help="keep block-compressed copies of the chunks in DIRECTORY for queries and exit")
+    parser.add_argument("--cluster-chunks", metavar="DIRECTORY",
+                        help="sort the chunks in DIRECTORY by name for binary-searched name lookups and exit")
+    parser.add_argument("--codec", choices=sorted(CompressedChunk.CODECS), default="zlib",
+                        help="compression used by --compress-chunks (default: zlib)")
+    parser.add_argument("--partition-size", type=int, default=64 * 1024 * 1024, metavar="BYTES",
+                        help="split chunk files larger than this by longer name prefixes (default: 64 MiB)")
+    parser.add_argument("--save-buffer-size", type=int, default=1024 * 1024, metavar="BYTES",
+                        help="write buffer used when saving query results (default: 1 MiB)")
+    parser.add_argument("--display", metavar="CHUNK",
+                        help="print the rows of the chunk file CHUNK (e.g. data_chunks/male_a.csv) and exit")
+    parser.add_argument("--offset", type=int, default=0, metavar="ROWS",
+                        help="rows of the chunk --display skips first (default: 0)")
+    parser.add_argument("--limit", type=int, metavar="ROWS",
+                        help="rows --display prints (default: all); also the page size of Display data")
+    parser.add_argument("--read-ahead", type=int, default=2, metavar="FILES",
+                        help="chunk files a query reads ahead while filtering the current one (default: 2, 0 = off)")
+    parser.add_argument("--read-ahead-size", type=int, default=256 * 1024 * 1024, metavar="BYTES",
+                        help="memory for chunk files read ahead by a query (default: 256 MiB)")
+    args = parser.parse_args()
+
+    if args.convert_columnar:
+        BabyNamesDatabase(os.path.join(args.convert_columnar, "dummy.csv")).convert_to_columnar(args.convert_columnar)
+        return
+    if args.compress_chunks:
+        BabyNamesDatabase(os.path.join(args.compress_chunks, "dummy.csv")).compress_chunks(args.compress_chunks, args.codec)
+        return
+    if args.cluster_chunks:
+        BabyNamesDatabase(os.path.join(args.cluster_chunks, "dummy.csv")).cluster_chunks(args.cluster_chunks)
+        return
+    if args.display:
+        display_directory, display_file = os.path.split(args.display)
+        display_directory = display_directory or "."
+        database = BabyNamesDatabase(os.path.join(display_directory, "dummy.csv"))
+        offset, remaining = args.offset, args.limit
+        # One page at a time, so printing a whole chunk never holds it in memory
+        while remaining is None or remaining > 0:
+            page_rows = DISPLAY_PAGE_ROWS if remaining is None else min(remaining, DISPLAY_PAGE_ROWS)
+            data = database.read_data(display_directory, display_file, offset, page_rows)
+            for item in data:
+                print(item)
+            offset += len(data)
+            if remaining is not None:
+                remaining -= len(data)
+            if len(data) < page_rows:
+                break
+        database.close()
+        return
+
     # set up directory for loading data and creating the instance
     directory = input("Enter the directory where data chunks will be stored: ")
     os.makedirs(directory, exist_ok=True) 
 
     dummy_file_path = os.path.join(directory, "dummy.csv") #create directory with dummy file as placholder until there is real data
     database = BabyNamesDatabase(dummy_file_path) #Create instance using dummy file path
+    database.save_buffer_size = args.save_buffer_size
+    database.read_ahead = ReadAhead(args.read_ahead, args.read_ahead_size)
+    database.partition_bytes = args.partition_size
+
+    # Redo any changes a crash left in the write-ahead log
+    replayed = database.recover(directory)
+    if replayed:
+        print(f"Replayed {replayed} logged changes into the data chunks.")
 
     # Prompt User interaction
     while True:
@@ -598,10 +4609,24 @@ def main():
                 print(file)
             print("")
             selected_file = input("Enter the filename to display data (e.g., male_a.csv): ")
-            data = database.read_data(directory, selected_file)
             print("\nFile contents:")
-            for item in data:
-                print(item)
+            # Shown a page at a time; only the rows of the page are read
+            page_rows = args.limit or DISPLAY_PAGE_ROWS
+            offset = 0
+            while True:
+                data = database.read_data(directory, selected_file, offset, page_rows)
+                for item in data:
+                    print(item)
+                if len(data) < page_rows:
+                    break
+                answer = input(f"\nRows {offset + 1:,}-{offset + len(data):,} shown. Press Enter for the next page, "
+                               f"enter a row number to jump to it, or q to stop: ").strip()
+                if answer.isdigit():
+                    offset = max(int(answer) - 1, 0)
+                elif answer:
+                    break
+                else:
+                    offset += len(data)
 
         elif choice == '6':
             result = database.query(directory)
@@ -0,0 +1,258 @@
+import os
+import json
+import asyncio
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from csv_cli import BabyNamesDatabase, ChunkCache, parse_explain
+
+# ----------------------------------------------------------- #
+# QUERY SERVER FOR THE CSV DATABASE
+# ----------------------------------------------------------- #
+# Keeps one BabyNamesDatabase open for many clients, so compiled plans, chunk indexes,
+# aggregate cubes, zone maps, the catalog and a ChunkCache of decoded chunks stay warm
+# between requests instead of being rebuilt by every CLI process. The protocol is one
+# JSON object per line in each direction, over a Unix socket or a localhost TCP port:
+#
+#   {"op": "find", "query": "FIND Emma F 2010 CONDITION None None", "limit": 100}
+#   {"op": "explain", "query": "EXPLAIN ANALYZE FIND Emma F 2010 CONDITION None None"}
+#   {"op": "insert", "name": "Emma", "gender": "F", "year": 2010}
+#   {"op": "insert_many", "records": [["Emma", "F", 2010], ["Liam", "M", 2011]]}
+#   {"op": "load", "path": "names.csv", "resume": true}
+#   {"op": "delete", "name": "Emma", "gender": "F", "year": 2010, "count": "all"}
+#   {"op": "update", "name": "Emma", "gender": "F", "year": 2010, "count": 5}
+#   {"op": "ping"} / {"op": "stats"}
+#
+# Replies are {"ok": true, ...} or {"ok": false, "error": "..."}. Database calls run on a
+# thread pool. Readers and writers are isolated per chunk file: a FIND holds shared locks
+# on the chunks its plan scans, an edit holds the exclusive lock of the chunk it changes
+# and checkpoints before releasing it, and a batch load excludes everything else. These
+# order the server's own threads; the database calls also take the file locks of their
+# chunk groups (see ChunkLocks), so CLI and script processes can share the directory.
+#
+#   python src/csv_server.py data_chunks --socket /tmp/babynames.sock
+
+DEFAULT_LIMIT = 1000             # rows returned by a FIND unless the request sets "limit"
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+# asyncio readers-writer lock; waiting writers block new readers so they are not starved
+class ReadWriteLock:
+    def __init__(self):
+        self.condition = asyncio.Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.writer and not self.waiting_writers)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        async with self.condition:
+            self.waiting_writers += 1
+            try:
+                await self.condition.wait_for(lambda: not self.writer and not self.readers)
+            finally:
+                self.waiting_writers -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+class QueryServer:
+    def __init__(self, directory, cache_bytes, workers=None):
+        self.directory = directory
+        self.database = BabyNamesDatabase(os.path.join(directory, "dummy.csv"))
+        self.database.chunk_cache = ChunkCache(cache_bytes)
+        self.executor = ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4))
+        self.directory_lock = ReadWriteLock()  # batch loads write, every other request reads
+        self.chunk_locks = {}  # chunk filename -> ReadWriteLock
+        self.requests = 0
+
+    def recover(self):
+        return self.database.recover(self.directory)
+
+    async def run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: function(*args, **kwargs))
+
+    # Take shared or exclusive locks on chunk files, always in sorted order to avoid deadlocks
+    @contextlib.asynccontextmanager
+    async def lock_chunks(self, filenames, exclusive):
+        async with contextlib.AsyncExitStack() as stack:
+            await stack.enter_async_context(self.directory_lock.read())
+            for filename in sorted(set(filenames)):
+                lock = self.chunk_locks.setdefault(filename, ReadWriteLock())
+                await stack.enter_async_context(lock.write() if exclusive else lock.read())
+            yield
+
+    # Chunk group file of a record, the unit FIND plans and chunk locks work with
+    def _filename(self, request):
+        gender = str(request["gender"]).upper()
+        if gender not in ("M", "F"):
+            raise ValueError("gender must be M or F")
+        return self.database.chunk_group(str(request["name"]), gender) + ".csv"
+
+    # Apply changes and checkpoint them while the chunk locks are held, so no reader
+    # ever sees a chunk with changes pending for it
+    def _write(self, function, *args, **kwargs):
+        result = function(*args, **kwargs)
+        self.database.checkpoint()
+        return result
+
+    ########################## REQUEST HANDLERS ###########################
+    async def op_ping(self, request):
+        return {}
+
+    async def op_find(self, request):
+        plan = self.database.compile_query(request["query"])
+        limit = int(request.get("limit", DEFAULT_LIMIT))
+        async with self.lock_chunks(plan.scan.files, exclusive=False):
+            return await self.run(self._find, plan, limit)
+
+    def _find(self, plan, limit):
+        data = self.database.execute_plan(self.directory, plan)
+        if not hasattr(data, 'head'):
+            return {"value": data.item() if hasattr(data, 'item') else data}
+        try:
+            rows = data.head(limit)
+            if rows.ndim == 1:
+                rows = rows.to_frame()  # RETURN of a single column
+            return {"columns": list(rows.columns), "rows": json.loads(rows.to_json(orient='values')),
+                    "total": len(data)}
+        finally:
+            data.close()
+
+    # EXPLAIN [ANALYZE] report of a FIND (the EXPLAIN prefix is optional; "analyze": true
+    # does the same as ANALYZE)
+    async def op_explain(self, request):
+        query, analyze = request["query"], bool(request.get("analyze", False))
+        explain = parse_explain(query)
+        if explain is not None:
+            analyze, _, query = explain
+        plan = self.database.compile_query(query)
+        async with self.lock_chunks(plan.scan.files, exclusive=False):
+            return {"explain": await self.run(self.database.explain, self.directory, query, analyze)}
+
+    async def op_insert(self, request):
+        record = (str(request["name"]), str(request["gender"]).upper(), str(int(request["year"])))
+        async with self.lock_chunks([self._filename(request)], exclusive=True):
+            await self.run(self._write, self.database.insert_many, self.directory, [record])
+        return {"inserted": 1}
+
+    async def op_insert_many(self, request):
+        records, filenames = [], []
+        for name, gender, year in request["records"]:
+            record = {"name": name, "gender": gender}
+            filenames.append(self._filename(record))
+            records.append((str(name), str(gender).upper(), str(int(year))))
+        async with self.lock_chunks(filenames, exclusive=True):
+            inserted = await self.run(self._write, self.database.insert_many, self.directory, records)
+        return {"inserted": inserted}
+
+    async def op_load(self, request):
+        async with self.directory_lock.write():
+            await self.run(self._write, self.database.load_batch_data, self.directory, request["path"],
+                           resume=bool(request.get("resume", True)))
+        return {}
+
+    async def op_delete(self, request):
+        async with self.lock_chunks([self._filename(request)], exclusive=True):
+            deleted = await self.run(self._write, self.database.delete, self.directory, str(request["name"]),
+                                     str(int(request["year"])), str(request["gender"]).upper(),
+                                     delete_count=request["count"])
+        return {"changed": deleted}
+
+    async def op_update(self, request):
+        async with self.lock_chunks([self._filename(request)], exclusive=True):
+            updated = await self.run(self._write, self.database.update, self.directory, str(request["name"]),
+                                     str(int(request["year"])), str(request["gender"]).upper(),
+                                     new_count=int(request["count"]))
+        return {"changed": updated}
+
+    async def op_stats(self, request):
+        return {"requests": self.requests, "cache": self.database.chunk_cache.stats(),
+                "results": self.database.result_cache.stats(),
+                "cached_plans": len(self.database.plan_cache), "pending_changes": self.database.pending_changes}
+
+    ############################# CONNECTIONS #############################
+    async def handle(self, line):
+        try:
+            request = json.loads(line)
+            handler = getattr(self, "op_" + str(request.get("op")), None)
+            if handler is None:
+                raise ValueError(f"unknown op: {request.get('op')}")
+            self.requests += 1
+            return dict(await handler(request), ok=True)
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    async def serve_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                response = await self.handle(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass  # client went away or sent an oversized line
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None, host="127.0.0.1", port=None):
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.serve_client, socket_path, limit=MAX_REQUEST_BYTES)
+            print(f"Serving {self.directory} on {socket_path}")
+        else:
+            server = await asyncio.start_server(self.serve_client, host, port, limit=MAX_REQUEST_BYTES)
+            print(f"Serving {self.directory} on {host}:{server.sockets[0].getsockname()[1]}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
+        self.database.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Query server for the baby names CSV database")
+    parser.add_argument("directory", help="directory holding the data chunks")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--socket", metavar="PATH", help="listen on this Unix socket")
+    group.add_argument("--port", type=int, default=8551, help="listen on this localhost TCP port (default: 8551)")
+    parser.add_argument("--cache-mb", type=int, default=512,
+                        help="memory for decoded chunks kept between queries (default: 512)")
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    server = QueryServer(args.directory, args.cache_mb * 1024 * 1024)
+    replayed = server.recover()
+    if replayed:
+        print(f"Replayed {replayed} logged changes into the data chunks.")
+    try:
+        asyncio.run(server.serve(args.socket, port=args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import os
+import io
+import csv
+import sys
+import random
+import shutil
+import contextlib
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import csv_cli  # noqa: E402
+from csv_cli import BabyNamesDatabase, FIELDNAMES  # noqa: E402
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+SYLLABLES = ["an", "bel", "ca", "da", "el", "ja", "ka", "li", "ma", "ol", "ra", "sa", "ze", "vi", "qu"]
+YEARS = range(1990, 2015)
+
+# Small zone map blocks, so a chunk of the test data spans several blocks and scans can
+# skip some or all of them
+@pytest.fixture(autouse=True, scope="session")
+def small_blocks():
+    block_rows = csv_cli.ZoneMap.BLOCK_ROWS
+    csv_cli.ZoneMap.BLOCK_ROWS = 64
+    yield
+    csv_cli.ZoneMap.BLOCK_ROWS = block_rows
+
+# Source CSV rows with unique (Name, Year, Gender), in a seeded random order
+def make_rows(count=6000, seed=7):
+    rng = random.Random(seed)
+    names = sorted({(rng.choice(SYLLABLES) + rng.choice(SYLLABLES) + rng.choice(SYLLABLES)).capitalize()
+                    for _ in range(600)})
+    keys = set()
+    while len(keys) < count:
+        keys.add((rng.choice(names), rng.choice(YEARS), rng.choice("MF")))
+    keys = sorted(keys)
+    rng.shuffle(keys)
+    return [{"Id": row_id, "Name": name, "Year": year, "Gender": gender, "Count": rng.randint(5, 5000)}
+            for row_id, (name, year, gender) in enumerate(keys)]
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def open_database(directory):
+    return BabyNamesDatabase(os.path.join(directory, "dummy.csv"))
+
+# Quiet batch load of a source CSV into directory
+def load(directory, source, batch_size=1000, partition_bytes=None, **kwargs):
+    database = open_database(directory)
+    if partition_bytes is not None:
+        database.partition_bytes = partition_bytes
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            database.load_batch_data(directory, source, batch_size=batch_size, **kwargs)
+    finally:
+        database.close()
+
+# Live rows of every chunk in a directory as sorted (Name, Year, Gender, Count) tuples
+def chunk_rows(directory):
+    rows = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.startswith(".") or not filename.endswith(".csv"):
+            continue
+        with open(os.path.join(directory, filename), newline="") as chunk_file:
+            for row in csv.DictReader(csv_cli.live_lines(chunk_file)):
+                rows.append((row["Name"], int(row["Year"]), row["Gender"], int(row["Count"])))
+    return sorted(rows)
+
+@pytest.fixture(scope="session")
+def source_rows():
+    return make_rows()
+
+@pytest.fixture(scope="session")
+def source_csv(tmp_path_factory, source_rows):
+    path = tmp_path_factory.mktemp("source") / "names.csv"
+    write_csv(path, source_rows)
+    return str(path)
+
+@pytest.fixture(scope="session")
+def loaded_template(tmp_path_factory, source_csv, small_blocks):
+    directory = str(tmp_path_factory.mktemp("template") / "data")
+    load(directory, source_csv)
+    return directory
+
+# A fresh copy of the loaded data directory for one test
+@pytest.fixture
+def data_dir(tmp_path, loaded_template):
+    directory = str(tmp_path / "data")
+    shutil.copytree(loaded_template, directory,
+                    ignore=lambda _, names: [name for name in names if name.endswith(".lock") or ".wal" in name])
+    return directory
+
+@pytest.fixture
+def database(data_dir):
+    database = open_database(data_dir)
+    yield database
+    database.close()
@@ -0,0 +1,26 @@
+import os
+
+from conftest import open_database
+
+
+# Files that are not chunks stay out of the catalog rebuilt from the directory listing
+def test_stray_files_are_not_chunks(data_dir, source_rows):
+    chunks = sorted(filename for filename in os.listdir(data_dir)
+                    if not filename.startswith(".") and filename.endswith(".csv"))
+    strays = {"README.md": "Baby names chunks\n", "notes.csv": "a,b\n1,2\n",
+              "male_export.csv": "Name,Total\nKevin,10\n", "female_q.txt": "Id,Name,Year,Gender,Count\n"}
+    for filename, text in strays.items():
+        with open(os.path.join(data_dir, filename), "w") as stray_file:
+            stray_file.write(text)
+    os.mkdir(os.path.join(data_dir, "male_dir.csv"))
+    os.remove(os.path.join(data_dir, ".catalog"))
+
+    database = open_database(data_dir)
+    try:
+        assert database.list_files(data_dir) == chunks
+        assert database.read_data(data_dir, chunks[0], offset=2, limit=3)
+        assert database.run_query(data_dir, "FIND a-z M/F 1990-2014 CONDITION count") == len(source_rows)
+        assert database.run_query(data_dir, "FIND a-z M/F 1990-2014 CONDITION sum") == \
+            sum(row["Count"] for row in source_rows)
+    finally:
+        database.close()
@@ -0,0 +1,92 @@
+import pytest
+
+from conftest import chunk_rows, open_database
+
+
+def count_of(database, directory, name, gender, year):
+    return database.run_query(directory, f"FIND {name} {gender} {year} CONDITION sum")
+
+def rows_of(database, directory, name, gender, year):
+    result = database.run_query(directory, f"FIND {name} {gender} {year} CONDITION None None")
+    rows = [row for batch in result.batches() for row in batch.itertuples(index=False, name=None)]
+    result.close()
+    return [row for row in rows if row[1] == name]
+
+@pytest.fixture
+def existing(source_rows):
+    # A source row whose name is no prefix of another name in the same chunk and year
+    for row in source_rows:
+        if not any(other is not row and other["Name"].lower().startswith(row["Name"].lower())
+                   and other["Gender"] == row["Gender"] and other["Year"] == row["Year"] for other in source_rows):
+            return row
+
+
+def test_insert_new_and_existing_rows(database, data_dir, existing):
+    database.insert(data_dir, "Qqnew", "F", 2001)
+    database.insert(data_dir, "Qqnew", "F", 2001)
+    database.insert(data_dir, existing["Name"], existing["Gender"], existing["Year"])
+
+    assert count_of(database, data_dir, "Qqnew", "F", 2001) == 2
+    assert count_of(database, data_dir, existing["Name"], existing["Gender"], existing["Year"]) == existing["Count"] + 1
+    rows = rows_of(database, data_dir, "Qqnew", "F", 2001)
+    assert [(row[1], row[2], row[3], row[4]) for row in rows] == [("Qqnew", 2001, "F", 2)]
+
+
+def test_insert_many_sums_repeated_records(database, data_dir, existing):
+    records = [("Qqmany", "M", 1999)] * 3 + [(existing["Name"], existing["Gender"], existing["Year"])] * 2
+    assert database.insert_many(data_dir, records) == 5
+    assert count_of(database, data_dir, "Qqmany", "M", 1999) == 3
+    assert count_of(database, data_dir, existing["Name"], existing["Gender"], existing["Year"]) == existing["Count"] + 2
+
+
+def test_delete_part_of_a_count_and_all(database, data_dir, existing):
+    name, gender, year = existing["Name"], existing["Gender"], existing["Year"]
+    assert database.delete(data_dir, name, year, gender, delete_count=1)
+    assert count_of(database, data_dir, name, gender, year) == existing["Count"] - 1
+
+    assert database.delete(data_dir, name, year, gender, delete_count="all")
+    assert rows_of(database, data_dir, name, gender, year) == []
+    assert not database.delete(data_dir, name, year, gender, delete_count="all")
+
+
+def test_delete_rejects_counts_out_of_range(database, data_dir, existing):
+    name, gender, year = existing["Name"], existing["Gender"], existing["Year"]
+    assert not database.delete(data_dir, name, year, gender, delete_count=existing["Count"] + 1)
+    assert not database.delete(data_dir, name, year, gender, delete_count="many")
+    assert count_of(database, data_dir, name, gender, year) == existing["Count"]
+
+
+def test_update_sets_the_count(database, data_dir, existing):
+    name, gender, year = existing["Name"], existing["Gender"], existing["Year"]
+    total = database.run_query(data_dir, "FIND a-z M/F 1990-2014 CONDITION sum")
+    assert database.update(data_dir, name, year, gender, new_count=12345)
+    assert count_of(database, data_dir, name, gender, year) == 12345
+    assert database.run_query(data_dir, "FIND a-z M/F 1990-2014 CONDITION sum") == total - existing["Count"] + 12345
+    assert not database.update(data_dir, "Qqmissing", 2000, "M", new_count=1)
+
+
+# Deleted rows leave tombstones until compaction; neither shows in reads or queries
+def test_tombstones_and_compaction(database, data_dir, source_rows):
+    gender = source_rows[0]["Gender"]
+    filename = f"{'male' if gender == 'M' else 'female'}_{source_rows[0]['Name'][0].lower()}.csv"
+    before = database.read_data(data_dir, filename)
+    doomed = before[1:len(before):3]
+    for row in doomed:
+        assert database.delete(data_dir, row["Name"], int(row["Year"]), row["Gender"], delete_count="all")
+
+    live = [row for row in before if row not in doomed]
+    assert database.read_data(data_dir, filename) == live
+    assert database.read_data(data_dir, filename, offset=5, limit=7) == live[5:12]
+    expected_rows = chunk_rows(data_dir)
+
+    database.compact(data_dir)
+    assert database.read_data(data_dir, filename) == live
+    assert database.read_data(data_dir, filename, offset=5, limit=7) == live[5:12]
+    assert chunk_rows(data_dir) == expected_rows
+
+    reopened = open_database(data_dir)
+    try:
+        count = reopened.run_query(data_dir, f"FIND {filename.split('_')[1][0]} {gender} 1990-2014 CONDITION count")
+    finally:
+        reopened.close()
+    assert count == len(live)
@@ -0,0 +1,153 @@
+import io
+import contextlib
+
+import pandas as pd
+import pytest
+
+from csv_cli import BabyNamesDatabase, ChunkCache, QueryResult, RowResult
+from conftest import load, open_database
+
+QUERIES = [
+    "FIND a-z M/F 1990-2014 CONDITION sum",
+    "FIND a-z M/F 1990-2014 CONDITION count",
+    "FIND [a,k,z] F [1995,2003,2011] CONDITION sum",
+    "FIND Ka M 2000-2009 CONDITION count",
+    "FIND [e,m] M/F 1990-2014 CONDITION top 7",
+    "FIND s F 2000-2005 CONDITION bottom 4",
+    "FIND [b,d,o] M/F 1990-2014 CONDITION group Year",
+    "FIND a-z F 2001 CONDITION group Name",
+    "FIND [j,l] M 1998-2004 CONDITION group Gender",
+    "FIND [r,Vi] M/F 1990-1999 CONDITION None None",
+    "FIND c M/F 2010 CONDITION None None ORDER [asc,desc] BY [Name,Count] RETURN [Name,Count]",
+]
+
+LAYOUTS = ["plain", "columnar", "compressed", "clustered", "partitioned", "chunk cache", "parallel"]
+
+ROW_QUERIES = [
+    "FIND {name} {gender} 1990-2014 CONDITION None None",
+    "FIND {name} M/F [1992,2001,2013] CONDITION None None ORDER [desc,asc] BY [Count,Year] RETURN [Year,Count,Id]",
+    "FIND [{prefix},Zzzz] {gender} 1990-2014 CONDITION None None ORDER asc BY Name RETURN Name",
+    "FIND Zzzz M 2010 CONDITION None None",
+]
+
+
+# The answer of a query computed with pandas straight from the source rows
+def expected(source, query):
+    tokens = query.split()
+    names, gender, years = tokens[1:4]
+    frame = source
+    if names != 'a-z':
+        prefixes = tuple(name.lower() for name in names.strip('[]').split(','))
+        frame = frame[frame['Name'].str.lower().str.startswith(prefixes)]
+    if gender != 'M/F':
+        frame = frame[frame['Gender'] == gender]
+    if '-' in years:
+        start, end = years.split('-')
+        frame = frame[frame['Year'].between(int(start), int(end))]
+    else:
+        frame = frame[frame['Year'].isin([int(year) for year in years.strip('[]').split(',')])]
+
+    func, value = tokens[5], tokens[6] if len(tokens) > 6 else None
+    if func == 'sum':
+        return int(frame['Count'].sum())
+    if func == 'count':
+        return len(frame)
+    if func in ('top', 'bottom'):
+        return sorted(frame['Count'], reverse=(func == 'top'))[:int(value)]
+    if func == 'group':
+        return sorted(frame.groupby(value)['Count'].sum().items())
+    return sorted(frame[['Name', 'Year', 'Gender', 'Count']].itertuples(index=False, name=None))
+
+# The same shape of answer from a query result
+def answer(query, result):
+    if not isinstance(result, QueryResult):
+        return int(result)
+    frame = pd.concat(list(result.batches()) or [pd.DataFrame()], ignore_index=True)
+    result.close()
+    func, value = query.split()[5:7]
+    if func in ('top', 'bottom'):
+        return sorted(frame['Count'], reverse=(func == 'top'))
+    if func == 'group':
+        return sorted(zip(frame[value], frame['Count']))
+    if 'RETURN' in query:
+        return frame
+    return sorted(frame[['Name', 'Year', 'Gender', 'Count']].itertuples(index=False, name=None))
+
+
+@pytest.fixture(params=LAYOUTS)
+def layout_database(request, tmp_path, source_csv, data_dir):
+    layout = request.param
+    directory = data_dir
+    if layout == "partitioned":
+        directory = str(tmp_path / "partitioned")
+        load(directory, source_csv, partition_bytes=4096)
+    database = open_database(directory)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if layout == "columnar":
+            database.convert_to_columnar(directory)
+        elif layout == "compressed":
+            database.compress_chunks(directory)
+        elif layout == "clustered":
+            database.cluster_chunks(directory)
+    database.ROW_LOOKUP_BYTES = -1  # row queries scan with pandas (see test_row_lookup_matches_scan)
+    if layout == "chunk cache":
+        database.chunk_cache = ChunkCache()
+    elif layout == "parallel":
+        database.PARALLEL_MIN_BYTES = 0
+        database.max_workers = 2
+    yield database, directory
+    database.close()
+
+
+def test_partitioned_layout_splits_chunks(tmp_path, source_csv):
+    directory = str(tmp_path / "partitioned")
+    load(directory, source_csv, partition_bytes=4096)
+    database = open_database(directory)
+    try:
+        files = database.list_files(directory)
+    finally:
+        database.close()
+    assert any(len(filename[:-len(".csv")].split("_")[1]) > 1 for filename in files)  # e.g. male_jo.csv
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_query_matches_pandas(layout_database, source_rows, query):
+    database, directory = layout_database
+    source = pd.DataFrame(source_rows)
+    want = expected(source, query)
+    for _ in range(2):  # the second run is answered from the result cache
+        got = answer(query, database.run_query(directory, query))
+        if isinstance(got, pd.DataFrame):
+            assert list(got.columns) == ['Name', 'Count']
+            got = list(got.itertuples(index=False, name=None))
+            assert got == sorted(got, key=lambda row: (row[0], -row[1]))
+            assert sorted(got) == sorted((name, count) for name, _, _, count in want)
+        else:
+            assert got == want
+
+
+# Row queries answered by csv lookups give the rows, and the text, of a pandas scan
+@pytest.mark.parametrize("layout_database", ["plain", "compressed", "clustered", "partitioned"], indirect=True)
+@pytest.mark.parametrize("query", ROW_QUERIES)
+def test_row_lookup_matches_scan(layout_database, source_rows, query):
+    database, directory = layout_database
+    row = source_rows[0]
+    query = query.format(name=row["Name"], gender=row["Gender"], prefix=row["Name"][:2])
+    database.ROW_LOOKUP_BYTES = -1
+    scanned = database.run_query(directory, query)
+    database.ROW_LOOKUP_BYTES = BabyNamesDatabase.ROW_LOOKUP_BYTES
+    database.result_cache.clear()
+    looked_up = database.run_query(directory, query)
+    assert isinstance(looked_up, RowResult) and not isinstance(scanned, RowResult)
+
+    assert len(looked_up) == len(scanned)
+    assert looked_up.zone_stats == scanned.zone_stats
+    assert looked_up.to_text(25) == scanned.to_text(25)
+    assert looked_up.to_text(len(scanned)) == scanned.to_text(len(scanned))
+    frames = [pd.concat(list(result.batches()) or [result.head(0)]).reset_index(drop=True)
+              for result in (looked_up, scanned)]
+    pd.testing.assert_frame_equal(*frames) if frames[0].ndim == 2 else pd.testing.assert_series_equal(*frames)
+    cached = database.run_query(directory, query)
+    assert isinstance(cached, RowResult) and cached.to_text(len(scanned)) == scanned.to_text(len(scanned))
+    for result in (looked_up, scanned, cached):
+        result.close()
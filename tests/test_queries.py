@@ -0,0 +1,111 @@
+import sys
+import textwrap
+import threading
+import subprocess
+
+import pytest
+
+from csv_cli import QueryResult
+from conftest import SRC_DIR
+
+
+def run(database, directory, query):
+    return database.execute_plan(directory, database.compile_query(query))
+
+def rows(result):
+    frame = result.in_memory_rows()
+    result.close()
+    return frame
+
+
+# Names no chunk holds skip every zone map block, leaving only empty partials to merge
+@pytest.mark.parametrize("query", [
+    "FIND Zzzz M 2010 CONDITION top 3",
+    "FIND Zzzz F 1990-2014 CONDITION bottom 5",
+    "FIND [Zzzz,Zzyx] M/F 2000 CONDITION top 2 ORDER desc BY Count RETURN [Name,Count]",
+])
+def test_top_n_over_fully_skipped_chunks(database, data_dir, query):
+    result = run(database, data_dir, query)
+    assert isinstance(result, QueryResult)
+    assert len(result) == 0
+    frame = rows(result)
+    assert len(frame) == 0
+
+
+# EXPLAIN ANALYZE profiles only its own plan while other threads run queries
+def test_explain_analyze_profile_is_per_query(database, data_dir):
+    stop = threading.Event()
+
+    def other_queries():
+        year = 1990
+        while not stop.is_set():
+            result = run(database, data_dir, f"FIND [a,e,j,m] F {year} CONDITION top 5")
+            result.close()
+            year = 1990 if year == 2014 else year + 1
+
+    threads = [threading.Thread(target=other_queries) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    try:
+        for year in range(1990, 2000):
+            report = database.explain(data_dir, f"FIND k M {year} CONDITION top 3", analyze=True)
+            assert report['files']
+            assert all(entry['file'].startswith('male_k') for entry in report['files'])
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+# Each result carries the zone map counts of its own scan, also when served from the
+# result cache or run alongside other queries
+def test_zone_stats_travel_with_each_result(database, data_dir):
+    queries = [f"FIND [a,k,Szzz] M/F {year} CONDITION None None" for year in range(1990, 2000)]
+    expected = {}
+    for query in queries:
+        result = run(database, data_dir, query)
+        expected[query] = dict(result.zone_stats)
+        result.close()
+        assert expected[query]['blocks']
+
+    database.result_cache.clear()
+    seen = {query: [] for query in queries}
+
+    def worker(offset):
+        for step in range(3 * len(queries)):
+            query = queries[(offset + step) % len(queries)]
+            result = run(database, data_dir, query)
+            seen[query].append(dict(result.zone_stats))
+            result.close()
+
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for query in queries:
+        assert seen[query] and all(stats == expected[query] for stats in seen[query])
+
+
+# Row lookups of a name, like sum and count, run without importing pandas or numpy
+def test_row_lookup_without_pandas(data_dir, source_rows):
+    row = source_rows[0]
+    script = textwrap.dedent("""
+        import os, sys
+        sys.path.insert(0, sys.argv[1])
+        from csv_cli import BabyNamesDatabase, RowResult
+        database = BabyNamesDatabase(os.path.join(sys.argv[2], "dummy.csv"))
+        for query in sys.argv[3:]:
+            result = database.run_query(sys.argv[2], query)
+            assert isinstance(result, RowResult), query
+            print(result.to_text(25))
+            result.close()
+        database.close()
+        print(sorted({"pandas", "numpy"} & set(sys.modules)))
+    """)
+    queries = [f"FIND {row['Name']} {row['Gender']} {row['Year']} CONDITION None None",
+               f"FIND {row['Name']} M/F 1990-2014 CONDITION None None ORDER desc BY Count RETURN [Year,Count]"]
+    output = subprocess.run([sys.executable, "-c", script, SRC_DIR, data_dir, *queries],
+                            check=True, capture_output=True, text=True).stdout
+    assert output.splitlines()[-1] == "[]"
+    assert f"{row['Name']} {row['Year']}" in " ".join(output.split())
@@ -0,0 +1,91 @@
+import os
+import sys
+import subprocess
+import textwrap
+
+import pytest
+
+from csv_cli import ChunkWriterPool
+from conftest import SRC_DIR, chunk_rows, load, open_database
+
+# Run a snippet in a fresh interpreter that ends with os._exit, as if the process crashed
+def run_crashing(code, *args):
+    script = "import os, sys\nsys.path.insert(0, sys.argv[1])\nfrom csv_cli import BabyNamesDatabase\n" + \
+        textwrap.dedent(code) + "\nos._exit(0)\n"
+    subprocess.run([sys.executable, "-c", script, SRC_DIR, *args], check=True, capture_output=True)
+
+
+def test_logged_inserts_are_replayed_after_a_crash(data_dir, source_rows):
+    existing = source_rows[0]
+    before = chunk_rows(data_dir)
+    run_crashing("""
+        database = BabyNamesDatabase(os.path.join(sys.argv[2], "dummy.csv"))
+        database.CHECKPOINT_DELAY = 3600
+        database.insert_many(sys.argv[2], [("Qqlogged", "M", 2003)] * 2 + [(sys.argv[3], sys.argv[4], int(sys.argv[5]))])
+    """, data_dir, existing["Name"], existing["Gender"], str(existing["Year"]))
+
+    # The inserts only reached the log
+    assert chunk_rows(data_dir) == before
+    assert any(filename.startswith(".wal") for filename in os.listdir(data_dir))
+
+    database = open_database(data_dir)
+    try:
+        assert database.recover(data_dir) == 2
+        assert database.run_query(data_dir, "FIND Qqlogged M 2003 CONDITION sum") == 2
+        query = f"FIND {existing['Name']} {existing['Gender']} {existing['Year']} CONDITION None None"
+        result = database.run_query(data_dir, query)
+        counts = [row.Count for batch in result.batches() for row in batch.itertuples() if row.Name == existing["Name"]]
+        result.close()
+        assert counts == [existing["Count"] + 1]
+        assert database.recover(data_dir) == 0  # the log is gone once replayed
+    finally:
+        database.close()
+    assert not any(filename.startswith(".wal") for filename in os.listdir(data_dir))
+
+
+class LoadFailure(Exception):
+    pass
+
+def test_failed_load_resumes_to_a_clean_load(tmp_path, monkeypatch, source_csv, loaded_template):
+    directory = str(tmp_path / "data")
+    flush = ChunkWriterPool.flush
+    syncs = []
+
+    def failing_flush(self, sync=False):
+        flush(self, sync)
+        if sync:
+            syncs.append(None)
+            if len(syncs) == 3:
+                raise LoadFailure()
+
+    monkeypatch.setattr(ChunkWriterPool, "flush", failing_flush)
+    with pytest.raises(LoadFailure):
+        load(directory, source_csv)
+    monkeypatch.setattr(ChunkWriterPool, "flush", flush)
+
+    # Two batches stayed loaded and the third was rolled back
+    assert len(chunk_rows(directory)) == 2000
+    load(directory, source_csv, resume=True)
+    assert chunk_rows(directory) == chunk_rows(loaded_template)
+
+
+def test_load_killed_mid_batch_resumes_to_a_clean_load(tmp_path, source_csv, loaded_template):
+    directory = str(tmp_path / "data")
+    run_crashing("""
+        from csv_cli import ChunkWriterPool
+        flush = ChunkWriterPool.flush
+        syncs = []
+        def dying_flush(self, sync=False):
+            flush(self, sync)
+            if sync:
+                syncs.append(None)
+                if len(syncs) == 4:
+                    os._exit(0)  # rows of the fourth batch are on disk, its commit is not
+        ChunkWriterPool.flush = dying_flush
+        database = BabyNamesDatabase(os.path.join(sys.argv[2], "dummy.csv"))
+        database.load_batch_data(sys.argv[2], sys.argv[3], batch_size=1000, resume=False)
+    """, directory, source_csv)
+
+    assert len(chunk_rows(directory)) > 3000  # the half-written batch, until rolled back
+    load(directory, source_csv, resume=True)
+    assert chunk_rows(directory) == chunk_rows(loaded_template)